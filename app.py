@@ -5,15 +5,20 @@ import os
 import hmac
 from apscheduler.schedulers.background import BackgroundScheduler
 import atexit
-import load_playlist
 import playlist_upload
-import pandas as pd
+import playlist_listing
+import playlist_manifest
+import playlist_format
+import playlist_compaction
+import station_scraper
 import datetime
 import spotify_playlist
+import task_store
+import job_executor
 from urllib.parse import urlencode
-from io import StringIO
 import uuid
-import threading
+import json
+import time
 
 AWS_ACCESS_KEY_ID = os.environ.get("AWS_ACCESS_KEY_ID")
 
@@ -139,73 +144,33 @@ def require_basic_auth():
         }
     )
 
-def scrape_and_upload_playlists():
-    """
-    Scrape every configured source and upload the results to S3.
-
-    A playlist is only uploaded when it actually contains tracks: an empty scrape is a
-    bug in the scraper or a retired station, and writing it produced the 877 one-byte
-    CSVs that accumulated after raddio.net became Radoxo. One failing station does not
-    abort the others.
-
-    Returns (uploaded, failures) where failures is a list of (source, reason).
-    """
-    uploaded = []
-    failures = []
-
+def my_scheduled_job(shard=None):
+    """Scheduled job to load one shard's playlists (all of them if None) without Flask context"""
     try:
-        # load_playlist() raises NoTracksFoundError on an empty scrape and only writes a
-        # file when it has tracks, so there is nothing to re-read here. Reading it back
-        # was worse than redundant: a bare open() uses the platform default encoding,
-        # which is ASCII in the container, and the Cyrillic track names blew up on it.
-        playlist_filename = load_playlist.load_playlist()
-        playlist_upload.upload_file_to_s3(
-            playlist_filename, "radio-playlists", playlist_filename.split("/")[-1]
+        results = []
+        uploaded, failures = station_scraper.scrape_and_upload_playlists(results, shard=shard)
+        slowest = sorted(results, key=lambda result: result['seconds'], reverse=True)[:3]
+        logging.info(
+            "Slowest sources: " + ', '.join(f"{r['source']} {r['seconds']}s" for r in slowest)
         )
-        uploaded.append(playlist_filename.split("/")[-1])
-    except Exception as e:
-        failures.append(("retrofm", str(e)))
-        logging.error(f"Error scraping retrofm: {e}")
-
-    current_datetime = datetime.datetime.now()
-    yesterday_date = (current_datetime - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
-
-    for station_id in load_playlist.RADOXO_STATION_IDS:
-        try:
-            playlist_df = load_playlist.get_playlist_from_radoxo(station_id, yesterday_date)
-
-            # Guard the upload itself as well, so a future scraper change that returns an
-            # empty frame instead of raising still cannot write a junk file to S3.
-            if playlist_df.empty:
-                failures.append((str(station_id), "scrape produced no tracks - not uploaded"))
-                logging.error(f"Station {station_id} produced no tracks - skipping upload")
-                continue
-
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = os.path.join(load_playlist.DATA_DIR, f"playlist_{station_id}_{timestamp}.csv")
-            playlist_df.to_csv(filename, index=False)
-            playlist_upload.upload_file_to_s3(
-                filename, "radio-playlists", filename.split("/")[-1]
-            )
-            uploaded.append(filename.split("/")[-1])
-        except Exception as e:
-            failures.append((str(station_id), str(e)))
-            logging.error(f"Error scraping station {station_id}: {e}")
-
-    return uploaded, failures
-
-def my_scheduled_job():
-    """Scheduled job to load playlists without Flask context"""
-    try:
-        uploaded, failures = scrape_and_upload_playlists()
         if failures:
             logging.error(
-                f"Scheduled playlist loading finished with {len(failures)} failure(s): {failures}"
+                f"Scheduled playlist loading (shard {shard}) finished with {len(failures)} failure(s): {failures}"
             )
-        logging.info(f"Scheduled playlist loading uploaded {len(uploaded)} playlist(s)")
+        unchanged = sum(1 for r in results if r['status'] == 'unchanged')
+        logging.info(
+            f"Scheduled playlist loading (shard {shard}) uploaded {len(uploaded)} playlist(s), {unchanged} unchanged"
+        )
     except Exception as e:
         logging.error(f"Error in scheduled playlist loading: {e}")
 
+def compaction_job():
+    """Scheduled job folding the nightly playlist files into the Parquet dataset"""
+    try:
+        playlist_compaction.compact()
+    except Exception as e:
+        logging.error(f"Error in scheduled playlist compaction: {e}")
+
 @app.route('/spotify/auth')
 def spotify_auth():
     """Initiate Spotify OAuth flow"""
@@ -309,13 +274,35 @@ def should_start_scheduler():
 scheduler = None
 if should_start_scheduler():
     scheduler = BackgroundScheduler()
-    scheduler.add_job(func=my_scheduled_job, trigger="cron", hour="23", minute="40")
+    # One job per shard of the station registry, spread across the night with jitter
+    # (see station_scraper.SCRAPE_SHARDS) instead of every station at 23:40 sharp.
+    for shard in range(station_scraper.SCRAPE_SHARDS):
+        start = station_scraper.shard_start(shard)
+        scheduler.add_job(
+            func=my_scheduled_job, args=[shard], trigger="cron", hour=start.hour, minute=start.minute,
+            jitter=station_scraper.SCRAPE_JITTER_SECONDS, id=f"scrape-shard-{shard}",
+            # A shard still running when its next start comes around is not doubled up.
+            max_instances=1, coalesce=True
+        )
+    # Well clear of the scrape, so the night's files are all uploaded first.
+    if playlist_format.pyarrow is not None:
+        scheduler.add_job(func=compaction_job, trigger="cron", hour="3", minute="15")
+    else:
+        # Loud, because the Docker image installs it: missing here means a local sync
+        # without the parquet group, or a broken image.
+        logging.warning(
+            "pyarrow is not installed - nightly playlist compaction is off "
+            "(install the parquet dependency group: uv sync --group parquet)"
+        )
     scheduler.start()
     atexit.register(lambda: scheduler.shutdown())
     logging.info("Started background scheduler in this process")
 else:
     logging.info("Skipping background scheduler in this worker")
 
+# Fail queued playlist jobs cleanly on shutdown instead of leaving them 'queued' forever.
+atexit.register(job_executor.executor.shutdown)
+
 @app.route('/')
 def index():
     """Serve the main React application"""
@@ -328,13 +315,21 @@ def spotify_page():
 
 @app.route('/load_playlist')
 def load_playlist_route():
-    uploaded, failures = scrape_and_upload_playlists()
+    results = []
+    uploaded, failures = station_scraper.scrape_and_upload_playlists(results)
+    # Identical to what is already stored (e.g. after tonight's cron run), so not
+    # uploaded: the keys of the stored files they matched.
+    unchanged = [r['key'] for r in results if r['status'] == 'unchanged']
+    failed = failures and not uploaded and not unchanged
 
     return {
-        'status': 'error' if failures and not uploaded else 'success',
+        'status': 'error' if failed else 'success',
         'uploaded': uploaded,
+        'unchanged': unchanged,
         'failures': [{'source': s, 'reason': r} for s, r in failures],
-    }, (500 if failures and not uploaded else 200)
+        # Per source, with timings (see station_scraper.scrape_and_upload_playlists)
+        'sources': results,
+    }, (500 if failed else 200)
 
 @app.route('/health')
 def health():
@@ -361,12 +356,32 @@ def list_playlists():
 
 @app.route('/api/playlists')
 def api_list_playlists():
-    """API endpoint to get list of playlist files from S3"""
+    """
+    API endpoint to get list of playlist files from S3.
+
+    'playlists' is the sorted list of playlist file keys. 'details' has station, date, track
+    count, size and ETag for each, read from the manifest in one GET (see
+    playlist_manifest), and only station and date for a listed file the manifest
+    does not have yet. It is null until the manifest has been built.
+    """
     try:
-        files = playlist_upload.list_objects_in_bucket("radio-playlists")
-        # Filter only CSV files and sort by name
-        csv_files = sorted([f for f in files if f.endswith('.csv')])
-        return {'status': 'success', 'playlists': csv_files}
+        # Playlist keys, sorted, from the cached listing (see playlist_listing)
+        keys = playlist_listing.listing.keys()
+        details = playlist_manifest.manifest.entries()
+        if details is None:
+            return {'status': 'success', 'playlists': keys, 'details': None}
+        # The manifest can lag the bucket: an upload whose manifest write was lost (see
+        # playlist_manifest.record_upload) is still listed, with what its key tells.
+        by_key = {entry['key']: entry for entry in details}
+        for key in keys:
+            if key not in by_key:
+                by_key[key] = playlist_manifest.key_entry(key)
+        details = [by_key[key] for key in sorted(by_key)]
+        return {
+            'status': 'success',
+            'playlists': [entry['key'] for entry in details],
+            'details': details
+        }
     except Exception as e:
         logging.error(f"Error listing playlists: {e}")
         return {
@@ -383,6 +398,16 @@ def create_playlist_from_file():
             return {'status': 'error', 'message': 'No file name provided'}, 400
 
         file_name = data['file_name']
+        duplicates = data.get('duplicates', 'keep')
+        if duplicates not in spotify_playlist.DUPLICATE_MODES:
+            return {
+                'status': 'error',
+                'message': f"duplicates must be one of {', '.join(spotify_playlist.DUPLICATE_MODES)}"
+            }, 400
+
+        # Sync into this existing playlist instead of creating a new one.
+        target_playlist_id = data.get('target_playlist_id') or None
+
         # Generate a task ID
         task_id = str(uuid.uuid4())
 
@@ -392,39 +417,50 @@ def create_playlist_from_file():
         if not spotify_playlist.has_cached_token(session_data):
             return SPOTIFY_AUTH_REQUIRED, 401
 
-        # Download CSV content
-        csv_content = playlist_upload.download_file_from_s3("radio-playlists", file_name)
+        # Download the file as bytes: it may be gzip-CSV or Parquet (see playlist_format)
+        csv_content = playlist_upload.download_file_from_s3("radio-playlists", file_name, decode=False)
         if not csv_content:
             return {
                 'status': 'error',
                 'message': f'Failed to download file: {file_name}'
             }, 400
 
-        # Create playlist name from file name (remove .csv extension)
-        playlist_name = file_name.rsplit('.', 1)[0]
+        # Create playlist name from file name (remove the format extension)
+        playlist_name = playlist_format.playlist_name(file_name)
+        user_key = spotify_playlist.session_user_key(session_data)
+
+        # The same request from the same user is the same job: if an earlier run was cut
+        # short (a restart, a rate limit), this one resumes from its checkpoint.
+        checkpoint_key = '|'.join(
+            ['create', user_key, file_name, duplicates, target_playlist_id or '']
+        )
 
-        # Start playlist creation in background thread
         def run_playlist_creation():
             try:
-                spotify_playlist.create_playlist_from_csv(csv_content, playlist_name, task_id, session_data)
+                spotify_playlist.create_playlist_from_csv(
+                    csv_content, playlist_name, task_id, session_data,
+                    duplicates=duplicates, target_playlist_id=target_playlist_id,
+                    checkpoint_key=checkpoint_key
+                )
             except Exception as e:
                 logging.error(f"Error in background playlist creation: {e}")
                 # Update task with error status
                 if task_id in spotify_playlist.tasks:
-                    spotify_playlist.tasks[task_id].update({
+                    spotify_playlist.tasks.update(task_id, {
                         'status': 'error',
                         'message': f'Error during playlist creation: {str(e)}'
                     })
-        
-        # Start the background thread
-        thread = threading.Thread(target=run_playlist_creation)
-        thread.daemon = True  # Allow main thread to exit even if this is still running
-        thread.start()
-        
+
+        # Queue it on the shared job pool; it reports 'queued' until a thread is free.
+        try:
+            job_executor.executor.submit(task_id, user_key, run_playlist_creation)
+        except job_executor.QueueFullError as e:
+            return {'status': 'error', 'message': f'Too many playlist jobs queued: {e}'}, 503
+
         return {
             'status': 'success',
             'task_id': task_id,
-            'message': 'Started creating playlist'
+            'message': 'Started syncing playlist' if target_playlist_id else 'Started creating playlist'
         }
             
     except Exception as e:
@@ -434,6 +470,29 @@ def create_playlist_from_file():
             'message': f'Error creating playlist: {str(e)}'
         }, 500
 
+# A progress stream re-reads its task at least this often, which bounds how late it
+# sees a job running in another worker; jobs in its own worker wake it immediately.
+PROGRESS_STREAM_POLL_SECONDS = 0.5
+# Comment lines keep idle proxies from closing the stream during a long 429 pause.
+PROGRESS_STREAM_HEARTBEAT_SECONDS = 15
+# End streams eventually so a forgotten tab cannot hold a worker thread forever;
+# EventSource reconnects by itself and picks up from the current state.
+PROGRESS_STREAM_MAX_SECONDS = 300
+
+def task_progress(task):
+    """The public view of a task record, as returned by the progress endpoints"""
+    progress = {
+        'status': task.get('status', 'processing'),
+        'progress': task.get('progress', 0),
+        'message': task.get('message', 'Processing...')
+    }
+    if 'counts' in task:
+        # Bulk jobs (/create_playlists) report counters and the failed files; each
+        # file's own progress is its task (see spotify_playlist.process_s3_playlists).
+        progress['counts'] = task['counts']
+        progress['failures'] = task.get('failures', [])
+    return progress
+
 @app.route('/playlist_progress/<task_id>')
 def playlist_progress(task_id):
     """Get the progress of a playlist creation task"""
@@ -444,11 +503,57 @@ def playlist_progress(task_id):
             'message': 'Task not found'
         }, 404
     
-    return {
-        'status': task.get('status', 'processing'),
-        'progress': task.get('progress', 0),
-        'message': task.get('message', 'Processing...')
-    }
+    return task_progress(task)
+
+@app.route('/playlist_progress/<task_id>/events')
+def playlist_progress_events(task_id):
+    """
+    Stream a task's progress as Server-Sent Events until it finishes.
+
+    Replaces polling /playlist_progress once a second: each poll was a full Basic Auth
+    request through a worker, and still saw progress up to a second late. Every event
+    carries the same JSON as /playlist_progress.
+    """
+    if not spotify_playlist.tasks.get(task_id):
+        return {
+            'status': 'error',
+            'message': 'Task not found'
+        }, 404
+
+    def generate():
+        last = None
+        last_sent = started = time.monotonic()
+        while True:
+            task = spotify_playlist.tasks.get(task_id)
+            if not task:
+                yield f"data: {json.dumps({'status': 'error', 'progress': 0, 'message': 'Task not found'})}\n\n"
+                return
+
+            progress = task_progress(task)
+            now = time.monotonic()
+            if progress != last:
+                yield f"data: {json.dumps(progress)}\n\n"
+                last, last_sent = progress, now
+            elif now - last_sent >= PROGRESS_STREAM_HEARTBEAT_SECONDS:
+                yield ": keep-alive\n\n"
+                last_sent = now
+
+            if progress['status'] in task_store.TERMINAL_STATUSES:
+                return
+            if now - started >= PROGRESS_STREAM_MAX_SECONDS:
+                return
+            spotify_playlist.tasks.wait(PROGRESS_STREAM_POLL_SECONDS)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Stop nginx-style proxies from buffering the stream into one late response.
+        'X-Accel-Buffering': 'no',
+    })
+
+@app.route('/api/jobs')
+def job_metrics():
+    """Queue depth, running jobs and wait times of this worker's job executor, and the jobs running in all workers"""
+    return job_executor.executor.metrics()
 
 @app.route('/playlist/<playlist_id>/tracks')
 def get_playlist_tracks(playlist_id):
@@ -498,7 +603,6 @@ def merge_playlists():
         if not spotify_playlist.has_cached_token(session_data):
             return SPOTIFY_AUTH_REQUIRED, 401
 
-        # Start playlist merging in background thread
         def run_merge_process():
             try:
                 spotify_playlist.merge_playlists(source_playlist_id, target_playlist_id, task_id, session_data)
@@ -506,16 +610,19 @@ def merge_playlists():
                 logging.error(f"Error in background playlist merging: {e}")
                 # Update task with error status
                 if task_id in spotify_playlist.tasks:
-                    spotify_playlist.tasks[task_id].update({
+                    spotify_playlist.tasks.update(task_id, {
                         'status': 'error',
                         'message': f'Error during playlist merging: {str(e)}'
                     })
-        
-        # Start the background thread
-        thread = threading.Thread(target=run_merge_process)
-        thread.daemon = True  # Allow main thread to exit even if this is still running
-        thread.start()
-        
+
+        # Queue it on the shared job pool; it reports 'queued' until a thread is free.
+        try:
+            job_executor.executor.submit(
+                task_id, spotify_playlist.session_user_key(session_data), run_merge_process
+            )
+        except job_executor.QueueFullError as e:
+            return {'status': 'error', 'message': f'Too many playlist jobs queued: {e}'}, 503
+
         return {
             'status': 'success',
             'task_id': task_id,
@@ -529,19 +636,60 @@ def merge_playlists():
             'message': f'Error merging playlists: {str(e)}'
         }, 500
 
-@app.route('/create_playlists')
+@app.route('/create_playlists', methods=['GET', 'POST'])
 def create_playlists():
-    """Create Spotify playlists from S3 CSV files"""
+    """
+    Create Spotify playlists from every S3 CSV file matching an optional station and
+    date filter, as one background job.
+
+    POST takes JSON {station, date, duplicates} and returns the task id of the whole
+    batch; its progress lists every file (see spotify_playlist.process_s3_playlists).
+    GET takes the same filters as query parameters and redirects to the playlists page.
+    """
+    is_api = request.method == 'POST'
     try:
-        if not spotify_playlist.has_cached_token(session):
+        params = (request.get_json(silent=True) or {}) if is_api else request.args
+        station = params.get('station') or None
+        date = params.get('date') or None
+        duplicates = params.get('duplicates', 'keep')
+        if duplicates not in spotify_playlist.DUPLICATE_MODES:
+            return {
+                'status': 'error',
+                'message': f"duplicates must be one of {', '.join(spotify_playlist.DUPLICATE_MODES)}"
+            }, 400
+
+        session_data = dict(session)
+        if not spotify_playlist.has_cached_token(session_data):
+            if is_api:
+                return SPOTIFY_AUTH_REQUIRED, 401
             flash("Connect your Spotify account first", 'error')
             return redirect(url_for('list_playlists'))
 
-        spotify_playlist.process_s3_playlists(dict(session))
+        task_id = str(uuid.uuid4())
+
+        def run_bulk_creation():
+            spotify_playlist.process_s3_playlists(
+                session_data, task_id, station=station, date=date, duplicates=duplicates
+            )
+
+        try:
+            job_executor.executor.submit(
+                task_id, spotify_playlist.session_user_key(session_data), run_bulk_creation
+            )
+        except job_executor.QueueFullError as e:
+            if is_api:
+                return {'status': 'error', 'message': f'Too many playlist jobs queued: {e}'}, 503
+            flash(f"Too many playlist jobs queued: {e}", 'error')
+            return redirect(url_for('list_playlists'))
+
+        if is_api:
+            return {'status': 'success', 'task_id': task_id, 'message': 'Started creating playlists'}
         flash("Playlists creation process started", 'success')
         return redirect(url_for('list_playlists'))
     except Exception as e:
         logging.error(f"Error in create_playlists route: {e}")
+        if is_api:
+            return {'status': 'error', 'message': f'Error creating playlists: {str(e)}'}, 500
         flash(f"Error creating playlists: {str(e)}", 'error')
         return redirect(url_for('list_playlists'))
 
@@ -575,32 +723,20 @@ def get_spotify_playlists():
 
 @app.route('/playlists/view/<path:file_name>')
 def view_playlist(file_name):
-    """View contents of a specific CSV file"""
+    """View contents of a specific playlist file (CSV, gzip-CSV or Parquet)"""
     try:
-        # Download CSV content
-        csv_content = playlist_upload.download_file_from_s3("radio-playlists", file_name)
-        if csv_content is None:
+        # Download the file as bytes; playlist_format picks the parser
+        content = playlist_upload.download_file_from_s3("radio-playlists", file_name, decode=False)
+        if content is None:
             flash(f'Failed to download file: {file_name}', 'error')
             return redirect(url_for('list_playlists'))
 
-        # A scrape that found no tracks writes a file holding nothing but a newline, and
-        # pd.read_csv raises EmptyDataError on it. Show the page with an empty state
+        # A scrape that found no tracks writes a file holding nothing but a newline.
+        # read_playlist returns an empty frame for it, so the page shows an empty state
         # rather than bouncing the user back to the list with no explanation.
-        if not csv_content.strip():
-            return render_template('view_playlist.html',
-                                   file_name=file_name,
-                                   data=[],
-                                   columns=[])
-
-        # Parse CSV content into a DataFrame
-        try:
-            df = pd.read_csv(StringIO(csv_content))
-        except pd.errors.EmptyDataError:
-            logging.warning(f"Playlist {file_name} contains no parseable CSV data")
-            return render_template('view_playlist.html',
-                                   file_name=file_name,
-                                   data=[],
-                                   columns=[])
+        df = playlist_format.read_playlist(content, file_name)
+        if df.empty:
+            logging.warning(f"Playlist {file_name} contains no tracks")
 
         # Convert DataFrame to list of dictionaries for template
         data = df.to_dict('records')
@@ -0,0 +1,261 @@
+import collections
+import logging
+import os
+import threading
+import time
+
+from task_store import tasks
+
+# Playlist jobs this worker process runs at once. Every job draws on the same Spotify
+# quota (see track_resolver.spotify_limiter), so more workers mostly means more 429s.
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+# Jobs one Spotify account may have running at once, across all worker processes (each
+# has its own queue, but the running jobs are counted in the shared task store); the
+# rest wait their turn.
+JOB_MAX_PER_USER = int(os.environ.get("JOB_MAX_PER_USER", "1"))
+# How often a job held back by the user's jobs in other workers checks for a free slot:
+# their finishing wakes nobody in this process.
+JOB_SLOT_POLL_SECONDS = 5
+# How often the tasks of queued and running jobs are re-written to the task store, so a
+# job waiting its turn, or sleeping through a Retry-After, is not mistaken for a job of
+# a dead process (see task_store.TASK_STALL_SECONDS).
+JOB_HEARTBEAT_SECONDS = 60
+# Jobs allowed to wait. Past this, submit() refuses rather than queueing work nobody
+# will still be watching by the time it starts.
+JOB_QUEUE_LIMIT = int(os.environ.get("JOB_QUEUE_LIMIT", "50"))
+
+class QueueFullError(Exception):
+    """Raised by submit() when JOB_QUEUE_LIMIT jobs are already waiting."""
+
+class JobExecutor:
+    """
+    Fixed pool of threads running background playlist jobs from a FIFO queue.
+
+    Replaces one unbounded daemon thread per request: a burst of clicks used to start
+    dozens of concurrent jobs in one worker. A queued job is visible through the task
+    store with status 'queued' until a thread picks it up, and a user already at
+    JOB_MAX_PER_USER running jobs, in this worker or any other, is skipped over rather
+    than blocking everyone else.
+    """
+    def __init__(self, workers, max_per_user, queue_limit):
+        self.workers = max(1, workers)
+        self.max_per_user = max(1, max_per_user)
+        self.queue_limit = queue_limit
+        self._cond = threading.Condition()
+        self._pending = collections.deque()
+        self._running = collections.Counter()
+        self._running_tasks = set()
+        self._threads = []
+        self._shutting_down = False
+        self._waits = collections.deque(maxlen=100)
+        self._counts = collections.Counter()
+
+    def submit(self, task_id, user_key, func, *args, **kwargs):
+        """
+        Queue func(*args, **kwargs) as the job behind `task_id`.
+
+        The job is expected to create its own task record when it starts; until then
+        the record says 'queued'. Raises QueueFullError when the queue is full and
+        RuntimeError once shutdown() has been called.
+        """
+        with self._cond:
+            if self._shutting_down:
+                raise RuntimeError("Server is shutting down - not accepting new jobs")
+            if len(self._pending) >= self.queue_limit:
+                self._counts['rejected'] += 1
+                raise QueueFullError(
+                    f"{len(self._pending)} jobs are already waiting - try again in a few minutes"
+                )
+            position = len(self._pending)
+            tasks.create(task_id, {
+                'status': 'queued',
+                'progress': 0,
+                'message': f'Queued behind {position} job(s)' if position else 'Queued...'
+            })
+            self._pending.append({
+                'task_id': task_id,
+                'user_key': user_key,
+                'call': (func, args, kwargs),
+                'queued_at': time.monotonic(),
+            })
+            self._counts['submitted'] += 1
+            self._start_threads()
+            self._cond.notify_all()
+
+    def _start_threads(self):
+        # Started on first use, not at import: under uWSGI every worker imports this
+        # module, and most of them never run a job.
+        if self._threads:
+            return
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'playlist-job-{index}', daemon=True)
+            self._threads.append(thread)
+            thread.start()
+        threading.Thread(target=self._heartbeat, name='playlist-job-heartbeat', daemon=True).start()
+
+    def _heartbeat(self):
+        # Every pool thread may be busy with a long job, so none of them can do this.
+        while True:
+            with self._cond:
+                if self._cond.wait_for(lambda: self._shutting_down, JOB_HEARTBEAT_SECONDS):
+                    return
+                running = list(self._running_tasks)
+            try:
+                # Queued jobs' records and every record a running job owns (a bulk job
+                # has one per file) live in this process's task store.
+                tasks.touch_all()
+                tasks.renew_jobs(running)
+            except Exception as e:
+                logging.error(f"Job heartbeat failed: {e}")
+
+    def _next_job(self):
+        """
+        The oldest pending job whose user is below the limit in every worker together,
+        its slot claimed in the task store and counted in _running; caller holds the
+        lock, which is let go while the slot is claimed
+        """
+        skipped = set()
+        while True:
+            job = next((
+                job for job in self._pending
+                if job['task_id'] not in skipped and self._running[job['user_key']] < self.max_per_user
+            ), None)
+            if job is None:
+                return None
+            # Taken off the queue and counted as running while it is claimed, so no other
+            # thread of this worker picks it, or a job of the same user past the limit.
+            self._pending.remove(job)
+            self._running[job['user_key']] += 1
+            # The claim is a BEGIN IMMEDIATE on the shared store, which waits on every
+            # other worker's writes; holding the lock through it would stall submit(),
+            # metrics() and every job finishing in this worker behind it.
+            self._cond.release()
+            try:
+                claimed = tasks.claim_job(job['task_id'], job['user_key'], self.max_per_user)
+            except Exception as e:
+                # The store is unusable: hold to the limit within this worker at least.
+                logging.warning(f"Cannot claim a job slot in the task store, limiting per worker: {e}")
+                claimed = True
+            finally:
+                self._cond.acquire()
+            if claimed:
+                return job
+            # The user's jobs in other workers hold the slots: back in its place in the
+            # queue, and the next job gets a turn.
+            self._release_slot(job)
+            self._requeue(job)
+            skipped.add(job['task_id'])
+
+    def _release_slot(self, job):
+        self._running[job['user_key']] -= 1
+        if not self._running[job['user_key']]:
+            del self._running[job['user_key']]
+
+    def _requeue(self, job):
+        # Jobs are queued in submit order, which queued_at records.
+        for index, queued in enumerate(self._pending):
+            if queued['queued_at'] > job['queued_at']:
+                self._pending.insert(index, job)
+                return
+        self._pending.append(job)
+
+    def _report_positions(self):
+        for position, job in enumerate(self._pending):
+            tasks.update(job['task_id'], {
+                'message': f'Queued behind {position} job(s)' if position else 'Queued - starting next'
+            })
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None and not self._shutting_down:
+                    self._cond.wait(JOB_SLOT_POLL_SECONDS if self._pending else None)
+                    job = self._next_job()
+                if job is None:
+                    # Shutting down. A job whose claim was refused while shutdown() cleared
+                    # the queue was put back after it: failed here like the others.
+                    abandoned = list(self._pending)
+                    self._pending.clear()
+                    break
+                self._running_tasks.add(job['task_id'])
+                self._waits.append(time.monotonic() - job['queued_at'])
+                self._report_positions()
+
+            func, args, kwargs = job['call']
+            outcome = 'completed'
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                outcome = 'failed'
+                logging.error(f"Background job {job['task_id']} failed: {e}")
+                tasks.update(job['task_id'], {'status': 'error', 'message': f'Job failed: {str(e)}'})
+            finally:
+                try:
+                    tasks.release_job(job['task_id'])
+                except Exception as e:
+                    # Expires with the heartbeat instead.
+                    logging.warning(f"Cannot release the job slot of {job['task_id']}: {e}")
+                with self._cond:
+                    self._running_tasks.discard(job['task_id'])
+                    self._counts[outcome] += 1
+                    self._release_slot(job)
+                    # A slot for this user may unblock a job another thread skipped.
+                    self._cond.notify_all()
+        self._abandon(abandoned)
+
+    def metrics(self):
+        """
+        Queue depth, running jobs and queue wait times for this worker process, plus the
+        jobs running in all workers together
+        """
+        try:
+            running_all, users_all = tasks.running_jobs()
+        except Exception as e:
+            logging.warning(f"Cannot count running jobs in the task store: {e}")
+            running_all = users_all = None
+        with self._cond:
+            waits = list(self._waits)
+            return {
+                'running_all_workers': running_all,
+                'running_users_all_workers': users_all,
+                'workers': self.workers,
+                'max_per_user': self.max_per_user,
+                'queue_depth': len(self._pending),
+                'queue_limit': self.queue_limit,
+                'running': sum(self._running.values()),
+                'running_users': len(self._running),
+                'wait_seconds_avg': round(sum(waits) / len(waits), 3) if waits else 0.0,
+                'wait_seconds_max': round(max(waits), 3) if waits else 0.0,
+                **{name: self._counts[name] for name in ('submitted', 'completed', 'failed', 'rejected')},
+            }
+
+    def shutdown(self, timeout=10):
+        """
+        Stop accepting jobs, fail the queued ones and give running jobs `timeout`
+        seconds to finish. Threads are daemons, so a job still running after that is
+        cut off when the process exits.
+        """
+        with self._cond:
+            self._shutting_down = True
+            abandoned = list(self._pending)
+            self._pending.clear()
+            self._cond.notify_all()
+
+        self._abandon(abandoned)
+
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+
+    @staticmethod
+    def _abandon(jobs):
+        for job in jobs:
+            tasks.update(job['task_id'], {
+                'status': 'error',
+                'message': 'Server restarted before this job started - please start it again'
+            })
+        if jobs:
+            logging.warning(f"Job executor shut down with {len(jobs)} queued job(s) abandoned")
+
+executor = JobExecutor(JOB_WORKERS, JOB_MAX_PER_USER, JOB_QUEUE_LIMIT)
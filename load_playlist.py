@@ -3,47 +3,50 @@ import pandas as pd
 import logging
 import os
 import datetime
-from bs4 import BeautifulSoup
-from latest_user_agents import get_latest_user_agents
 from zoneinfo import ZoneInfo
-import requests
+import scrape_parser
+import scrape_session
 import re
+import playlist_format
 
 aws_api_key = os.environ.get("AWS_API_KEY")
 
-# Where scraped CSVs are written before upload. /var/data only exists inside the
+# Where scraped playlists are written before upload. /var/data only exists inside the
 # container (docker-compose mounts ./data there); override for local runs and tests.
 DATA_DIR = os.environ.get("PLAYLIST_DATA_DIR", "/var/data")
 
 # The columns every scraper must return; create_playlist_from_csv depends on these names.
 PLAYLIST_COLUMNS = ["time", "artist_name", "song_name"]
 
-def get_user_agent():
-    chrome_user_agents = get_latest_user_agents()
-    user_agent = chrome_user_agents[0]
-    return user_agent
+# Selectors of the scraped pages, as (selector, attribute) fields for scrape_parser.
+RADIOTUT_ITEMS = ".b_playlist li"
+RADIOTUT_FIELDS = [(".time", None), (".artist_name", None), (".song_name", None)]
 
-def get_playlist_from_radiotut(station_id, day):
-    timezone_name = "Europe/Moscow"
-    current_datetime = datetime.datetime.now(ZoneInfo(timezone_name))
+def parse_radiotut_playlist(html, day, current_datetime=None, parser=None):
+    """
+    The tracks of a radiotut playlist page as a PLAYLIST_COLUMNS frame.
+
+    The page only shows times, so the date is `day` - 1 days before `current_datetime`
+    (now in Moscow by default). `parser` picks the scrape_parser backend.
+    """
+    current_datetime = current_datetime or datetime.datetime.now(ZoneInfo("Europe/Moscow"))
+    current_date = (current_datetime - datetime.timedelta(days=day-1)).strftime("%Y-%m-%d")
     tracks = []
+    for time, artist_name, song_name in scrape_parser.extract(html, RADIOTUT_ITEMS, RADIOTUT_FIELDS, parser):
+        if time is None or artist_name is None or song_name is None:
+            # An item missing a field means the layout changed; never guess around it.
+            raise ValueError("radiotut playlist item without time, artist or song - the page layout may have changed")
+        tracks.append({"time" : f"{current_date}T{time}:00", "artist_name": artist_name, "song_name": song_name})
+    return pd.DataFrame(tracks, columns=PLAYLIST_COLUMNS)
 
+def get_playlist_from_radiotut(station_id, day, timezone="Europe/Moscow"):
     url = f"https://radiotut.com/radio/{station_id}/playlist/{day if day != 1 else ""}/"
     logging.info(f"Fetching radiotut playlist: {url}")
 
-    response = requests.get(url, headers={"user-agent": get_user_agent()}, timeout=30)
+    # Pooled connection, cached user agent, retries on 5xx (see scrape_session)
+    response = scrape_session.get(url)
     response.raise_for_status()
-    soup = BeautifulSoup(response.text, "html.parser")
-
-    track_history_items = soup.select(".b_playlist li")
-    for track_history_item in track_history_items:
-        time = track_history_item.select(".time")[0].get_text().strip()
-        artist_name = track_history_item.select(".artist_name")[0].get_text().strip()
-        song_name = track_history_item.select(".song_name")[0].get_text().strip()
-        current_date = (current_datetime - datetime.timedelta(days=day-1)).strftime("%Y-%m-%d")
-        tracks.append({"time" : f"{current_date}T{time}:00", "artist_name": artist_name, "song_name": song_name})
-        
-    return pd.DataFrame(tracks, columns=PLAYLIST_COLUMNS)
+    return parse_radiotut_playlist(response.text, day, datetime.datetime.now(ZoneInfo(timezone)))
 
 # raddio.net rebranded to Radoxo. The old
 # /radio_stations/playlist/playlist?id=..&day=.. endpoint now 301s to the bare homepage,
@@ -51,20 +54,38 @@ def get_playlist_from_radiotut(station_id, day):
 # and its station ids are NOT the old raddio.net ids.
 RADOXO_PLAYLIST_URL = "https://radoxo.com/playlist-for-day"
 
-# Radoxo station ids to scrape nightly.
-#
-# EMPTY BY DESIGN. The previous values (75885, 309175, 294683) were raddio.net ids and do
-# not carry over: 309175 and 294683 now 404, and 75885 resolves to an unrelated Brazilian
-# station. Scraping them would collect the wrong data rather than no data.
-#
-# To repopulate, find each station on https://radoxo.com and run:
-#     uv run python -c "import load_playlist; \
-#         print(load_playlist.get_radoxo_station_id('https://radoxo.com/<country>/<slug>'))"
-RADOXO_STATION_IDS = [38225, 16134, 38234]
+# The stations scraped nightly are listed in stations.json (see station_registry). The
+# old raddio.net ids (75885, 309175, 294683) do not carry over: 309175 and 294683 now
+# 404, and 75885 resolves to an unrelated Brazilian station.
 
 class NoTracksFoundError(Exception):
     """Raised when a scrape returns a page but no tracks, so breakage is never silent."""
 
+RADOXO_ITEMS = "li.playlist-track"
+RADOXO_FIELDS = [
+    (".playlist-track__status[data-ts]", "data-ts"),
+    (".playlist-track__artist", None),
+    (".playlist-track__song", None),
+]
+
+def parse_radoxo_playlist(html, parser=None):
+    """
+    The tracks in the "main" HTML of a Radoxo day view as a PLAYLIST_COLUMNS frame.
+
+    Items missing a field are skipped. `parser` picks the scrape_parser backend.
+    """
+    tracks = []
+    for played_at, artist_name, song_name in scrape_parser.extract(html, RADOXO_ITEMS, RADOXO_FIELDS, parser):
+        if played_at is None or song_name is None or artist_name is None:
+            continue
+        played = datetime.datetime.fromtimestamp(int(played_at), ZoneInfo("Etc/UTC"))
+        tracks.append({
+            "time": played.strftime("%Y-%m-%dT%H:%M:%S"),
+            "artist_name": artist_name,
+            "song_name": song_name,
+        })
+    return pd.DataFrame(tracks, columns=PLAYLIST_COLUMNS)
+
 def get_playlist_from_radoxo(station_id, date):
     """
     Fetch one day of playlist history for a Radoxo station.
@@ -77,77 +98,53 @@ def get_playlist_from_radoxo(station_id, date):
     url = f"{RADOXO_PLAYLIST_URL}?stationId={station_id}&day={date}"
     logging.info(f"Fetching Radoxo playlist: {url}")
 
-    response = requests.get(
-        url,
-        headers={"user-agent": get_user_agent(), "x-requested-with": "XMLHttpRequest"},
-        timeout=30,
-    )
+    response = scrape_session.get(url, headers={"x-requested-with": "XMLHttpRequest"})
     # A retired station id returns 404 here; surface it instead of parsing an error page.
     response.raise_for_status()
 
-    payload = response.json()
-    soup = BeautifulSoup(payload.get("main", ""), "html.parser")
-
-    tracks = []
-    for item in soup.select("li.playlist-track"):
-        played_at = item.select_one(".playlist-track__status[data-ts]")
-        song_name = item.select_one(".playlist-track__song")
-        artist_name = item.select_one(".playlist-track__artist")
-        if not (played_at and song_name and artist_name):
-            continue
-
-        played = datetime.datetime.fromtimestamp(
-            int(played_at["data-ts"]), ZoneInfo("Etc/UTC")
-        )
-        tracks.append({
-            "time": played.strftime("%Y-%m-%dT%H:%M:%S"),
-            "artist_name": artist_name.get_text().strip(),
-            "song_name": song_name.get_text().strip(),
-        })
-
-    if not tracks:
+    tracks = parse_radoxo_playlist(response.json().get("main", ""))
+    if tracks.empty:
         raise NoTracksFoundError(
             f"Radoxo station {station_id} returned no tracks for {date}. The station id "
             f"may be retired, the date outside the ~7 day window, or the markup changed."
         )
 
     logging.info(f"Radoxo station {station_id}: {len(tracks)} tracks for {date}")
-    return pd.DataFrame(tracks, columns=PLAYLIST_COLUMNS)
+    return tracks
 
 def get_radoxo_station_id(station_page_url):
     """
     Look up a Radoxo numeric station id from its public page URL, e.g.
-    https://radoxo.com/ukraine/xit-fm. Helper for reconfiguring STATION_IDS by hand.
+    https://radoxo.com/ukraine/xit-fm. Helper for adding stations to stations.json.
     """
-    response = requests.get(station_page_url, headers={"user-agent": get_user_agent()}, timeout=30)
+    response = scrape_session.get(station_page_url)
     response.raise_for_status()
-    soup = BeautifulSoup(response.text, "html.parser")
-    day_link = soup.select_one("[data-station-id]")
-    if not day_link:
+    ids = scrape_parser.extract(response.text, "[data-station-id]", [(None, "data-station-id")])
+    if not ids:
         raise ValueError(f"No station id found on {station_page_url}")
-    return int(day_link["data-station-id"])
+    return int(ids[0][0])
 
-def load_playlist():
+def load_playlist(station_id="retrofm", timezone="Europe/Moscow"):
     """
-    Scrape retrofm and write it to DATA_DIR, returning the filename.
+    Scrape a radiotut station's yesterday and write it to DATA_DIR, returning the filename.
 
     Raises NoTracksFoundError on an empty scrape, matching get_playlist_from_radoxo, so
     no file is written and callers never upload an empty playlist.
     """
-    station_id = "retrofm"
     logging.info(f"load_playlist {datetime.datetime.now()}")
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
 
-    playlist_df = get_playlist_from_radiotut(station_id, 2)
+    playlist_df = get_playlist_from_radiotut(station_id, 2, timezone)
     if playlist_df.empty:
         raise NoTracksFoundError(
             f"radiotut station {station_id} returned no tracks - the page layout may have changed"
         )
 
-    filename = os.path.join(DATA_DIR, f"playlist_{station_id}_{timestamp}.csv")
-    # Track names are Cyrillic; never rely on the platform default encoding.
-    playlist_df.to_csv(filename, index=False, encoding="utf-8")
-    logging.info(f"retrofm: wrote {len(playlist_df)} tracks to {filename}")
+    # .csv, .csv.gz or .parquet depending on PLAYLIST_FORMAT.
+    filename = playlist_format.write_playlist(
+        playlist_df, os.path.join(DATA_DIR, f"playlist_{station_id}_{timestamp}")
+    )
+    logging.info(f"{station_id}: wrote {len(playlist_df)} tracks to {filename}")
     return filename
 
 
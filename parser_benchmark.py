@@ -0,0 +1,66 @@
+import datetime
+import json
+import sys
+import time
+from zoneinfo import ZoneInfo
+
+import load_playlist
+import scrape_parser
+
+# Radiotut pages only carry times; pin "now" so every backend dates them the same.
+_NOW = datetime.datetime(2025, 1, 2, 12, 0, tzinfo=ZoneInfo("Europe/Moscow"))
+
+# Each page is parsed repeatedly for at least this long per backend.
+MIN_SECONDS = 1.0
+
+def load_page(path):
+    """(kind, parse) for a saved page: a Radoxo day view response or a radiotut playlist page"""
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    try:
+        # A saved playlist-for-day response; its HTML is in "main".
+        main = json.loads(text)['main']
+        return 'radoxo', lambda parser: load_playlist.parse_radoxo_playlist(main, parser)
+    except (ValueError, KeyError, TypeError):
+        return 'radiotut', lambda parser: load_playlist.parse_radiotut_playlist(text, 2, _NOW, parser)
+
+def bench(parse, backend):
+    """(frame, rows per second) of parsing with `backend` for at least MIN_SECONDS"""
+    runs = 0
+    started = time.perf_counter()
+    while True:
+        frame = parse(backend)
+        runs += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= MIN_SECONDS:
+            return frame, len(frame) * runs / elapsed
+
+def main(paths):
+    """
+    Parse each saved page with every installed backend and print rows per second.
+
+    html.parser is the reference: a backend whose frame differs from its frame in any
+    way is reported as DIFFERS, and the exit status is 1.
+    """
+    backends = scrape_parser.available_backends()
+    print(f"{'page':<40} {'kind':<9} {'rows':>6} " + ' '.join(f"{name:>14}" for name in backends))
+    identical = True
+    for path in paths:
+        kind, parse = load_page(path)
+        reference, _ = bench(parse, 'html.parser')
+        cells = []
+        for backend in backends:
+            frame, rate = bench(parse, backend)
+            same = frame.equals(reference) and list(frame.columns) == list(reference.columns)
+            identical = identical and same
+            cells.append(f"{rate:>10,.0f}/s" + ('   ' if same else ' !!'))
+        print(f"{path[-40:]:<40} {kind:<9} {len(reference):>6} " + ' '.join(f"{cell:>14}" for cell in cells))
+    if not identical:
+        print("!! DIFFERS: the frame is not identical to html.parser's")
+    return 0 if identical else 1
+
+if __name__ == '__main__':
+    # uv run python parser_benchmark.py saved/radiotut.html saved/radoxo-38225.json ...
+    if len(sys.argv) < 2:
+        sys.exit("usage: parser_benchmark.py PAGE...")
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,293 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+
+# The playlist tracks page and merge_playlists downloaded whole playlists on every call,
+# thousands of tracks in pages of 100, though most playlists had not changed since the
+# last time. A snapshot_id names one version of a playlist, so a track list stored under
+# (playlist_id, snapshot_id) never goes stale: the only question is which snapshot is
+# current. Recent lists are kept in memory; every list is also written to SQLite on the
+# data volume, where the other uWSGI workers and the next restart find it.
+PLAYLIST_CACHE_PATH = os.environ.get("PLAYLIST_CACHE_PATH") or os.path.join(
+    os.environ.get("PLAYLIST_DATA_DIR", "/var/data"), "playlist_cache.sqlite3"
+)
+
+# Tracks held in memory across all cached playlists, and the size of the lists on disk.
+PLAYLIST_CACHE_MEMORY_TRACKS = int(os.environ.get("PLAYLIST_CACHE_MEMORY_TRACKS", "20000"))
+PLAYLIST_CACHE_MAX_BYTES = int(os.environ.get("PLAYLIST_CACHE_MAX_MB", "64")) * 1024 * 1024
+
+# How long the snapshot_id a user was shown for a playlist (in their playlists listing,
+# or when they fetched its tracks) is trusted without asking Spotify. Our own writes
+# forget it at once (see invalidate); this only bounds edits made elsewhere, e.g. in the
+# Spotify app.
+PLAYLIST_SNAPSHOT_TTL = int(os.environ.get("PLAYLIST_SNAPSHOT_TTL_SECONDS", "300"))
+
+# Run eviction every this many stores rather than on every write.
+_EVICT_EVERY = 20
+
+_lock = threading.Lock()
+_ready = False
+_disabled = False
+_stores_since_evict = 0
+_counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'invalidated': 0, 'evicted': 0}
+
+# (playlist_id, snapshot_id) -> track list, least recently used first.
+_memory = OrderedDict()
+_memory_tracks = 0
+
+def _connect():
+    return sqlite3.connect(PLAYLIST_CACHE_PATH, timeout=10)
+
+def _ensure_ready():
+    """
+    Create the schema once per process. Returns False when the cache is unusable,
+    which disables it with one warning (see track_cache).
+    """
+    global _ready, _disabled
+    if _ready:
+        return True
+    if _disabled:
+        return False
+    with _lock:
+        if _ready or _disabled:
+            return _ready
+        try:
+            os.makedirs(os.path.dirname(PLAYLIST_CACHE_PATH) or '.', exist_ok=True)
+            with closing(_connect()) as conn, conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS tracklists ("
+                    " playlist_id TEXT NOT NULL,"
+                    " snapshot_id TEXT NOT NULL,"
+                    " tracks TEXT NOT NULL,"
+                    " size INTEGER NOT NULL,"
+                    " last_used REAL NOT NULL,"
+                    " PRIMARY KEY (playlist_id, snapshot_id))"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS tracklists_last_used ON tracklists (last_used)")
+                # Snapshots are recorded per user (see session_user_key): Spotify has
+                # answered that user for that playlist, so serving them its cached
+                # tracks without a request shows them nothing they could not read.
+                # Another user must ask Spotify first - a private playlist's answer
+                # for them is an error, not a snapshot. The first version of this
+                # table was keyed by playlist alone.
+                conn.execute("DROP TABLE IF EXISTS snapshots")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS user_snapshots ("
+                    " user_key TEXT NOT NULL,"
+                    " playlist_id TEXT NOT NULL,"
+                    " snapshot_id TEXT NOT NULL,"
+                    " seen_at REAL NOT NULL,"
+                    " PRIMARY KEY (user_key, playlist_id))"
+                )
+            _ready = True
+        except Exception as e:
+            _disabled = True
+            logging.warning(f"Playlist cache disabled - cannot open {PLAYLIST_CACHE_PATH}: {e}")
+    return _ready
+
+def _count(name, n=1):
+    with _lock:
+        _counters[name] += n
+
+def _forget_in_memory(playlist_id, keep=None):
+    """Drop every version of a playlist from memory except snapshot `keep`"""
+    global _memory_tracks
+    with _lock:
+        for key in [key for key in _memory if key[0] == playlist_id and key[1] != keep]:
+            _memory_tracks -= len(_memory.pop(key))
+
+def _remember_in_memory(key, tracks):
+    global _memory_tracks
+    with _lock:
+        if key in _memory:
+            _memory_tracks -= len(_memory.pop(key))
+        if len(tracks) > PLAYLIST_CACHE_MEMORY_TRACKS:
+            return
+        _memory[key] = tracks
+        _memory_tracks += len(tracks)
+        while _memory_tracks > PLAYLIST_CACHE_MEMORY_TRACKS:
+            _, evicted = _memory.popitem(last=False)
+            _memory_tracks -= len(evicted)
+
+def remember_snapshots(user_key, snapshots):
+    """
+    Record the snapshot_id Spotify just gave the user `user_key` for playlists, from a
+    {playlist_id: snapshot_id} dict
+    """
+    if not snapshots or not _ensure_ready():
+        return
+    now = time.time()
+    try:
+        with closing(_connect()) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO user_snapshots (user_key, playlist_id, snapshot_id, seen_at) "
+                "VALUES (?, ?, ?, ?)",
+                [(user_key, playlist_id, snapshot_id, now) for playlist_id, snapshot_id in snapshots.items()]
+            )
+    except Exception as e:
+        logging.warning(f"Playlist cache could not record snapshots: {e}")
+
+def known_snapshot(user_key, playlist_id):
+    """
+    The snapshot_id the user `user_key` was given for a playlist in the last
+    PLAYLIST_SNAPSHOT_TTL seconds, or None
+    """
+    if not _ensure_ready():
+        return None
+    try:
+        with closing(_connect()) as conn:
+            row = conn.execute(
+                "SELECT snapshot_id FROM user_snapshots WHERE user_key = ? AND playlist_id = ? AND seen_at > ?",
+                (user_key, playlist_id, time.time() - PLAYLIST_SNAPSHOT_TTL)
+            ).fetchone()
+    except Exception as e:
+        logging.warning(f"Playlist cache snapshot lookup failed for {playlist_id}: {e}")
+        return None
+    return row[0] if row else None
+
+def lookup(playlist_id, snapshot_id):
+    """The track list cached for this version of a playlist (a new list), or None"""
+    key = (playlist_id, snapshot_id)
+    with _lock:
+        tracks = _memory.get(key)
+        if tracks is not None:
+            _memory.move_to_end(key)
+    if tracks is not None:
+        _count('memory_hits')
+        return list(tracks)
+
+    if not _ensure_ready():
+        _count('misses')
+        return None
+    try:
+        with closing(_connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT tracks FROM tracklists WHERE playlist_id = ? AND snapshot_id = ?", key
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE tracklists SET last_used = ? WHERE playlist_id = ? AND snapshot_id = ?",
+                    (time.time(), *key)
+                )
+        tracks = json.loads(row[0]) if row else None
+    except Exception as e:
+        logging.warning(f"Playlist cache lookup failed for {playlist_id}: {e}")
+        tracks = None
+
+    if tracks is None:
+        _count('misses')
+        return None
+    _count('disk_hits')
+    _remember_in_memory(key, tracks)
+    return list(tracks)
+
+def store(playlist_id, snapshot_id, tracks):
+    """
+    Cache the track list of this version of a playlist, replacing older versions.
+
+    Shared by every user, but only reachable through a snapshot recorded for them
+    with remember_snapshots.
+    """
+    global _stores_since_evict
+    tracks = list(tracks)
+    _forget_in_memory(playlist_id, keep=snapshot_id)
+    _remember_in_memory((playlist_id, snapshot_id), tracks)
+    if not _ensure_ready():
+        return
+
+    body = json.dumps(tracks, ensure_ascii=False)
+    now = time.time()
+    try:
+        with closing(_connect()) as conn, conn:
+            conn.execute(
+                "DELETE FROM tracklists WHERE playlist_id = ? AND snapshot_id != ?",
+                (playlist_id, snapshot_id)
+            )
+            if len(body) <= PLAYLIST_CACHE_MAX_BYTES:
+                conn.execute(
+                    "INSERT OR REPLACE INTO tracklists (playlist_id, snapshot_id, tracks, size, last_used) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (playlist_id, snapshot_id, body, len(body), now)
+                )
+    except Exception as e:
+        logging.warning(f"Playlist cache store failed for {playlist_id}: {e}")
+        return
+
+    _count('stores')
+    with _lock:
+        _stores_since_evict += 1
+        due = _stores_since_evict >= _EVICT_EVERY
+        if due:
+            _stores_since_evict = 0
+    if due:
+        evict()
+
+def invalidate(playlist_id):
+    """
+    Forget a playlist we have just written to (or deleted).
+
+    Its new snapshot_id is not known until it is read again, and the one recorded for
+    every user is now wrong. Dropping it from the shared database covers the other
+    workers too.
+    """
+    _forget_in_memory(playlist_id)
+    _count('invalidated')
+    if not _ensure_ready():
+        return
+    try:
+        with closing(_connect()) as conn, conn:
+            conn.execute("DELETE FROM user_snapshots WHERE playlist_id = ?", (playlist_id,))
+            conn.execute("DELETE FROM tracklists WHERE playlist_id = ?", (playlist_id,))
+    except Exception as e:
+        logging.warning(f"Playlist cache invalidation failed for {playlist_id}: {e}")
+
+def evict():
+    """Drop the least recently used track lists until the disk cache fits PLAYLIST_CACHE_MAX_BYTES"""
+    if not _ensure_ready():
+        return 0
+    removed = 0
+    try:
+        with closing(_connect()) as conn, conn:
+            (total,) = conn.execute("SELECT COALESCE(SUM(size), 0) FROM tracklists").fetchone()
+            for playlist_id, snapshot_id, size in conn.execute(
+                "SELECT playlist_id, snapshot_id, size FROM tracklists ORDER BY last_used"
+            ).fetchall():
+                if total <= PLAYLIST_CACHE_MAX_BYTES:
+                    break
+                conn.execute(
+                    "DELETE FROM tracklists WHERE playlist_id = ? AND snapshot_id = ?",
+                    (playlist_id, snapshot_id)
+                )
+                total -= size
+                removed += 1
+    except Exception as e:
+        logging.warning(f"Playlist cache eviction failed: {e}")
+        return 0
+
+    if removed:
+        _count('evicted', removed)
+        logging.info(f"Playlist cache evicted {removed} track lists")
+    return removed
+
+def stats():
+    """Hit/miss counters for this process, plus what is held in memory and on disk"""
+    with _lock:
+        result = dict(_counters)
+        result['memory_playlists'] = len(_memory)
+        result['memory_tracks'] = _memory_tracks
+    result['disk_playlists'] = result['disk_bytes'] = None
+    if _ensure_ready():
+        try:
+            with closing(_connect()) as conn:
+                result['disk_playlists'], result['disk_bytes'] = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM tracklists"
+                ).fetchone()
+        except Exception as e:
+            logging.warning(f"Playlist cache stats failed: {e}")
+    return result
@@ -0,0 +1,197 @@
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import pandas as pd
+from botocore.exceptions import ClientError
+
+import playlist_format
+from playlist_listing import PLAYLIST_BUCKET, PLAYLIST_KEY_PATTERN
+from playlist_upload import get_s3_client, iter_objects_in_bucket
+
+# Every night adds one small file per station, so a question about history meant
+# listing and downloading thousands of them. Compaction folds them into one Parquet
+# file per station and month under this prefix, hive-style
+# (dataset/station=<id>/month=<YYYY-MM>/part.parquet), which pyarrow.dataset and most
+# query engines read as a partitioned table. The nightly files are left where they are:
+# the playlists page and playlist builds still work from them.
+PLAYLIST_DATASET_PREFIX = os.environ.get("PLAYLIST_DATASET_PREFIX", "dataset/")
+
+# Per partition: the Parquet key, row count, min/max play time and the source files
+# folded into it. Lets a query pick its partitions without opening any of them, and
+# lets the next compaction skip files already folded in.
+DATASET_INDEX_KEY = PLAYLIST_DATASET_PREFIX + "_index.json"
+
+# Source files downloaded at once.
+COMPACTION_CONCURRENCY = 8
+
+def partition_key(station, month):
+    return f"{PLAYLIST_DATASET_PREFIX}station={station}/month={month}/part.parquet"
+
+def _require_pyarrow():
+    if playlist_format.pyarrow is None:
+        raise RuntimeError("Playlist compaction writes Parquet and needs pyarrow (uv sync --group parquet)")
+
+def read_index(bucket_name=PLAYLIST_BUCKET):
+    """(partitions by 'station/month', ETag) of the dataset index; ({}, None) before the first run"""
+    try:
+        response = get_s3_client().get_object(Bucket=bucket_name, Key=DATASET_INDEX_KEY)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return {}, None
+        raise
+    return json.loads(response['Body'].read()), response['ETag']
+
+def _get(bucket_name, key):
+    # Straight from S3, not through s3_cache: a run reads thousands of files once,
+    # which would only flush the files the web pages use out of the disk cache, and
+    # partitions are rewritten here under the same key.
+    return get_s3_client().get_object(Bucket=bucket_name, Key=key)['Body'].read()
+
+def _load_source(bucket_name, key):
+    """One nightly file as rows of the dataset: play time, station, artist, song, source key"""
+    df = playlist_format.read_playlist(_get(bucket_name, key), key)
+    if df.empty:
+        return None
+    match = PLAYLIST_KEY_PATTERN.match(key)
+    played_at = pd.to_datetime(df['time'], errors='coerce', format='ISO8601')
+    return pd.DataFrame({
+        'played_at': played_at,
+        'station': match['station'],
+        'artist_name': df['artist_name'].astype('string'),
+        'song_name': df['song_name'].astype('string'),
+        'source_key': key,
+    }).dropna(subset=['played_at'])
+
+def compact(bucket_name=PLAYLIST_BUCKET):
+    """
+    Fold every nightly playlist file not yet in the dataset into its partitions.
+
+    A partition is rewritten whole - its current Parquet plus the new rows, sorted by
+    play time with repeated rows dropped - so it stays one file that reads sequentially.
+    Returns the number of source files folded in.
+    """
+    _require_pyarrow()
+    started = time.monotonic()
+    index, etag = read_index(bucket_name)
+    done = {key for partition in index.values() for key in partition['sources']}
+    pending = [
+        key for key in iter_objects_in_bucket(bucket_name, 'playlist_')
+        if PLAYLIST_KEY_PATTERN.match(key) and key not in done
+    ]
+    if not pending:
+        logging.info("Playlist compaction: nothing new to fold in")
+        return 0
+
+    with ThreadPoolExecutor(max_workers=COMPACTION_CONCURRENCY) as pool:
+        frames = list(pool.map(lambda key: _load_source(bucket_name, key), pending))
+    loaded = [frame for frame in frames if frame is not None and not frame.empty]
+
+    partitions = {}
+    if loaded:
+        new_rows = pd.concat(loaded, ignore_index=True)
+        new_rows['month'] = new_rows['played_at'].dt.strftime('%Y-%m')
+        partitions = dict(tuple(new_rows.groupby(['station', 'month'])))
+
+    s3_client = get_s3_client()
+    for (station, month), rows in partitions.items():
+        name = f"{station}/{month}"
+        key = partition_key(station, month)
+        rows = rows.drop(columns='month')
+        # Before dropping repeats: a file whose rows were all already there is done too.
+        sources = set(index.get(name, {}).get('sources', [])) | set(rows['source_key'])
+        if name in index:
+            current = pd.read_parquet(BytesIO(_get(bucket_name, key)))
+            rows = pd.concat([current, rows], ignore_index=True)
+        rows = rows.drop_duplicates(subset=['played_at', 'artist_name', 'song_name']) \
+            .sort_values('played_at', ignore_index=True)
+
+        with tempfile.NamedTemporaryFile(suffix='.parquet') as f:
+            # pyarrow stores min/max per column and row group, so readers filtering on
+            # played_at skip row groups as well as whole partitions.
+            rows.to_parquet(f.name, index=False, compression='zstd')
+            s3_client.upload_file(
+                f.name, bucket_name, key,
+                ExtraArgs={'ContentType': playlist_format.CONTENT_TYPES['parquet']}
+            )
+        index[name] = {
+            'key': key,
+            'station': station,
+            'month': month,
+            'rows': len(rows),
+            'min_time': rows['played_at'].min().isoformat(),
+            'max_time': rows['played_at'].max().isoformat(),
+            'sources': sorted(sources),
+        }
+
+    # Files with no usable rows (empty scrapes) are recorded too, so they are not
+    # downloaded again every night.
+    empty = [key for key, frame in zip(pending, frames) if frame is None or frame.empty]
+    if empty:
+        index.setdefault('_empty', {'key': None, 'rows': 0, 'sources': []})
+        index['_empty']['sources'] = sorted(set(index['_empty']['sources']) | set(empty))
+
+    condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+    try:
+        s3_client.put_object(
+            Bucket=bucket_name, Key=DATASET_INDEX_KEY,
+            Body=json.dumps(index, indent=1, sort_keys=True).encode('utf-8'),
+            ContentType='application/json', **condition
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict', '412', '409'):
+            # Runs must not overlap (the scheduler runs this in one worker only); if two
+            # did, say so loudly rather than record partitions the other run rewrote.
+            raise RuntimeError("Another compaction updated the dataset index at the same time") from e
+        raise
+
+    logging.info(
+        f"Playlist compaction: folded {len(pending)} file(s) into {len(partitions)} partition(s) "
+        f"in {time.monotonic() - started:.1f}s"
+    )
+    return len(pending)
+
+def partitions_for(index, station=None, start=None, end=None):
+    """
+    The partitions of `index` (see read_index) that can hold plays of `station`
+    from `start` up to but excluding `end` (ISO date or date-time strings), judged by
+    their min/max play time alone.
+    """
+    selected = []
+    for name, partition in sorted(index.items()):
+        if name == '_empty':
+            continue
+        if station and partition['station'] != str(station):
+            continue
+        if start and partition['max_time'] < start:
+            continue
+        if end and partition['min_time'] >= end:
+            continue
+        selected.append(partition)
+    return selected
+
+def read_history(station=None, start=None, end=None, bucket_name=PLAYLIST_BUCKET):
+    """Plays of `station` from `start` up to `end`, read from the compacted dataset"""
+    _require_pyarrow()
+    index, _ = read_index(bucket_name)
+    frames = []
+    for partition in partitions_for(index, station, start, end):
+        frames.append(pd.read_parquet(BytesIO(_get(bucket_name, partition['key']))))
+    if not frames:
+        return pd.DataFrame(columns=['played_at', 'station', 'artist_name', 'song_name', 'source_key'])
+    history = pd.concat(frames, ignore_index=True)
+    if start:
+        history = history[history['played_at'] >= pd.Timestamp(start)]
+    if end:
+        history = history[history['played_at'] < pd.Timestamp(end)]
+    return history.reset_index(drop=True)
+
+if __name__ == '__main__':
+    # uv run python playlist_compaction.py [bucket]
+    logging.basicConfig(level=logging.INFO)
+    print(f"{compact(sys.argv[1] if len(sys.argv) > 1 else PLAYLIST_BUCKET)} file(s) compacted")
@@ -0,0 +1,114 @@
+import gzip
+import hashlib
+import logging
+import os
+from io import BytesIO
+
+import pandas as pd
+
+# Parquet needs pyarrow, from the optional 'parquet' dependency group (uv sync --group
+# parquet). The Docker image installs it.
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# How scrapes are written. Plain CSV stays the default so files keep opening in
+# anything; csv.gz is several times smaller for the same pandas code, and Parquet is
+# smaller still and parses fastest. Reading handles all three whatever this says.
+PLAYLIST_FORMAT = os.environ.get("PLAYLIST_FORMAT", "csv").strip().lower()
+if PLAYLIST_FORMAT == 'parquet' and pyarrow is None:
+    # Refused at startup rather than quietly writing another format: a night of
+    # scrapes in csv.gz is only noticed when something downstream expects Parquet.
+    raise RuntimeError(
+        "PLAYLIST_FORMAT=parquet needs pyarrow, which is not installed. Install the "
+        "parquet dependency group (uv sync --group parquet) or choose csv or csv.gz."
+    )
+
+# Longest suffix first, so ".csv.gz" is not taken for ".gz".
+EXTENSIONS = {'csv.gz': '.csv.gz', 'parquet': '.parquet', 'csv': '.csv'}
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'csv.gz': 'application/gzip',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+_GZIP_MAGIC = b'\x1f\x8b'
+_PARQUET_MAGIC = b'PAR1'
+
+def write_format():
+    """The format new scrapes are written in: PLAYLIST_FORMAT if it can be written"""
+    if PLAYLIST_FORMAT not in EXTENSIONS:
+        logging.warning(f"Unknown PLAYLIST_FORMAT {PLAYLIST_FORMAT!r} - writing csv")
+        return 'csv'
+    return PLAYLIST_FORMAT
+
+def format_of(key):
+    """The format a key's extension names, or None for anything else"""
+    for name, extension in EXTENSIONS.items():
+        if key.endswith(extension):
+            return name
+    return None
+
+def playlist_name(key):
+    """A key without its format extension, which is what playlists are named after"""
+    name = format_of(key)
+    return key[:-len(EXTENSIONS[name])] if name else key.rsplit('.', 1)[0]
+
+def content_type(key):
+    return CONTENT_TYPES.get(format_of(key), 'application/octet-stream')
+
+def write_playlist(df, path_without_extension, fmt=None):
+    """Write a scraped playlist, returning the file name with its extension added"""
+    fmt = fmt or write_format()
+    filename = path_without_extension + EXTENSIONS[fmt]
+    if fmt == 'parquet':
+        df.to_parquet(filename, index=False)
+    elif fmt == 'csv.gz':
+        # mtime=0 keeps the output byte-identical for identical playlists.
+        df.to_csv(filename, index=False, encoding="utf-8", compression={'method': 'gzip', 'mtime': 0})
+    else:
+        # Track names are Cyrillic; never rely on the platform default encoding.
+        df.to_csv(filename, index=False, encoding="utf-8")
+    return filename
+
+def content_hash(df):
+    """
+    sha256 (hex) of a playlist's rows, whatever format it is stored in: the same
+    tracks give the same hash as .csv, .csv.gz or .parquet.
+    """
+    return hashlib.sha256(df.to_csv(index=False).encode('utf-8')).hexdigest()
+
+def read_playlist(content, key=None):
+    """
+    Parse a playlist file into a DataFrame.
+
+    `content` is the file as bytes (or an already decoded CSV str). The format comes
+    from the key's extension when there is one, otherwise from the content itself, so
+    old .csv keys and bodies passed around without their key both work. A file with
+    no data (the one-byte files of empty scrapes) gives an empty DataFrame.
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    fmt = format_of(key) if key else None
+    if fmt is None:
+        if content.startswith(_PARQUET_MAGIC):
+            fmt = 'parquet'
+        elif content.startswith(_GZIP_MAGIC):
+            fmt = 'csv.gz'
+        else:
+            fmt = 'csv'
+
+    if fmt == 'parquet':
+        if pyarrow is None:
+            raise RuntimeError("Reading Parquet playlists needs pyarrow, which is not installed")
+        return pd.read_parquet(BytesIO(content))
+    if fmt == 'csv.gz':
+        content = gzip.decompress(content)
+    if not content.strip():
+        return pd.DataFrame()
+    try:
+        return pd.read_csv(BytesIO(content), encoding='utf-8')
+    except pd.errors.EmptyDataError:
+        return pd.DataFrame()
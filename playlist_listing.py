@@ -0,0 +1,141 @@
+import bisect
+import logging
+import os
+import re
+import threading
+import time
+
+from playlist_upload import iter_objects_in_bucket
+
+PLAYLIST_BUCKET = "radio-playlists"
+
+# Keys written by the scraper: playlist_<station>_<YYYYMMDD>_<HHMMSS>.<csv|csv.gz|parquet>
+# The bucket also holds files that are not playlists in a playlist format - the
+# manifest, and the compacted dataset's Parquet partitions under "dataset/" (see
+# playlist_compaction) - so a key is a playlist only if it matches this, top level.
+PLAYLIST_KEY_PATTERN = re.compile(
+    r'^playlist_(?P<station>[^/]+)_(?P<date>\d{8})_\d{6}\.(?:csv|csv\.gz|parquet)$'
+)
+
+# How long a listing is served before it is refreshed from the manifest, and how often
+# the whole bucket is listed again to pick up deletions and uploads the manifest missed
+# (and to drop deleted files from the manifest, see playlist_manifest.prune).
+PLAYLIST_LISTING_TTL = int(os.environ.get("PLAYLIST_LISTING_TTL_SECONDS", "60"))
+PLAYLIST_LISTING_FULL_REFRESH = int(os.environ.get("PLAYLIST_LISTING_FULL_REFRESH_SECONDS", "3600"))
+
+def is_playlist_key(key):
+    return PLAYLIST_KEY_PATTERN.match(key) is not None
+
+def station_prefix(key):
+    """The key prefix shared by one station's files ("playlist_<station>_"), or None"""
+    match = PLAYLIST_KEY_PATTERN.match(key)
+    return f"playlist_{match['station']}_" if match else None
+
+class PlaylistListing:
+    """
+    In-process cache of the playlist file keys in a bucket, kept sorted.
+
+    /api/playlists used to page through the whole bucket on every page load, a cost
+    that grows with every nightly scrape. Here a full listing is taken once; after
+    that, once the cache is older than PLAYLIST_LISTING_TTL, new keys are taken from
+    the playlist manifest, which every upload - from any process - adds itself to and
+    which costs one conditional GET (a bodiless 304 when nothing changed). Listing per
+    station prefix instead took a request per station, hundreds of them.
+
+    Refreshes after the first run on a background thread: callers get the cached keys
+    at once and never wait on S3 behind one another.
+    """
+    def __init__(self, bucket_name):
+        self.bucket_name = bucket_name
+        self._lock = threading.Lock()
+        self._keys = []
+        self._key_set = set()
+        self._added = []  # keys add()ed while a full listing is in flight
+        self._refreshing = False
+        self._refreshed_at = 0.0
+        self._fully_listed_at = 0.0
+
+    def keys(self):
+        """Every playlist file key, sorted. Starts a refresh if the cache is stale"""
+        with self._lock:
+            if not self._fully_listed_at:
+                # Nothing to serve yet, so this one call waits for the listing.
+                keys = self._list_everything()
+                self._replace(keys)
+                return list(self._keys)
+            now = time.monotonic()
+            if not self._refreshing and now - self._refreshed_at >= PLAYLIST_LISTING_TTL:
+                self._refreshing = True
+                full = now - self._fully_listed_at >= PLAYLIST_LISTING_FULL_REFRESH
+                if full:
+                    self._added = []
+                threading.Thread(
+                    target=self._refresh, args=(full,), name='playlist-listing-refresh', daemon=True
+                ).start()
+            return list(self._keys)
+
+    def add(self, key):
+        """Record a key this process has just uploaded, so it shows up at once"""
+        if not is_playlist_key(key):
+            return
+        with self._lock:
+            self._insert(key)
+            self._added.append(key)
+
+    def _insert(self, key):
+        if key in self._key_set:
+            return
+        bisect.insort(self._keys, key)
+        self._key_set.add(key)
+
+    def _replace(self, keys):
+        # Uploads recorded while the listing was paged through may have been missed by it.
+        keys = set(keys) | set(self._added)
+        self._added = []
+        self._keys = sorted(keys)
+        self._key_set = keys
+        self._refreshed_at = self._fully_listed_at = time.monotonic()
+
+    def _refresh(self, full):
+        try:
+            if full:
+                keys = self._list_everything()
+                with self._lock:
+                    self._replace(keys)
+                # Imported here: playlist_manifest builds on this module.
+                import playlist_manifest
+                # The listing has just dropped deleted files; their manifest entries
+                # would otherwise stay in /api/playlists until someone ran a rebuild.
+                playlist_manifest.prune(self.bucket_name, set(keys))
+            else:
+                keys = self._manifest_keys()
+                with self._lock:
+                    added = len(self._keys)
+                    for key in keys:
+                        self._insert(key)
+                    added = len(self._keys) - added
+                if added:
+                    logging.info(f"Playlist listing picked up {added} new key(s) from the manifest")
+        except Exception as e:
+            # S3 hiccup: the cached listing is still the best answer there is.
+            logging.error(f"Error refreshing playlist listing, serving the cached one: {e}")
+        finally:
+            with self._lock:
+                # Failed refreshes wait a TTL too, rather than being retried on every call.
+                self._refreshed_at = time.monotonic()
+                self._refreshing = False
+
+    def _list_everything(self):
+        started = time.monotonic()
+        keys = [key for key in iter_objects_in_bucket(self.bucket_name) if is_playlist_key(key)]
+        logging.info(
+            f"Listed {len(keys)} playlists in {self.bucket_name} in {time.monotonic() - started:.2f}s"
+        )
+        return keys
+
+    def _manifest_keys(self):
+        import playlist_manifest
+        entries = playlist_manifest.manifest.entries() or []
+        return [entry['key'] for entry in entries if is_playlist_key(entry['key'])]
+
+listing = PlaylistListing(PLAYLIST_BUCKET)
@@ -0,0 +1,286 @@
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+
+from playlist_format import content_hash, read_playlist
+from playlist_listing import PLAYLIST_BUCKET, PLAYLIST_KEY_PATTERN, PLAYLIST_LISTING_TTL, is_playlist_key
+from playlist_upload import get_s3_client, iter_objects_in_bucket
+
+# One JSON object per playlist file, sorted by key: what /api/playlists serves, so the
+# page can show station, date and track count without downloading every file. Its
+# extension is not a playlist format, so nothing that lists playlists mistakes it for one.
+PLAYLIST_MANIFEST_KEY = os.environ.get("PLAYLIST_MANIFEST_KEY", "manifest/playlists.jsonl")
+
+# Concurrent writers (two workers uploading, a rebuild) are serialised with conditional
+# PUTs; one that loses the race re-reads the manifest and tries again this many times,
+# after a random wait of up to MANIFEST_RETRY_BASE_SECONDS * 2**attempt (capped at
+# MANIFEST_RETRY_MAX_SECONDS). A fixed wait had racing writers collide again in step.
+MANIFEST_WRITE_RETRIES = 10
+MANIFEST_RETRY_BASE_SECONDS = 0.2
+MANIFEST_RETRY_MAX_SECONDS = 5.0
+
+# Files downloaded at once by rebuild().
+MANIFEST_REBUILD_CONCURRENCY = 8
+
+_CONFLICT_CODES = ('PreconditionFailed', 'ConditionalRequestConflict', '412', '409')
+
+def key_entry(key):
+    """
+    An entry with only what the key itself tells: station and date. Stands in for a
+    file listed in the bucket that the manifest does not have (yet).
+    """
+    match = PLAYLIST_KEY_PATTERN.match(key)
+    return {
+        'key': key,
+        'station': match['station'] if match else None,
+        'date': f"{match['date'][:4]}-{match['date'][4:6]}-{match['date'][6:]}" if match else None,
+        'track_count': None,
+        'size': None,
+        'etag': None,
+    }
+
+def describe_playlist(key, body, etag):
+    """The manifest entry for the playlist file `key`, whose content is `body` (bytes)"""
+    try:
+        df = read_playlist(body, key)
+        track_count, sha256 = len(df), content_hash(df)
+    except Exception as e:
+        logging.warning(f"Cannot count tracks in {key}: {e}")
+        track_count = sha256 = None
+    return {
+        **key_entry(key),
+        'track_count': track_count,
+        'size': len(body),
+        'etag': etag,
+        # Of the rows, not the bytes (see playlist_format.content_hash); lets the
+        # scraper recognise a repeat scrape without downloading anything.
+        'sha256': sha256,
+    }
+
+def _read(bucket_name):
+    """(entries by key, ETag) of the manifest; ({}, None) when there is none yet"""
+    try:
+        response = get_s3_client().get_object(Bucket=bucket_name, Key=PLAYLIST_MANIFEST_KEY)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return {}, None
+        raise
+    return _parse(response['Body'].read()), response['ETag']
+
+def _parse(body):
+    entries = {}
+    for line in body.decode('utf-8').splitlines():
+        if line.strip():
+            entry = json.loads(line)
+            entries[entry['key']] = entry
+    return entries
+
+def _write(bucket_name, entries, etag):
+    """
+    Store the manifest if it is still at `etag` (None: if it still does not exist).
+    Returns False when another writer got there first.
+    """
+    body = ''.join(json.dumps(entries[key], ensure_ascii=False) + '\n' for key in sorted(entries))
+    condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+    try:
+        get_s3_client().put_object(
+            Bucket=bucket_name, Key=PLAYLIST_MANIFEST_KEY, Body=body.encode('utf-8'),
+            ContentType='application/x-ndjson', **condition
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] in _CONFLICT_CODES:
+            return False
+        raise
+    return True
+
+def update_entries(bucket_name, entries):
+    """Add or replace `entries` in the manifest, retrying if another writer races us"""
+    _change(bucket_name, lambda current: current.update({entry['key']: entry for entry in entries}))
+
+def remove_entries(bucket_name, keys):
+    """Drop the entries of `keys` from the manifest, retrying like update_entries"""
+    def remove(current):
+        for key in keys:
+            current.pop(key, None)
+    _change(bucket_name, remove)
+
+def _change(bucket_name, change):
+    # change(entries) edits the entries read in place; re-run on every retry.
+    for attempt in range(MANIFEST_WRITE_RETRIES):
+        current, etag = _read(bucket_name)
+        change(current)
+        if _write(bucket_name, current, etag):
+            manifest.invalidate()
+            return
+        time.sleep(random.uniform(0, min(MANIFEST_RETRY_MAX_SECONDS, MANIFEST_RETRY_BASE_SECONDS * 2 ** attempt)))
+    raise RuntimeError(f"Manifest {PLAYLIST_MANIFEST_KEY} kept changing - gave up after {MANIFEST_WRITE_RETRIES} attempts")
+
+def describe_upload(bucket_name, key, file_name):
+    """The manifest entry for the file just uploaded from `file_name` to `key`"""
+    with open(file_name, 'rb') as f:
+        body = f.read()
+    etag = get_s3_client().head_object(Bucket=bucket_name, Key=key)['ETag']
+    return describe_playlist(key, body, etag)
+
+def record_upload(bucket_name, key, file_name):
+    """
+    Add the file just uploaded from `file_name` to `key` to the manifest.
+
+    Never raises: the upload itself has succeeded. Until the next rebuild repairs a
+    missing entry, /api/playlists still lists the file from the bucket listing, only
+    without its details.
+    """
+    try:
+        update_entries(bucket_name, [describe_upload(bucket_name, key, file_name)])
+    except Exception as e:
+        logging.error(f"Error adding {key} to the playlist manifest: {e}")
+
+def record_uploads(bucket_name, entries):
+    """
+    Add the entries of several uploads (see describe_upload) in one manifest write.
+
+    Never raises, like record_upload.
+    """
+    if not entries:
+        return
+    try:
+        update_entries(bucket_name, entries)
+    except Exception as e:
+        logging.error(f"Error adding {len(entries)} upload(s) to the playlist manifest: {e}")
+
+def _exists(s3_client, bucket_name, key):
+    try:
+        s3_client.head_object(Bucket=bucket_name, Key=key)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        raise
+    return True
+
+def prune(bucket_name, listed_keys):
+    """
+    Drop the entries of files deleted from the bucket, given a full listing of it.
+
+    Run after every full listing (see playlist_listing), so a deleted file leaves
+    /api/playlists within PLAYLIST_LISTING_FULL_REFRESH without a rebuild. A file
+    uploaded after the listing passed its key is in the manifest but not in
+    `listed_keys`, so every candidate is checked with a HEAD before it goes;
+    deletions are rare, and so are the HEADs. Never raises, like record_upload.
+    Returns the number of entries dropped.
+    """
+    try:
+        current, _ = _read(bucket_name)
+        candidates = [key for key in current if key not in listed_keys]
+        if not candidates:
+            return 0
+        s3_client = get_s3_client()
+        gone = [key for key in candidates if not _exists(s3_client, bucket_name, key)]
+        if gone:
+            remove_entries(bucket_name, gone)
+            logging.info(f"Dropped {len(gone)} deleted playlist(s) from the manifest")
+        return len(gone)
+    except Exception as e:
+        logging.error(f"Error pruning deleted playlists from the manifest: {e}")
+        return 0
+
+def rebuild(bucket_name=PLAYLIST_BUCKET):
+    """
+    Regenerate the manifest from every playlist file in the bucket.
+
+    For existing data and to repair drift. Files whose ETag matches their current
+    entry are not downloaded again. Returns the number of entries written.
+    """
+    existing, _ = _read(bucket_name)
+    keys = [key for key in iter_objects_in_bucket(bucket_name) if is_playlist_key(key)]
+    s3_client = get_s3_client()
+
+    def describe(key):
+        # Entries from before content hashes were recorded are described again.
+        current = existing.get(key, {})
+        conditional = {'IfNoneMatch': current['etag']} if 'sha256' in current else {}
+        try:
+            response = s3_client.get_object(Bucket=bucket_name, Key=key, **conditional)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('304', 'NotModified'):
+                return existing[key]
+            raise
+        return describe_playlist(key, response['Body'].read(), response['ETag'])
+
+    with ThreadPoolExecutor(max_workers=MANIFEST_REBUILD_CONCURRENCY) as pool:
+        entries = list(pool.map(describe, keys))
+
+    # Last writer wins here: a rebuild replaces whatever is there, uploads included.
+    for attempt in range(MANIFEST_WRITE_RETRIES):
+        _, etag = _read(bucket_name)
+        if _write(bucket_name, {entry['key']: entry for entry in entries}, etag):
+            break
+    else:
+        raise RuntimeError(f"Manifest {PLAYLIST_MANIFEST_KEY} kept changing during the rebuild")
+    manifest.invalidate()
+    logging.info(f"Rebuilt playlist manifest with {len(entries)} entries")
+    return len(entries)
+
+class ManifestCache:
+    """
+    The manifest as last read by this process.
+
+    Re-checked at most every PLAYLIST_LISTING_TTL seconds with a conditional GET, which
+    costs a 304 and no body when nothing has been uploaded since.
+    """
+    def __init__(self, bucket_name):
+        self.bucket_name = bucket_name
+        self._lock = threading.Lock()
+        self._entries = None
+        self._etag = None
+        self._checked_at = 0.0
+
+    def entries(self):
+        """Manifest entries sorted by key, or None when the bucket has no manifest"""
+        with self._lock:
+            if time.monotonic() - self._checked_at >= PLAYLIST_LISTING_TTL:
+                self._refresh()
+            return None if self._entries is None else list(self._entries)
+
+    def invalidate(self):
+        with self._lock:
+            self._checked_at = 0.0
+
+    def _refresh(self):
+        params = {'IfNoneMatch': self._etag} if self._etag else {}
+        try:
+            response = get_s3_client().get_object(
+                Bucket=self.bucket_name, Key=PLAYLIST_MANIFEST_KEY, **params
+            )
+        except ClientError as e:
+            code = e.response['Error']['Code']
+            if code in ('304', 'NotModified'):
+                self._checked_at = time.monotonic()
+                return
+            if code in ('NoSuchKey', '404'):
+                self._entries, self._etag = None, None
+                self._checked_at = time.monotonic()
+                return
+            if self._entries is None:
+                raise
+            logging.error(f"Error refreshing the playlist manifest, serving the cached one: {e}")
+            self._checked_at = time.monotonic()
+            return
+        entries = _parse(response['Body'].read())
+        self._entries = [entries[key] for key in sorted(entries)]
+        self._etag = response['ETag']
+        self._checked_at = time.monotonic()
+
+manifest = ManifestCache(PLAYLIST_BUCKET)
+
+if __name__ == '__main__':
+    # uv run python playlist_manifest.py rebuild [bucket]
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2 or sys.argv[1] != 'rebuild':
+        sys.exit("usage: python playlist_manifest.py rebuild [bucket]")
+    print(f"{rebuild(sys.argv[2] if len(sys.argv) > 2 else PLAYLIST_BUCKET)} playlists in the manifest")
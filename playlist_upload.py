@@ -1,68 +1,135 @@
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 import logging
 import os
+import threading
+import s3_cache
 
 AWS_ACCESS_KEY_ID = os.environ.get("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.environ.get("AWS_SECRET_ACCESS_KEY")
 AWS_REGION = os.environ.get("AWS_REGION")
 
+# Connections the shared S3 client keeps open. botocore's default of 10 is below what
+# the bulk playlist job (download prefetch plus concurrent builds) and the web threads
+# can have in flight at once.
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get("S3_MAX_POOL_CONNECTIONS", "20"))
+S3_TCP_KEEPALIVE = os.environ.get("S3_TCP_KEEPALIVE", "true").strip().lower() in (
+    "1", "true", "yes", "on"
+)
+
+_s3_client = None
+_s3_client_pid = None
+_s3_client_lock = threading.Lock()
+
+def get_s3_client():
+    """
+    The process's shared S3 client, created on first use.
+
+    Building a client per call resolved credentials, loaded the endpoint rules and
+    opened a new connection pool every time. boto3 clients are thread-safe once built;
+    the lock only guards building it. A forked child builds its own rather than sharing
+    its parent's sockets.
+    """
+    global _s3_client, _s3_client_pid
+    if _s3_client is not None and _s3_client_pid == os.getpid():
+        return _s3_client
+    with _s3_client_lock:
+        if _s3_client is None or _s3_client_pid != os.getpid():
+            # A Session of our own: boto3's default session is not safe to share
+            # between threads while it builds clients.
+            _s3_client = boto3.session.Session().client(
+                "s3",
+                aws_access_key_id=AWS_ACCESS_KEY_ID,
+                aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+                region_name=AWS_REGION,
+                config=Config(
+                    max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                    tcp_keepalive=S3_TCP_KEEPALIVE,
+                ),
+            )
+            _s3_client_pid = os.getpid()
+        return _s3_client
+
+def iter_objects_in_bucket(bucket_name, prefix=''):
+    """
+    Yield the keys in an S3 bucket under `prefix`, one listing page at a time.
+
+    Unlike list_objects_in_bucket this raises on errors, and callers can start on the
+    first keys while later pages are still being fetched.
+    """
+    s3_client = get_s3_client()
+
+    # list_objects_v2 returns at most 1000 keys per response and signals the rest
+    # with a continuation token, so page through them instead of returning only
+    # the first page.
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            yield obj['Key']
+
 def list_objects_in_bucket(bucket_name):
     """List all objects in an S3 bucket"""
     try:
-        s3_client = boto3.client(
-            "s3",
-            aws_access_key_id=AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-            region_name=AWS_REGION,
-        )
-        
-        # list_objects_v2 returns at most 1000 keys per response and signals the rest
-        # with a continuation token, so page through them instead of returning only
-        # the first page.
-        keys = []
-        paginator = s3_client.get_paginator('list_objects_v2')
-        for page in paginator.paginate(Bucket=bucket_name):
-            keys.extend(obj['Key'] for obj in page.get('Contents', []))
-        return keys
+        return list(iter_objects_in_bucket(bucket_name))
     except Exception as e:
         logging.error(f"Error listing objects in bucket {bucket_name}: {e}")
         return []
 
-def download_file_from_s3(bucket_name, object_name):
-    """Download an object from S3 bucket and return its contents as a string"""
+def download_bytes_from_s3(bucket_name, object_name):
+    """
+    An object's body as bytes, read through the local disk cache (see s3_cache).
+
+    A copy confirmed recently is returned without any request; an older one costs a
+    conditional GET that S3 answers with a bodiless 304 while it is still current.
+    Raises on errors.
+    """
+    cached = s3_cache.lookup(bucket_name, object_name)
+    if cached and cached[2]:
+        return cached[1]
+
+    conditional = {'IfNoneMatch': cached[0]} if cached else {}
+    try:
+        response = get_s3_client().get_object(Bucket=bucket_name, Key=object_name, **conditional)
+    except ClientError as e:
+        if cached and e.response['Error']['Code'] in ('304', 'NotModified'):
+            s3_cache.mark_checked(bucket_name, object_name)
+            return cached[1]
+        raise
+    body = response['Body'].read()
+    s3_cache.store(bucket_name, object_name, response['ETag'], body)
+    return body
+
+def download_file_from_s3(bucket_name, object_name, decode=True):
+    """
+    Download an object from S3 bucket and return its contents as a string, or as
+    bytes with decode=False (compressed and Parquet playlists)
+    """
     try:
-        s3_client = boto3.client(
-            "s3",
-            aws_access_key_id=AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-            region_name=AWS_REGION,
-        )
-        
-        response = s3_client.get_object(Bucket=bucket_name, Key=object_name)
-        file_content = response['Body'].read().decode('utf-8')
-        return file_content
+        body = download_bytes_from_s3(bucket_name, object_name)
+        return body.decode('utf-8') if decode else body
     except Exception as e:
         logging.error(f"Error downloading {object_name} from {bucket_name}: {e}")
         return None
 
-def upload_file_to_s3(file_name, bucket, object_name):
-    """Upload a file to an S3 bucket"""
+def upload_file_to_s3(file_name, bucket, object_name, content_type=None, metadata=None):
+    """Upload a file to an S3 bucket, returning whether it was stored"""
 
     try:
-        # Create an S3 client with explicit credentials
-        s3_client = boto3.client(
-            "s3",
-            aws_access_key_id=AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-            region_name=AWS_REGION,
-        )
+        s3_client = get_s3_client()
 
-        upload_response = s3_client.upload_file(file_name, bucket, object_name)
+        extra_args = {}
+        if content_type:
+            extra_args['ContentType'] = content_type
+        if metadata:
+            extra_args['Metadata'] = metadata
+        upload_response = s3_client.upload_file(file_name, bucket, object_name, ExtraArgs=extra_args or None)
 
         logging.info(f"Object '{object_name}' successfully created in bucket '{bucket}'.")
+        return True
 
     except ClientError as e:
         logging.info(f"Error creating object: {e}")
     except Exception as e:
-        logging.info(f"An unexpected error occurred: {e}")
\ No newline at end of file
+        logging.info(f"An unexpected error occurred: {e}")
+    return False
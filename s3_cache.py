@@ -0,0 +1,216 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+# Scraped playlists are written once and never change, yet every view and every
+# playlist build downloaded the whole object again. Keep the bodies on the data volume,
+# shared by every uWSGI worker, with a SQLite index of which ETag each key was at.
+S3_CACHE_DIR = os.environ.get("S3_CACHE_DIR") or os.path.join(
+    os.environ.get("PLAYLIST_DATA_DIR", "/var/data"), "s3_cache"
+)
+S3_CACHE_MAX_BYTES = int(os.environ.get("S3_CACHE_MAX_MB", "256")) * 1024 * 1024
+
+# A cached body younger than this is served without asking S3 at all; an older one is
+# revalidated with a conditional GET, which costs a 304 and no body while it is current.
+S3_CACHE_REVALIDATE_SECONDS = int(os.environ.get("S3_CACHE_REVALIDATE_SECONDS", "3600"))
+
+# Run eviction every this many stores rather than on every write.
+_EVICT_EVERY = 20
+
+_lock = threading.Lock()
+_ready = False
+_disabled = False
+_stores_since_evict = 0
+_counters = {'hits': 0, 'revalidated': 0, 'misses': 0, 'stores': 0, 'evicted': 0}
+
+def _connect():
+    return sqlite3.connect(os.path.join(S3_CACHE_DIR, "index.sqlite3"), timeout=10)
+
+def _body_path(bucket_name, key, etag):
+    # Content-addressed by key and ETag: a new version of an object gets a new file,
+    # so a reader in another process never sees one being rewritten under it.
+    digest = hashlib.sha256(f"{bucket_name}\0{key}\0{etag}".encode('utf-8')).hexdigest()
+    return os.path.join(S3_CACHE_DIR, digest[:2], digest)
+
+def _ensure_ready():
+    """
+    Create the cache directory and index once per process. Returns False when the
+    cache is unusable, which disables it with one warning (see track_cache).
+    """
+    global _ready, _disabled
+    if _ready:
+        return True
+    if _disabled:
+        return False
+    with _lock:
+        if _ready or _disabled:
+            return _ready
+        try:
+            os.makedirs(S3_CACHE_DIR, exist_ok=True)
+            with closing(_connect()) as conn, conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS objects ("
+                    " bucket TEXT NOT NULL,"
+                    " key TEXT NOT NULL,"
+                    " etag TEXT NOT NULL,"
+                    " size INTEGER NOT NULL,"
+                    " checked_at REAL NOT NULL,"
+                    " last_used REAL NOT NULL,"
+                    " PRIMARY KEY (bucket, key))"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS objects_last_used ON objects (last_used)")
+            _ready = True
+        except Exception as e:
+            _disabled = True
+            logging.warning(f"S3 download cache disabled - cannot open {S3_CACHE_DIR}: {e}")
+    return _ready
+
+def _count(name, n=1):
+    with _lock:
+        _counters[name] += n
+
+def lookup(bucket_name, key):
+    """
+    The cached copy of an object as (etag, body, fresh), or None.
+
+    `fresh` means it was confirmed current less than S3_CACHE_REVALIDATE_SECONDS ago
+    and can be used as is; otherwise revalidate it against `etag` first.
+    """
+    if not _ensure_ready():
+        return None
+    now = time.time()
+    try:
+        with closing(_connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT etag, checked_at FROM objects WHERE bucket = ? AND key = ?",
+                (bucket_name, key)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE objects SET last_used = ? WHERE bucket = ? AND key = ?",
+                    (now, bucket_name, key)
+                )
+        if row is None:
+            _count('misses')
+            return None
+        with open(_body_path(bucket_name, key, row[0]), 'rb') as f:
+            body = f.read()
+    except Exception as e:
+        # Includes a body evicted by another worker since the row was read.
+        logging.debug(f"S3 cache lookup failed for {key}: {e}")
+        _count('misses')
+        return None
+
+    fresh = now - row[1] < S3_CACHE_REVALIDATE_SECONDS
+    if fresh:
+        _count('hits')
+    return row[0], body, fresh
+
+def mark_checked(bucket_name, key):
+    """Record that S3 confirmed the cached copy is current (a 304)"""
+    if not _ensure_ready():
+        return
+    _count('revalidated')
+    try:
+        with closing(_connect()) as conn, conn:
+            conn.execute(
+                "UPDATE objects SET checked_at = ? WHERE bucket = ? AND key = ?",
+                (time.time(), bucket_name, key)
+            )
+    except Exception as e:
+        logging.warning(f"S3 cache update failed for {key}: {e}")
+
+def store(bucket_name, key, etag, body):
+    """Cache `body` (bytes) as the content of `key` at `etag`"""
+    global _stores_since_evict
+    if not _ensure_ready() or len(body) > S3_CACHE_MAX_BYTES:
+        return
+
+    path = _body_path(bucket_name, key, etag)
+    now = time.time()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(body)
+        os.replace(temp_path, path)
+        with closing(_connect()) as conn, conn:
+            previous = conn.execute(
+                "SELECT etag FROM objects WHERE bucket = ? AND key = ?", (bucket_name, key)
+            ).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO objects (bucket, key, etag, size, checked_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (bucket_name, key, etag, len(body), now, now)
+            )
+        if previous and previous[0] != etag:
+            _remove_body(bucket_name, key, previous[0])
+    except Exception as e:
+        logging.warning(f"S3 cache store failed for {key}: {e}")
+        return
+
+    _count('stores')
+    with _lock:
+        _stores_since_evict += 1
+        due = _stores_since_evict >= _EVICT_EVERY
+        if due:
+            _stores_since_evict = 0
+    if due:
+        evict()
+
+def _remove_body(bucket_name, key, etag):
+    try:
+        os.remove(_body_path(bucket_name, key, etag))
+    except FileNotFoundError:
+        pass
+
+def evict():
+    """Drop the least recently used objects until the cache fits in S3_CACHE_MAX_BYTES"""
+    if not _ensure_ready():
+        return 0
+    removed = []
+    try:
+        with closing(_connect()) as conn, conn:
+            (total,) = conn.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()
+            if total <= S3_CACHE_MAX_BYTES:
+                return 0
+            for bucket_name, key, etag, size in conn.execute(
+                "SELECT bucket, key, etag, size FROM objects ORDER BY last_used"
+            ).fetchall():
+                if total <= S3_CACHE_MAX_BYTES:
+                    break
+                removed.append((bucket_name, key, etag))
+                total -= size
+            conn.executemany(
+                "DELETE FROM objects WHERE bucket = ? AND key = ? AND etag = ?", removed
+            )
+        for bucket_name, key, etag in removed:
+            _remove_body(bucket_name, key, etag)
+    except Exception as e:
+        logging.warning(f"S3 cache eviction failed: {e}")
+        return 0
+
+    if removed:
+        _count('evicted', len(removed))
+        logging.info(f"S3 download cache evicted {len(removed)} objects")
+    return len(removed)
+
+def stats():
+    """Hit/miss counters for this process, plus the objects and bytes on disk"""
+    with _lock:
+        result = dict(_counters)
+    result['objects'] = result['bytes'] = None
+    if _ensure_ready():
+        try:
+            with closing(_connect()) as conn:
+                result['objects'], result['bytes'] = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM objects"
+                ).fetchone()
+        except Exception as e:
+            logging.warning(f"S3 cache stats failed: {e}")
+    return result
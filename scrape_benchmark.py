@@ -0,0 +1,139 @@
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import load_playlist
+import scrape_fixtures
+import station_scraper
+
+# Runs per measurement; the median is reported.
+RUNS = int(os.environ.get("SCRAPE_BENCHMARK_RUNS", "5"))
+
+@contextmanager
+def _timed_parsers(parse_seconds):
+    """
+    Add the time spent in the parse_* functions of load_playlist to parse_seconds[0],
+    summed over threads: in the concurrent scrape it can exceed the wall time.
+    """
+    lock = threading.Lock()
+    originals = {}
+    for name in ('parse_radiotut_playlist', 'parse_radoxo_playlist'):
+        original = originals[name] = getattr(load_playlist, name)
+        def timed(*args, original=original, **kwargs):
+            started = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                with lock:
+                    parse_seconds[0] += time.perf_counter() - started
+        setattr(load_playlist, name, timed)
+    try:
+        yield
+    finally:
+        for name, original in originals.items():
+            setattr(load_playlist, name, original)
+
+def measure(run):
+    """Median wall seconds, parse seconds and peak traced allocation (bytes) of run()"""
+    walls, parses, peaks = [], [], []
+    for _ in range(RUNS):
+        parse_seconds = [0.0]
+        with _timed_parsers(parse_seconds):
+            tracemalloc.start()
+            started = time.perf_counter()
+            try:
+                run()
+            finally:
+                walls.append(time.perf_counter() - started)
+                peaks.append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+        parses.append(parse_seconds[0])
+    # tracemalloc slows everything it traces alike, so compare runs with runs, not with
+    # production timings.
+    return statistics.median(walls), statistics.median(parses), statistics.median(peaks)
+
+@contextmanager
+def _offline_scrape():
+    """scrape_and_upload_playlists without S3, delays or the data volume"""
+    upload_playlist = station_scraper.upload_playlist
+    min_interval = station_scraper.host_limiter.min_interval
+    data_dir = load_playlist.DATA_DIR
+    with tempfile.TemporaryDirectory() as directory:
+        # Written files are kept in a temporary directory and "uploaded" nowhere; the
+        # per-host spacing is for live sites and would only measure sleep().
+        station_scraper.upload_playlist = lambda filename, manifest_entries=None: (os.path.basename(filename), 'uploaded')
+        station_scraper.host_limiter.min_interval = 0
+        load_playlist.DATA_DIR = directory
+        try:
+            yield
+        finally:
+            station_scraper.upload_playlist = upload_playlist
+            station_scraper.host_limiter.min_interval = min_interval
+            load_playlist.DATA_DIR = data_dir
+
+def main(fixture_dir):
+    """
+    Run the scrapers against the fixtures in `fixture_dir` and print, per station and
+    for the whole scrape_and_upload_playlists run: tracks, wall time, the part of it
+    spent parsing, and peak allocations. Returns the rows as dicts.
+
+    Raises FileNotFoundError when `fixture_dir` holds no recording: none is committed
+    with the code, so one has to be recorded (scrape_fixtures.py record) first.
+    """
+    if not os.path.isfile(os.path.join(fixture_dir, scrape_fixtures.INDEX_FILE)):
+        raise FileNotFoundError(
+            f"No scraper fixtures in {fixture_dir} - record them first, from a machine that "
+            f"can reach the sites: python scrape_fixtures.py record {fixture_dir}"
+        )
+    index = scrape_fixtures.read_index(fixture_dir)
+    stations = index['stations']
+    units = [
+        (str(station['id']), scrape_fixtures.scrape_function(station, index['radoxo_date']))
+        for station in stations
+    ]
+    rows = []
+    with scrape_fixtures.replay(fixture_dir):
+        for source, scrape in units:
+            tracks = len(scrape())
+            wall, parse, peak = measure(scrape)
+            rows.append({'source': source, 'tracks': tracks, 'wall_ms': wall * 1000,
+                         'parse_ms': parse * 1000, 'peak_kib': peak / 1024})
+
+        with _offline_scrape():
+            results = []
+            station_scraper.scrape_and_upload_playlists(results, stations=stations)
+            failed = [result['source'] for result in results if result['status'] == 'failed']
+            if failed:
+                raise RuntimeError(f"Scrape failed against the fixtures for: {', '.join(failed)}")
+            wall, parse, peak = measure(lambda: station_scraper.scrape_and_upload_playlists(stations=stations))
+        rows.append({'source': 'scrape_and_upload_playlists', 'tracks': sum(row['tracks'] for row in rows),
+                     'wall_ms': wall * 1000, 'parse_ms': parse * 1000, 'peak_kib': peak / 1024})
+
+    print(f"Fixtures recorded {index['recorded_at']}, median of {RUNS} runs")
+    print(f"{'source':<28} {'tracks':>7} {'wall ms':>9} {'parse ms':>9} {'peak KiB':>9}")
+    for row in rows:
+        print(f"{row['source']:<28} {row['tracks']:>7} {row['wall_ms']:>9.1f} "
+              f"{row['parse_ms']:>9.1f} {row['peak_kib']:>9.0f}")
+    return rows
+
+if __name__ == '__main__':
+    # uv run python scrape_benchmark.py [fixture_dir] [--json results.json]
+    args = sys.argv[1:]
+    output = None
+    if '--json' in args:
+        position = args.index('--json')
+        output = args[position + 1]
+        del args[position:position + 2]
+    try:
+        rows = main(args[0] if args else scrape_fixtures.SCRAPE_FIXTURE_DIR)
+    except FileNotFoundError as e:
+        sys.exit(str(e))
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, indent=1)
@@ -0,0 +1,165 @@
+import base64
+import datetime
+import hashlib
+import json
+import logging
+import os
+import sys
+from contextlib import contextmanager
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+import load_playlist
+import scrape_session
+import station_registry
+
+# Recorded responses of the scraped sites, one JSON file per URL, so the scrapers can
+# be run and timed without radiotut or Radoxo (see scrape_benchmark). Record with
+# python scrape_fixtures.py record; the sites change their markup now and then, so
+# re-record rather than edit.
+SCRAPE_FIXTURE_DIR = os.environ.get("SCRAPE_FIXTURE_DIR", "fixtures/scrape")
+
+# Query parameters left out when matching a request to a recording. The nightly job asks
+# Radoxo for yesterday, which is never the day that was recorded; the recorded day
+# stands in for any.
+REPLAY_IGNORED_PARAMS = ('day',)
+
+# Written by record(): when, and of which stations and Radoxo day, the recording is.
+INDEX_FILE = "index.json"
+
+def _fixture_path(fixture_dir, url):
+    parts = urlsplit(url)
+    query = urlencode([
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if name not in REPLAY_IGNORED_PARAMS
+    ])
+    normalized = urlunsplit((parts.scheme, parts.netloc, parts.path, query, ''))
+    return os.path.join(fixture_dir, hashlib.sha256(normalized.encode('utf-8')).hexdigest()[:16] + '.json')
+
+class RecordingAdapter(HTTPAdapter):
+    """Sends requests for real and saves each response as a fixture"""
+    def __init__(self, fixture_dir, **kwargs):
+        super().__init__(**kwargs)
+        self.fixture_dir = fixture_dir
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        os.makedirs(self.fixture_dir, exist_ok=True)
+        with open(_fixture_path(self.fixture_dir, request.url), 'w', encoding='utf-8') as f:
+            json.dump({
+                'url': request.url,
+                'status': response.status_code,
+                'reason': response.reason,
+                'headers': {'Content-Type': response.headers.get('Content-Type', '')},
+                # Bytes as received, so replay decodes them exactly as the live response.
+                'body': base64.b64encode(response.content).decode('ascii'),
+            }, f, indent=1)
+        return response
+
+class ReplayAdapter(BaseAdapter):
+    """
+    Answers requests from recorded fixtures, without touching the network.
+
+    A URL with no recording gets a 404 rather than a connection error, so it fails at
+    once instead of being retried with backoff by scrape_session.
+    """
+    def __init__(self, fixture_dir):
+        super().__init__()
+        self.fixture_dir = fixture_dir
+
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.url = request.url
+        response.request = request
+        try:
+            with open(_fixture_path(self.fixture_dir, request.url), encoding='utf-8') as f:
+                fixture = json.load(f)
+        except FileNotFoundError:
+            response.status_code = 404
+            response.reason = f"No fixture recorded in {self.fixture_dir}"
+            response._content = b''
+            return response
+        response.status_code = fixture['status']
+        response.reason = fixture['reason']
+        response.headers = CaseInsensitiveDict(fixture['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = base64.b64decode(fixture['body'])
+        return response
+
+    def close(self):
+        pass
+
+@contextmanager
+def _mounted(adapter):
+    session = scrape_session.get_session()
+    previous = {prefix: session.adapters[prefix] for prefix in ("https://", "http://")}
+    for prefix in previous:
+        session.mount(prefix, adapter)
+    try:
+        yield
+    finally:
+        for prefix, original in previous.items():
+            session.mount(prefix, original)
+
+@contextmanager
+def replay(fixture_dir=SCRAPE_FIXTURE_DIR):
+    """Serve every scraper request from the fixtures in `fixture_dir`"""
+    get_user_agent = scrape_session.get_user_agent
+    # The user agent lookup is the one request that does not go through the session.
+    scrape_session.get_user_agent = lambda: scrape_session.FALLBACK_USER_AGENT
+    try:
+        with _mounted(ReplayAdapter(fixture_dir)):
+            yield
+    finally:
+        scrape_session.get_user_agent = get_user_agent
+
+def read_index(fixture_dir=SCRAPE_FIXTURE_DIR):
+    with open(os.path.join(fixture_dir, INDEX_FILE), encoding='utf-8') as f:
+        return json.load(f)
+
+def scrape_function(station, radoxo_date):
+    """A function scraping `station` as the nightly job does, returning its frame"""
+    if station['source'] == 'radiotut':
+        return lambda: load_playlist.get_playlist_from_radiotut(station['id'], 2, station['timezone'])
+    return lambda: load_playlist.get_playlist_from_radoxo(station['id'], radoxo_date)
+
+def record(fixture_dir=SCRAPE_FIXTURE_DIR):
+    """
+    Fetch every registered station live, as the nightly job does, saving the responses.
+
+    Sources that fail are recorded as they failed (a 404 is a fixture too) and reported.
+    Returns the number of sources that parsed.
+    """
+    date = (datetime.datetime.now() - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+    os.makedirs(fixture_dir, exist_ok=True)
+    adapter = RecordingAdapter(fixture_dir, pool_connections=10, pool_maxsize=10)
+    stations = station_registry.stations()
+    scrapes = [(str(station['id']), scrape_function(station, date)) for station in stations]
+    parsed = 0
+    with _mounted(adapter):
+        for source, scrape in scrapes:
+            try:
+                logging.info(f"Recorded {source}: {len(scrape())} tracks")
+                parsed += 1
+            except Exception as e:
+                logging.error(f"Recorded {source}, which failed: {e}")
+
+    with open(os.path.join(fixture_dir, INDEX_FILE), 'w', encoding='utf-8') as f:
+        json.dump({
+            'recorded_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            'radoxo_date': date,
+            'stations': stations,
+        }, f, indent=1)
+    return parsed
+
+if __name__ == '__main__':
+    # uv run python scrape_fixtures.py record [fixture_dir]
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2 or sys.argv[1] != 'record':
+        sys.exit("usage: python scrape_fixtures.py record [fixture_dir]")
+    fixture_dir = sys.argv[2] if len(sys.argv) > 2 else SCRAPE_FIXTURE_DIR
+    print(f"{record(fixture_dir)} source(s) recorded in {fixture_dir}")
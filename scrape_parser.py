@@ -0,0 +1,144 @@
+import functools
+import logging
+import os
+import re
+
+from bs4 import BeautifulSoup
+
+# Faster HTML parsers, used when installed (neither is a dependency of this project:
+# uv add selectolax, or uv add lxml). BeautifulSoup's pure-Python "html.parser" builds
+# a full Python object tree and matches CSS in Python, which is most of a scrape's CPU
+# time on the long day views. Every backend produces the same rows; run
+# parser_benchmark.py over saved pages to check that and compare their speed.
+try:
+    from selectolax.lexbor import LexborHTMLParser as SelectolaxParser
+except ImportError:
+    SelectolaxParser = None
+try:
+    import lxml.etree
+    import lxml.html
+except ImportError:
+    lxml = None
+
+# auto (default: the fastest installed), selectolax, lxml or html.parser.
+SCRAPE_HTML_PARSER = os.environ.get("SCRAPE_HTML_PARSER", "auto").strip().lower()
+
+BACKENDS = ('selectolax', 'lxml', 'html.parser')
+
+def available_backends():
+    """The installed backends, fastest first"""
+    installed = {
+        'selectolax': SelectolaxParser is not None,
+        'lxml': lxml is not None,
+        'html.parser': True,
+    }
+    return [name for name in BACKENDS if installed[name]]
+
+def default_backend():
+    """The backend SCRAPE_HTML_PARSER asks for, if it is installed"""
+    available = available_backends()
+    if SCRAPE_HTML_PARSER == 'auto':
+        return available[0]
+    if SCRAPE_HTML_PARSER in available:
+        return SCRAPE_HTML_PARSER
+    logging.warning(f"SCRAPE_HTML_PARSER {SCRAPE_HTML_PARSER!r} is not available - using {available[0]}")
+    return available[0]
+
+# The scrapers only need tag, class and attribute-presence selectors with descendant
+# combinators, e.g. ".b_playlist li" or ".playlist-track__status[data-ts]". lxml's own
+# CSS support needs the cssselect package, so translate that subset to XPath here.
+_COMPOUND = re.compile(r'^(?P<tag>[a-zA-Z][\w-]*|\*)?(?P<rest>(?:\.[\w-]+|\[[\w-]+\])*)$')
+_SIMPLE = re.compile(r'\.([\w-]+)|\[([\w-]+)\]')
+
+@functools.lru_cache(maxsize=64)
+def _xpath(selector, relative):
+    steps = []
+    for compound in selector.split():
+        match = _COMPOUND.match(compound)
+        if not match:
+            raise ValueError(f"Unsupported selector for the lxml backend: {selector!r}")
+        conditions = ''.join(
+            f"[contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')]"
+            if class_name else f"[@{attribute}]"
+            for class_name, attribute in _SIMPLE.findall(match['rest'])
+        )
+        steps.append((match['tag'] or '*') + conditions)
+    return lxml.etree.XPath(('.//' if relative else '//') + '//'.join(steps))
+
+def _extract_selectolax(html, item_selector, fields):
+    rows = []
+    for item in SelectolaxParser(html).css(item_selector):
+        row = []
+        for selector, attribute in fields:
+            node = item
+            if selector:
+                # Lexbor matches the item itself too; BeautifulSoup only its descendants.
+                node = next((match for match in item.css(selector) if match != item), None)
+            if node is None:
+                row.append(None)
+            elif attribute:
+                row.append(node.attributes.get(attribute))
+            else:
+                row.append(node.text(deep=True).strip())
+        rows.append(tuple(row))
+    return rows
+
+def _extract_lxml(html, item_selector, fields):
+    if not html.strip():
+        return []
+    # Bytes with the encoding given: lxml refuses a str that carries its own XML
+    # encoding declaration, and a page's <meta charset> must not override the decoding
+    # requests already did.
+    document = lxml.html.document_fromstring(
+        html.encode('utf-8'), parser=lxml.html.HTMLParser(encoding='utf-8')
+    )
+    compiled = [(_xpath(selector, True) if selector else None, attribute) for selector, attribute in fields]
+    rows = []
+    for item in _xpath(item_selector, False)(document):
+        row = []
+        for xpath, attribute in compiled:
+            if xpath is None:
+                node = item
+            else:
+                matches = xpath(item)
+                node = matches[0] if matches else None
+            if node is None:
+                row.append(None)
+            elif attribute:
+                row.append(node.get(attribute))
+            else:
+                row.append(node.text_content().strip())
+        rows.append(tuple(row))
+    return rows
+
+def _extract_html_parser(html, item_selector, fields):
+    rows = []
+    for item in BeautifulSoup(html, "html.parser").select(item_selector):
+        row = []
+        for selector, attribute in fields:
+            node = item.select_one(selector) if selector else item
+            if node is None:
+                row.append(None)
+            elif attribute:
+                row.append(node.get(attribute))
+            else:
+                row.append(node.get_text().strip())
+        rows.append(tuple(row))
+    return rows
+
+_EXTRACTORS = {
+    'selectolax': _extract_selectolax,
+    'lxml': _extract_lxml,
+    'html.parser': _extract_html_parser,
+}
+
+def extract(html, item_selector, fields, backend=None):
+    """
+    One tuple per element matching `item_selector`, in document order.
+
+    `fields` is a list of (selector, attribute): the first element under the item
+    matching `selector` (the item itself when selector is None), and of it the value
+    of `attribute`, or its stripped text when attribute is None. A field with no
+    matching element, or without the attribute, is None.
+    """
+    return _EXTRACTORS[backend or default_backend()](html, item_selector, fields)
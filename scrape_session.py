@@ -0,0 +1,106 @@
+import logging
+import os
+import random
+import threading
+import time
+
+import latest_user_agents
+import requests
+from requests.adapters import HTTPAdapter
+
+# Seconds to wait for a scraped site to connect or send data.
+SCRAPE_TIMEOUT = float(os.environ.get("SCRAPE_TIMEOUT_SECONDS", "30"))
+
+# Retries after a 5xx, a timeout or a dropped connection, with exponential backoff from
+# SCRAPE_BACKOFF seconds. The delay is jittered so the stations scraped concurrently
+# (see station_scraper) do not all come back at the same instant.
+SCRAPE_RETRIES = int(os.environ.get("SCRAPE_RETRIES", "3"))
+SCRAPE_BACKOFF = float(os.environ.get("SCRAPE_BACKOFF_SECONDS", "1.0"))
+
+# get_latest_user_agents() was called for every request. The answer changes when a
+# browser ships a release, so look it up again after this long.
+USER_AGENT_REFRESH = int(os.environ.get("SCRAPE_USER_AGENT_REFRESH_HOURS", "24")) * 3600
+
+# Used when the user agent list cannot be fetched and nothing is cached yet: a scrape
+# with a slightly old browser string beats no scrape.
+FALLBACK_USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36"
+)
+
+_user_agent_lock = threading.Lock()
+_session_lock = threading.Lock()
+_user_agent = None
+_user_agent_at = 0.0
+_session = None
+
+def get_user_agent():
+    """A current Chrome user agent, looked up at most every USER_AGENT_REFRESH seconds"""
+    global _user_agent, _user_agent_at
+    with _user_agent_lock:
+        if _user_agent and time.monotonic() - _user_agent_at < USER_AGENT_REFRESH:
+            return _user_agent
+        try:
+            if _user_agent:
+                # The library keeps its first answer in memory for the life of the
+                # process. Its public clear_user_agent_cache() is the supported way to
+                # make it fetch again; should the fetch fail, the agent we have is kept.
+                latest_user_agents.clear_user_agent_cache()
+            _user_agent = latest_user_agents.get_latest_user_agents()[0]
+        except Exception as e:
+            logging.warning(f"Cannot fetch the latest user agents ({e}) - keeping {_user_agent or 'the fallback'}")
+            _user_agent = _user_agent or FALLBACK_USER_AGENT
+        _user_agent_at = time.monotonic()
+        return _user_agent
+
+def get_session():
+    """
+    The requests session every scraper shares.
+
+    One pool of keep-alive connections per host, sized for the concurrent scrape
+    (see station_scraper), instead of a new TCP and TLS handshake per request. Only
+    connection pooling is shared: nothing here relies on cookies.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=10, pool_maxsize=10)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+def get(url, headers=None, **kwargs):
+    """
+    GET `url` through the shared session, with the cached user agent, a timeout, and
+    retries with jittered backoff on 5xx responses, timeouts and connection errors.
+
+    Returns the last response, whatever its status; callers still raise_for_status().
+    Raises the last exception when every attempt failed to get a response at all.
+    """
+    headers = {"user-agent": get_user_agent(), **(headers or {})}
+    kwargs.setdefault('timeout', SCRAPE_TIMEOUT)
+    for attempt in range(SCRAPE_RETRIES + 1):
+        started = time.monotonic()
+        try:
+            response = get_session().get(url, headers=headers, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == SCRAPE_RETRIES:
+                raise
+            problem = f"{type(e).__name__}: {e}"
+        else:
+            logging.info(
+                f"GET {url} -> {response.status_code} in {time.monotonic() - started:.2f}s"
+                f" ({len(response.content)} bytes)"
+            )
+            if response.status_code < 500 or attempt == SCRAPE_RETRIES:
+                return response
+            problem = f"HTTP {response.status_code}"
+
+        delay = SCRAPE_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5)
+        logging.warning(
+            f"GET {url} failed ({problem}) after {time.monotonic() - started:.2f}s - "
+            f"retry {attempt + 1}/{SCRAPE_RETRIES} in {delay:.1f}s"
+        )
+        time.sleep(delay)
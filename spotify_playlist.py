@@ -3,11 +3,23 @@ from spotipy.oauth2 import SpotifyOAuth
 from spotipy.cache_handler import CacheHandler
 import os
 import logging
-import pandas as pd
 import time
 import uuid
-from io import StringIO
-from playlist_upload import download_file_from_s3, list_objects_in_bucket
+import hashlib
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from urllib3.util.retry import Retry
+from playlist_upload import download_file_from_s3, iter_objects_in_bucket
+import playlist_format
+from playlist_listing import PLAYLIST_KEY_PATTERN
+import playlist_cache
+import task_store
+import track_cache
+from track_resolver import (
+    RateLimitedError, call_with_rate_limit, group_duplicate_tracks, resolve_tracks
+)
 
 # Load environment variables if .env file exists
 if os.path.exists('.env'):
@@ -78,6 +90,20 @@ def has_cached_token(session_data):
     """
     return bool((session_data or {}).get('spotify_token_info'))
 
+def session_user_key(session_data):
+    """
+    A stable, non-secret key for the Spotify account behind a session.
+
+    The Spotify user id recorded at login, or for sessions from before that was
+    recorded, a hash of the refresh token. Never the token itself: the key ends up in
+    logs and metrics.
+    """
+    session_data = session_data or {}
+    if session_data.get('spotify_user_id'):
+        return session_data['spotify_user_id']
+    refresh_token = (session_data.get('spotify_token_info') or {}).get('refresh_token') or ''
+    return 'token-' + hashlib.sha256(refresh_token.encode('utf-8')).hexdigest()[:16]
+
 def create_spotify_auth_manager(session_data=None):
     """
     Create and return a configured SpotifyOAuth auth manager with session-based cache
@@ -135,13 +161,20 @@ def handle_oauth_callback(code, session_data):
         # Save the token info for future use
         auth_manager.cache_handler.save_token_to_cache(token_info)
         logging.info("Successfully saved Spotify access token to the session")
+
+        # Remember whose token this is, so per-user job limits (see session_user_key)
+        # count accounts rather than browser sessions. Not worth failing the login over.
+        try:
+            session_data['spotify_user_id'] = spotipy.Spotify(auth_manager=auth_manager).current_user()['id']
+        except Exception as e:
+            logging.warning(f"Could not look up the Spotify user id after login: {e}")
         return True
 
     except Exception as e:
         logging.error(f"Error handling OAuth callback: {e}")
         return False
 
-def create_spotify_client_with_session(session_data):
+def create_spotify_client_with_session(session_data, retry_rate_limits=True):
     """
     Create an authenticated Spotify client from the token held in `session_data`.
 
@@ -152,6 +185,10 @@ def create_spotify_client_with_session(session_data):
     Pass the live Flask session for request-scoped work so a refreshed token is written
     back to the cookie; background threads have no request context and must pass a
     dict(session) copy, where a refresh cannot be persisted.
+
+    With retry_rate_limits=False a 429 is raised as a SpotifyException carrying the
+    Retry-After header instead of being slept through inside spotipy; route such a
+    client's calls through track_resolver.call_with_rate_limit.
     """
     if not has_cached_token(session_data):
         logging.info("No Spotify token in session - not creating a client")
@@ -162,209 +199,582 @@ def create_spotify_client_with_session(session_data):
         if not auth_manager:
             return None
 
-        return spotipy.Spotify(auth_manager=auth_manager)
+        if retry_rate_limits:
+            return spotipy.Spotify(auth_manager=auth_manager)
+        return spotipy.Spotify(auth_manager=auth_manager, requests_session=rate_limited_session())
     except Exception as e:
         logging.error(f"Error creating Spotify client with session data: {e}")
         return None
 
+def rate_limited_session():
+    """
+    A requests session for a spotipy client whose 429s must reach call_with_rate_limit.
+
+    Leaving 429 out of spotipy's status_forcelist is not enough: urllib3's Retry still
+    retries any 429 carrying Retry-After (respect_retry_after_header), sleeping inside
+    the thread for as long as Spotify asks, and spotipy then raises the final 429
+    without its headers. This session retries 5xx and connection errors as spotipy
+    does, and hands every 429 back at once, Retry-After header included.
+    """
+    session = requests.Session()
+    retry = Retry(
+        total=spotipy.Spotify.max_retries,
+        connect=None,
+        read=False,
+        allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+        status=spotipy.Spotify.max_retries,
+        backoff_factor=0.3,
+        status_forcelist=tuple(code for code in spotipy.Spotify.default_retry_codes if code != 429),
+        respect_retry_after_header=False,
+    )
+    adapter = requests.adapters.HTTPAdapter(max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def _search_track_uri(sp, artist, track):
+    """
+    Search Spotify for a track and return the URI of the best match, or None.
+
+    Unlike search_track this lets API errors propagate, so callers can tell "Spotify
+    has no such track" apart from "the search itself failed".
+    """
+    query = f"{track} artist:{artist}"
+    results = sp.search(q=query, type='track', limit=1)
+    logging.info(f"Searching for track: {query}")
+    logging.info(f"Search results: {results}")
+
+    if results['tracks']['items']:
+        return results['tracks']['items'][0]['uri']
+    return None
+
 def search_track(sp, artist, track):
     """
     Search for a track on Spotify
     """
     try:
-        query = f"{track} artist:{artist}"
-        results = sp.search(q=query, type='track', limit=1)
-        logging.info(f"Searching for track: {query}")
-        logging.info(f"Search results: {results}")
-        
-        if results['tracks']['items']:
-            return results['tracks']['items'][0]['uri']
-        return None
+        return _search_track_uri(sp, artist, track)
     except Exception as e:
         logging.error(f"Error searching for track {track} by {artist}: {e}")
         return None
 
-# Dictionary to store task progress
-tasks = {}
+# Returned by resolve_track when the search itself failed. None is a real answer
+# ("Spotify has no such track"), so it cannot double as the failure marker.
+SEARCH_FAILED = object()
 
-def create_playlist_from_csv(csv_content, playlist_name, task_id, session_data):
+def resolve_track(sp, artist, track):
     """
-    Create a Spotify playlist from CSV content with progress tracking
+    Resolve a track to a Spotify URI, consulting the persistent track cache first.
+
+    Only a miss reaches the search API, through the process-wide rate limiter. Both a
+    match and a definite "no match" (None) are cached; a failed search is not, and
+    returns SEARCH_FAILED, so a transient API error is retried next run.
+    RateLimitedError propagates: once Spotify refuses us, every remaining search would
+    fail the same way.
+    """
+    cached = track_cache.lookup(artist, track)
+    if cached is not track_cache.MISS:
+        return cached
+
+    try:
+        track_uri = call_with_rate_limit(_search_track_uri, sp, artist, track)
+    except RateLimitedError:
+        raise
+    except Exception as e:
+        logging.error(f"Error searching for track {track} by {artist}: {e}")
+        return SEARCH_FAILED
+
+    track_cache.store(artist, track, track_uri)
+    return track_uri
+
+# Task progress, shared by every worker process (see task_store)
+tasks = task_store.tasks
+
+# What create_playlist_from_csv does with repeated plays of a track: 'keep' adds every
+# play in order, as the station aired it; 'remove' adds each track once, at its first play.
+DUPLICATE_MODES = ('keep', 'remove')
+
+def _get_playlist_snapshot(sp, playlist_id):
+    """
+    Return (snapshot_id, track URIs) for a playlist, in playlist order.
+
+    The first page of items comes back with the playlist itself, so a playlist of up
+    to 100 tracks costs a single request. The rest are fetched by offset with the same
+    fields filter: following 'next' would drop it and download full track objects.
+    """
+    playlist = call_with_rate_limit(
+        sp.playlist, playlist_id,
+        fields='snapshot_id,tracks(total,items(track(uri)))'
+    )
+    items = fetch_all_pages(
+        playlist['tracks'],
+        lambda offset: call_with_rate_limit(
+            sp.playlist_items, playlist_id, fields='items(track(uri))',
+            limit=PLAYLIST_ITEMS_PAGE_LIMIT, offset=offset
+        ),
+        PLAYLIST_ITEMS_PAGE_LIMIT
+    )
+    uris = [
+        item['track']['uri'] for item in items
+        if item and item.get('track') and item['track'].get('uri')
+    ]
+    return playlist['snapshot_id'], uris
+
+def sync_playlist_items(sp, playlist_id, track_uris, on_progress=None):
+    """
+    Make an existing playlist hold `track_uris`, sending only the difference.
+
+    Tracks missing from `track_uris` are removed; tracks it has that the playlist lacks
+    (or holds fewer times) are appended in `track_uris` order. Tracks already present
+    are left where they are, so membership is synced, not position. Both requests go
+    in batches of 100, the Spotify API limit, and removals are pinned to the snapshot
+    that was diffed so they cannot act on a playlist edited in the meantime.
+
+    on_progress(done, total) is called after every batch. Returns (added, removed).
+    """
+    snapshot_id, current_uris = _get_playlist_snapshot(sp, playlist_id)
+
+    wanted = set(track_uris)
+    # Local files and episodes cannot be removed through this endpoint; leave them be.
+    to_remove = list(dict.fromkeys(
+        uri for uri in current_uris if uri not in wanted and uri.startswith('spotify:track:')
+    ))
+    present = {}
+    for uri in current_uris:
+        present[uri] = present.get(uri, 0) + 1
+    to_add = []
+    for uri in track_uris:
+        if present.get(uri, 0) > 0:
+            present[uri] -= 1
+        else:
+            to_add.append(uri)
+
+    logging.info(
+        f"Syncing playlist {playlist_id} (snapshot {snapshot_id}): "
+        f"{len(current_uris)} current, +{len(to_add)} -{len(to_remove)}"
+    )
+
+    batch_size = 100  # Spotify API limit
+    batches = [('remove', to_remove[i:i + batch_size]) for i in range(0, len(to_remove), batch_size)]
+    batches += [('add', to_add[i:i + batch_size]) for i in range(0, len(to_add), batch_size)]
+    try:
+        for done, (action, batch) in enumerate(batches, 1):
+            if action == 'remove':
+                result = call_with_rate_limit(
+                    sp.playlist_remove_all_occurrences_of_items, playlist_id, batch, snapshot_id=snapshot_id
+                )
+                snapshot_id = result['snapshot_id']
+            else:
+                call_with_rate_limit(sp.playlist_add_items, playlist_id, batch)
+            if on_progress:
+                on_progress(done, len(batches))
+    finally:
+        if batches:
+            playlist_cache.invalidate(playlist_id)
+
+    return len(to_add), len(to_remove)
+
+# Save the checkpoint of a running build after this many newly resolved tracks.
+CHECKPOINT_EVERY = 25
+
+def create_playlist_from_csv(csv_content, playlist_name, task_id, session_data, duplicates='keep',
+                             target_playlist_id=None, checkpoint_key=None):
+    """
+    Create a Spotify playlist from CSV content with progress tracking.
+
+    `csv_content` is a CSV str, or the bytes of a playlist file in any format
+    playlist_format reads (gzip-CSV, Parquet).
+
+    Repeated plays are searched once however `duplicates` is set; it only decides
+    whether the repeats appear in the playlist (see DUPLICATE_MODES).
+
+    With `target_playlist_id` no playlist is created: that existing playlist is synced
+    to the CSV instead (see sync_playlist_items), so re-running a station's daily build
+    costs a handful of requests rather than a new playlist every time.
+
+    With `checkpoint_key` progress is checkpointed in the task store: the playlist
+    created, the tracks resolved so far and the batches already added. A later call
+    with the same key and the same CSV - typically the user starting the job again
+    after a restart killed it - carries on from there instead of searching everything
+    again and creating a second playlist. The checkpoint is dropped once the job ends.
     """
     try:
         # Initialize task progress
-        tasks[task_id] = {
+        tasks.create(task_id, {
             'progress': 0,
             'message': 'Initializing...',
             'status': 'processing'
-        }
+        })
 
-        sp = create_spotify_client_with_session(session_data)
+        sp = create_spotify_client_with_session(session_data, retry_rate_limits=False)
         if not sp:
-            tasks[task_id].update({
+            tasks.update(task_id, {
                 'status': 'error',
                 'message': 'Not authenticated with Spotify. Connect your account and try again.'
             })
             return False
 
-        # Get current user's ID
-        user_id = sp.current_user()['id']
-        tasks[task_id].update({'progress': 5, 'message': 'Creating playlist...'})
-        
-        # Create new playlist
-        playlist = sp.user_playlist_create(user_id, playlist_name, public=False)
-        playlist_id = playlist['id']
+        content = csv_content.encode('utf-8') if isinstance(csv_content, str) else csv_content
+        fingerprint = hashlib.sha256(content).hexdigest()
+        checkpoint = tasks.load_checkpoint(checkpoint_key) if checkpoint_key else None
+        if checkpoint and checkpoint.get('fingerprint') != fingerprint:
+            # Same job, different data (the file was re-scraped): start over.
+            checkpoint = None
+        if checkpoint:
+            logging.info(f"Resuming '{playlist_name}' from checkpoint {checkpoint_key}")
+        checkpoint = checkpoint or {
+            'fingerprint': fingerprint, 'playlist_id': None, 'resolved': [], 'track_uris': None,
+            'batches_added': 0
+        }
+        checkpoint_lock = threading.Lock()
+
+        def save_checkpoint():
+            if checkpoint_key:
+                with checkpoint_lock:
+                    tasks.save_checkpoint(checkpoint_key, checkpoint)
+
+        if target_playlist_id:
+            playlist_id = target_playlist_id
+        elif checkpoint['playlist_id']:
+            # Created by the interrupted run; creating another would leave a duplicate.
+            playlist_id = checkpoint['playlist_id']
+        else:
+            # Get current user's ID
+            user_id = call_with_rate_limit(sp.current_user)['id']
+            tasks.update(task_id, {'progress': 5, 'message': 'Creating playlist...'})
+
+            # Create new playlist
+            playlist = call_with_rate_limit(sp.user_playlist_create, user_id, playlist_name, public=False)
+            playlist_id = playlist['id']
+            checkpoint['playlist_id'] = playlist_id
+            save_checkpoint()
         
-        # Load CSV content into DataFrame
-        df = pd.read_csv(StringIO(csv_content))
+        # Load CSV content into DataFrame (or gzip-CSV, or Parquet: see playlist_format)
+        df = playlist_format.read_playlist(content)
         total_tracks = len(df)
         
         logging.info(f"Creating playlist '{playlist_name}' with {total_tracks} tracks")
-        tasks[task_id].update({'progress': 10, 'message': f'Found {total_tracks} tracks to process'})
-
-        # Collect track URIs
-        track_uris = []
-        for index, row in df.iterrows():
-            artist = row.get('artist_name', '')
-            track = row.get('song_name', '')
-            logging.info(f"Processing track: {track} by {artist}")
-            
+        tasks.update(task_id, {'progress': 10, 'message': f'Found {total_tracks} tracks to process'})
+
+        rows = [
+            (row.get('artist_name'), row.get('song_name'))
+            for _, row in df.iterrows()
+        ]
+        # A busy station plays its hits many times a day: search each distinct track
+        # once and map the result back onto every play.
+        unique_rows, row_keys = group_duplicate_tracks(rows)
+        unique_keys = list(dict.fromkeys(key for key in row_keys if key is not None))
+        logging.info(
+            f"'{playlist_name}': {len(unique_rows)} distinct tracks in {total_tracks} plays"
+        )
+
+        resolved = {(artist, song): uri for artist, song, uri in checkpoint['resolved']}
+        pending = [
+            (key, artist, track)
+            for key, (artist, track) in zip(unique_keys, unique_rows) if key not in resolved
+        ]
+        if checkpoint.get('track_uris') is not None and not target_playlist_id:
+            # Adding had started before the interruption: the rest comes from the list
+            # frozen then (see below), so nothing is searched again.
+            pending = []
+        already_resolved = len(unique_keys) - len(pending)
+
+        failed_searches = []
+
+        def resolve_row(key, artist, track):
+            uri = resolve_track(sp, artist, track)
+            if uri is SEARCH_FAILED:
+                # Left out of `resolved`, and so of the checkpoint: a resumed run
+                # searches it again rather than dropping the track for good.
+                failed_searches.append(key)
+            else:
+                resolved[key] = uri
+
+        def report_progress(done, total, row):
+            _, artist, track = row
             # Update progress (10-70%)
-            progress = 10 + int((index / total_tracks) * 60)
-            tasks[task_id].update({
-                'progress': progress,
-                'message': f'Searching for track: {track} by {artist}'
+            tasks.update(task_id, {
+                'progress': 10 + int(((already_resolved + done) / len(unique_keys)) * 60),
+                'message': f'Searched {already_resolved + done} of {len(unique_keys)} distinct tracks: {track} by {artist}'
             })
-            
-            if artist and track:
-                track_uri = search_track(sp, artist, track)
-                if track_uri:
-                    track_uris.append(track_uri)
+            if done % CHECKPOINT_EVERY == 0:
+                # dict.copy() is atomic, so this is safe while other searches finish.
+                checkpoint['resolved'] = [[*key, uri] for key, uri in resolved.copy().items()]
+                save_checkpoint()
+
+        # Searches run concurrently on the pool; each stores its own result.
+        resolve_tracks(pending, resolve_row, on_progress=report_progress)
+        checkpoint['resolved'] = [[*key, uri] for key, uri in resolved.items()]
+        save_checkpoint()
+        if failed_searches:
+            logging.warning(f"'{playlist_name}': {len(failed_searches)} searches failed; those tracks are left out")
+
+        if duplicates == 'remove':
+            # Two spellings can still resolve to the same recording.
+            track_uris = list(dict.fromkeys(resolved[key] for key in unique_keys if resolved.get(key)))
+        else:
+            track_uris = [resolved[key] for key in row_keys if key is not None and resolved.get(key)]
+
+        logging.info(f"Track cache after resolving '{playlist_name}': {track_cache.stats()}")
+
+        if target_playlist_id and track_uris:
+            tasks.update(task_id, {'progress': 80, 'message': 'Comparing with the existing playlist...'})
+
+            def report_sync_progress(done, total):
+                # Update progress (80-95%)
+                tasks.update(task_id, {
+                    'progress': 80 + int((done / total) * 15),
+                    'message': f'Applying change {done} of {total}'
+                })
+
+            # A sync diffs against the playlist as it is now, so an interrupted sync
+            # needs no batch checkpoint: the rerun only sends what is still missing.
+            added, removed = sync_playlist_items(
+                sp, playlist_id, track_uris, on_progress=report_sync_progress
+            )
+            tasks.update(task_id, {
+                'status': 'completed',
+                'progress': 100,
+                'message': f"Synced playlist '{playlist_name}': {added} added, {removed} removed"
+            })
+            logging.info(f"Synced playlist {playlist_id} from '{playlist_name}': +{added} -{removed}")
+            if checkpoint_key:
+                tasks.clear_checkpoint(checkpoint_key)
+            return True
 
-        tasks[task_id].update({'progress': 80, 'message': 'Adding tracks to playlist...'})
+        tasks.update(task_id, {'progress': 80, 'message': 'Adding tracks to playlist...'})
+
+        # batches_added counts batches of this exact list. Rebuilt on a resumed run it
+        # could shift - a search that failed last time succeeds, a cached answer
+        # changes - and skipping by batch number would then add some tracks twice and
+        # others never. So the list is frozen in the checkpoint before the first add
+        # and a resumed run adds the rest of that one.
+        if checkpoint.get('track_uris') is not None:
+            track_uris = checkpoint['track_uris']
+        else:
+            checkpoint['track_uris'] = track_uris
+            save_checkpoint()
         
         # Add tracks to playlist in batches
         if track_uris:
             batch_size = 100  # Spotify API limit
-            for i in range(0, len(track_uris), batch_size):
+            batches = range(0, len(track_uris), batch_size)
+            for batch_number, i in enumerate(batches):
+                if batch_number < checkpoint['batches_added']:
+                    continue  # Added before the interruption
                 batch = track_uris[i:i + batch_size]
-                sp.playlist_add_items(playlist_id, batch)
+                call_with_rate_limit(sp.playlist_add_items, playlist_id, batch)
+                # Only matters when a resumed build's playlist was viewed in between.
+                playlist_cache.invalidate(playlist_id)
+                checkpoint['batches_added'] = batch_number + 1
+                save_checkpoint()
                 # Update progress (80-95%)
                 progress = 80 + int((i / len(track_uris)) * 15)
-                tasks[task_id].update({
+                tasks.update(task_id, {
                     'progress': progress,
                     'message': f'Adding tracks {i+1} to {min(i+batch_size, len(track_uris))}'
                 })
             
-            tasks[task_id].update({
+            tasks.update(task_id, {
                 'status': 'completed',
                 'progress': 100,
                 'message': f"Created playlist '{playlist_name}' with {len(track_uris)} tracks"
             })
             logging.info(f"Created playlist '{playlist_name}' with {len(track_uris)} tracks")
+            if checkpoint_key:
+                tasks.clear_checkpoint(checkpoint_key)
             return True
         else:
-            tasks[task_id].update({
+            tasks.update(task_id, {
                 'status': 'error',
                 'message': f"No tracks found for playlist '{playlist_name}'"
             })
             logging.warning(f"No tracks found for playlist '{playlist_name}'")
+            if checkpoint_key:
+                tasks.clear_checkpoint(checkpoint_key)
             return False
             
     except Exception as e:
         logging.error(f"Error creating playlist: {e}")
-        # Update task with error status
+        # Update task with error status. The checkpoint is kept, so running the job
+        # again resumes from the last one saved.
         if task_id in tasks:
-            tasks[task_id].update({
+            tasks.update(task_id, {
                 'status': 'error',
                 'message': f'Error creating playlist: {str(e)}'
             })
         return False
 
+# Largest page Spotify serves of /me/playlists.
+PLAYLISTS_PAGE_LIMIT = 50
+
+# Pages of a long listing (playlists, playlist items) fetched at once, once the first
+# page has told us how many there are. Every request still goes through the shared rate limiter.
+SPOTIFY_PAGE_CONCURRENCY = int(os.environ.get("SPOTIFY_PAGE_CONCURRENCY", "4"))
+
+def fetch_all_pages(first_page, fetch_page, limit):
+    """
+    The items of a paged Spotify listing, in order.
+
+    `first_page` is the page at offset 0 of `limit` items; its 'total' gives the other
+    offsets, which are fetched with fetch_page(offset) on SPOTIFY_PAGE_CONCURRENCY
+    threads instead of following 'next' one round-trip at a time.
+    """
+    items = list(first_page['items'])
+    offsets = range(limit, first_page['total'], limit)
+    if not offsets:
+        return items
+    workers = max(1, min(SPOTIFY_PAGE_CONCURRENCY, len(offsets)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='spotify-page') as pool:
+        # map() yields in offset order, whatever order the pages arrive in.
+        for page in pool.map(fetch_page, offsets):
+            items.extend(page['items'])
+    return items
+
+def _page_client(session_data):
+    """
+    A client for fetching pages on worker threads.
+
+    Those threads have no request context, so they cannot read a live Flask session:
+    they get a copy of the token, which the first page (fetched on the request thread)
+    has just refreshed if it needed it.
+    """
+    return create_spotify_client_with_session(dict(session_data), retry_rate_limits=False)
+
 def get_user_playlists_with_session(session_data):
     """
     Get all playlists for the authenticated user using provided session data
     """
     try:
+        started = time.monotonic()
         sp = create_spotify_client_with_session(session_data)
         if not sp:
             logging.error("Failed to create Spotify client for getting playlists")
             return None
-            
-        # Get current user info
-        user = sp.current_user()
-        user_id = user['id']
-        
-        # Get all user playlists
+
+        first_page = sp.current_user_playlists(limit=PLAYLISTS_PAGE_LIMIT)
+        page_sp = _page_client(session_data) if first_page['total'] > PLAYLISTS_PAGE_LIMIT else None
+        items = fetch_all_pages(
+            first_page,
+            lambda offset: call_with_rate_limit(
+                page_sp.current_user_playlists, limit=PLAYLISTS_PAGE_LIMIT, offset=offset
+            ),
+            PLAYLISTS_PAGE_LIMIT
+        )
+
         playlists = []
-        results = sp.user_playlists(user_id)
-        
-        while results:
-            for item in results['items']:
-                playlist_info = {
-                    'id': item['id'],
-                    'name': item['name'],
-                    'description': item.get('description', ''),
-                    'public': item['public'],
-                    'collaborative': item['collaborative'],
-                    'tracks_total': item['tracks']['total'],
-                    'owner': item['owner']['display_name'],
-                    'owner_id': item['owner']['id'],
-                    'href': item['href'],
-                    'external_url': item['external_urls']['spotify'],
-                    'images': item['images'],
-                    'snapshot_id': item['snapshot_id']
-                }
-                playlists.append(playlist_info)
-            
-            # Check if there are more playlists to fetch
-            if results['next']:
-                results = sp.next(results)
-            else:
-                break
-                
-        logging.info(f"Retrieved {len(playlists)} playlists for user {user_id}")
+        for item in items:
+            if not item:
+                continue
+            playlist_info = {
+                'id': item['id'],
+                'name': item['name'],
+                'description': item.get('description', ''),
+                'public': item['public'],
+                'collaborative': item['collaborative'],
+                'tracks_total': item['tracks']['total'],
+                'owner': item['owner']['display_name'],
+                'owner_id': item['owner']['id'],
+                'href': item['href'],
+                'external_url': item['external_urls']['spotify'],
+                'images': item['images'],
+                'snapshot_id': item['snapshot_id']
+            }
+            playlists.append(playlist_info)
+        # Lets the tracks of an unchanged playlist be served from playlist_cache.
+        playlist_cache.remember_snapshots(
+            session_user_key(session_data),
+            {p['id']: p['snapshot_id'] for p in playlists if p['snapshot_id']}
+        )
+
+        pages = max(1, -(-first_page['total'] // PLAYLISTS_PAGE_LIMIT))
+        logging.info(
+            f"Retrieved {len(playlists)} playlists in {pages} page(s) "
+            f"in {time.monotonic() - started:.2f}s"
+        )
         return playlists
-        
+
     except Exception as e:
         logging.error(f"Error getting user playlists: {e}")
         return None
 
+# Largest page Spotify serves of a playlist's items.
+PLAYLIST_ITEMS_PAGE_LIMIT = 100
+
+# Only what get_playlist_tracks_with_session keeps. A full track object carries its
+# available markets, album images and more: several KB per track that were downloaded
+# and thrown away.
+PLAYLIST_TRACK_FIELDS = 'total,items(track(id,name,uri,artists(name),album(name)))'
+
 def get_playlist_tracks_with_session(playlist_id, session_data):
     """
     Get all tracks from a specific playlist using provided session data
+
+    Served from playlist_cache when the playlist's snapshot is known and cached: without
+    any request when Spotify gave this user that snapshot recently, otherwise after one
+    request for the snapshot and the first page, made as this user.
     """
     try:
+        started = time.monotonic()
+        user_key = session_user_key(session_data)
+        snapshot_id = playlist_cache.known_snapshot(user_key, playlist_id)
+        cached = playlist_cache.lookup(playlist_id, snapshot_id) if snapshot_id else None
+        if cached is not None:
+            logging.info(f"Served {len(cached)} tracks of playlist {playlist_id} from the cache (snapshot {snapshot_id})")
+            return cached
+
         sp = create_spotify_client_with_session(session_data)
         if not sp:
             logging.error("Failed to create Spotify client for getting playlist tracks")
             return None
-            
+
+        # The playlist object carries its snapshot_id and the first page of items, so
+        # finding out whether the cached copy is current costs no extra request.
+        playlist = sp.playlist(
+            playlist_id, fields=f'snapshot_id,tracks({PLAYLIST_TRACK_FIELDS})', additional_types=('track',)
+        )
+        snapshot_id = playlist['snapshot_id']
+        cached = playlist_cache.lookup(playlist_id, snapshot_id)
+        if cached is not None:
+            playlist_cache.remember_snapshots(user_key, {playlist_id: snapshot_id})
+            logging.info(f"Served {len(cached)} tracks of playlist {playlist_id} from the cache (snapshot {snapshot_id})")
+            return cached
+
+        def fetch_page(client, offset):
+            return client.playlist_items(
+                playlist_id, fields=PLAYLIST_TRACK_FIELDS, limit=PLAYLIST_ITEMS_PAGE_LIMIT,
+                offset=offset, additional_types=('track',)
+            )
+
+        first_page = playlist['tracks']
+        page_sp = _page_client(session_data) if first_page['total'] > PLAYLIST_ITEMS_PAGE_LIMIT else None
+        items = fetch_all_pages(
+            first_page,
+            lambda offset: call_with_rate_limit(fetch_page, page_sp, offset),
+            PLAYLIST_ITEMS_PAGE_LIMIT
+        )
+
         tracks = []
-        results = sp.playlist_tracks(playlist_id)
-        
-        while results:
-            for item in results['items']:
-                track = item['track']
-                if track:  # Handle deleted tracks
-                    track_info = {
-                        'id': track['id'],
-                        'name': track['name'],
-                        'artist': track['artists'][0]['name'] if track['artists'] else '',
-                        'uri': track['uri'],
-                        'album': track['album']['name'] if track['album'] else ''
-                    }
-                    tracks.append(track_info)
-            
-            # Check if there are more tracks to fetch
-            if results['next']:
-                results = sp.next(results)
-            else:
-                break
-                
-        logging.info(f"Retrieved {len(tracks)} tracks from playlist {playlist_id}")
+        for item in items:
+            track = item.get('track') if item else None
+            if track:  # Handle deleted tracks
+                track_info = {
+                    'id': track['id'],
+                    'name': track['name'],
+                    'artist': track['artists'][0]['name'] if track['artists'] else '',
+                    'uri': track['uri'],
+                    'album': track['album']['name'] if track['album'] else ''
+                }
+                tracks.append(track_info)
+
+        playlist_cache.store(playlist_id, snapshot_id, tracks)
+        playlist_cache.remember_snapshots(user_key, {playlist_id: snapshot_id})
+        logging.info(
+            f"Retrieved {len(tracks)} tracks from playlist {playlist_id} "
+            f"in {time.monotonic() - started:.2f}s"
+        )
         return tracks
-        
+
     except Exception as e:
         logging.error(f"Error getting playlist tracks: {e}")
         return None
@@ -375,36 +785,36 @@ def merge_playlists(source_playlist_id, target_playlist_id, task_id, session_dat
     """
     try:
         # Initialize task progress
-        tasks[task_id] = {
+        tasks.create(task_id, {
             'progress': 0,
             'message': 'Starting playlist merge...',
             'status': 'processing'
-        }
+        })
 
         # Create Spotify client with session data
         sp = create_spotify_client_with_session(session_data)
         if not sp:
-            tasks[task_id].update({'status': 'error', 'message': 'Failed to create Spotify client'})
+            tasks.update(task_id, {'status': 'error', 'message': 'Failed to create Spotify client'})
             return False
 
-        tasks[task_id].update({'progress': 10, 'message': 'Getting source playlist tracks...'})
+        tasks.update(task_id, {'progress': 10, 'message': 'Getting source playlist tracks...'})
         
         # Get tracks from source playlist
         source_tracks = get_playlist_tracks_with_session(source_playlist_id, session_data)
         if not source_tracks:
-            tasks[task_id].update({'status': 'error', 'message': 'Failed to get tracks from source playlist'})
+            tasks.update(task_id, {'status': 'error', 'message': 'Failed to get tracks from source playlist'})
             return False
 
-        tasks[task_id].update({'progress': 30, 'message': f'Found {len(source_tracks)} tracks in source playlist'})
+        tasks.update(task_id, {'progress': 30, 'message': f'Found {len(source_tracks)} tracks in source playlist'})
         
         # Get tracks from target playlist to check for duplicates
-        tasks[task_id].update({'progress': 40, 'message': 'Getting target playlist tracks...'})
+        tasks.update(task_id, {'progress': 40, 'message': 'Getting target playlist tracks...'})
         target_tracks = get_playlist_tracks_with_session(target_playlist_id, session_data)
         if target_tracks is None:
-            tasks[task_id].update({'status': 'error', 'message': 'Failed to get tracks from target playlist'})
+            tasks.update(task_id, {'status': 'error', 'message': 'Failed to get tracks from target playlist'})
             return False
 
-        tasks[task_id].update({'progress': 50, 'message': f'Found {len(target_tracks)} tracks in target playlist'})
+        tasks.update(task_id, {'progress': 50, 'message': f'Found {len(target_tracks)} tracks in target playlist'})
 
         # Create a set of existing track URIs in target playlist for fast lookup
         target_track_uris = {track['uri'] for track in target_tracks}
@@ -413,13 +823,13 @@ def merge_playlists(source_playlist_id, target_playlist_id, task_id, session_dat
         new_tracks = [track for track in source_tracks if track['uri'] not in target_track_uris]
         
         if not new_tracks:
-            tasks[task_id].update({
+            tasks.update(task_id, {
                 'status': 'completed',
                 'progress': 90,
                 'message': 'No new tracks to add (all tracks already exist in target playlist)'
             })
         else:
-            tasks[task_id].update({'progress': 60, 'message': f'Adding {len(new_tracks)} new tracks to target playlist...'})
+            tasks.update(task_id, {'progress': 60, 'message': f'Adding {len(new_tracks)} new tracks to target playlist...'})
             
             # Add new tracks to target playlist in batches
             new_track_uris = [track['uri'] for track in new_tracks]
@@ -428,22 +838,24 @@ def merge_playlists(source_playlist_id, target_playlist_id, task_id, session_dat
             for i in range(0, len(new_track_uris), batch_size):
                 batch = new_track_uris[i:i + batch_size]
                 sp.playlist_add_items(target_playlist_id, batch)
+                playlist_cache.invalidate(target_playlist_id)
                 # Update progress (60-80%)
                 progress = 60 + int((i / len(new_track_uris)) * 20)
-                tasks[task_id].update({
+                tasks.update(task_id, {
                     'progress': progress,
                     'message': f'Adding tracks {i+1} to {min(i+batch_size, len(new_track_uris))}'
                 })
             
-            tasks[task_id].update({'progress': 85, 'message': f'Successfully added {len(new_tracks)} tracks to target playlist'})
+            tasks.update(task_id, {'progress': 85, 'message': f'Successfully added {len(new_tracks)} tracks to target playlist'})
 
         # Delete the source playlist
-        tasks[task_id].update({'progress': 90, 'message': 'Deleting source playlist...'})
+        tasks.update(task_id, {'progress': 90, 'message': 'Deleting source playlist...'})
         
         try:
             sp.current_user_unfollow_playlist(source_playlist_id)
+            playlist_cache.invalidate(source_playlist_id)
             logging.info(f"Successfully deleted source playlist {source_playlist_id}")
-            tasks[task_id].update({
+            tasks.update(task_id, {
                 'status': 'completed',
                 'progress': 100,
                 'message': f'Successfully merged {len(new_tracks) if new_tracks else 0} tracks and deleted source playlist'
@@ -453,7 +865,7 @@ def merge_playlists(source_playlist_id, target_playlist_id, task_id, session_dat
         except Exception as delete_error:
             logging.error(f"Error deleting source playlist {source_playlist_id}: {delete_error}")
             # Still consider the operation successful since tracks were merged, but warn about deletion failure
-            tasks[task_id].update({
+            tasks.update(task_id, {
                 'status': 'completed_with_warning',
                 'progress': 100,
                 'message': f'Successfully merged {len(new_tracks) if new_tracks else 0} tracks, but failed to delete source playlist: {str(delete_error)}'
@@ -464,7 +876,7 @@ def merge_playlists(source_playlist_id, target_playlist_id, task_id, session_dat
         logging.error(f"Error merging playlists: {e}")
         # Update task with error status
         if task_id in tasks:
-            tasks[task_id].update({
+            tasks.update(task_id, {
                 'status': 'error',
                 'message': f'Error merging playlists: {str(e)}'
             })
@@ -544,27 +956,188 @@ def refresh_token_if_needed(session_data=None):
         logging.error(f"Error refreshing token: {e}")
         return None
 
-def process_s3_playlists(session_data, bucket_name="radio-playlists"):
+# Bulk creation (process_s3_playlists): playlists built at once, and downloaded CSVs
+# allowed to wait for a free builder. Every build draws on the same per-process Spotify
+# rate limiter, so concurrency here overlaps downloads, parsing and the tail of one build
+# with the next - it does not raise the request rate.
+BULK_PLAYLIST_CONCURRENCY = int(os.environ.get("BULK_PLAYLIST_CONCURRENCY", "3"))
+BULK_PREFETCH = int(os.environ.get("BULK_PREFETCH", "4"))
+
+def iter_playlist_keys(bucket_name, station=None, date=None):
     """
-    Process all CSV files in the S3 bucket and create Spotify playlists
+    Yield the playlist file keys in a bucket as the listing pages arrive.
+
+    `station` keeps one station's files and is passed to S3 as a key prefix, so the
+    listing itself is narrowed. `date` keeps files whose scrape date starts with it:
+    "2024", "202403" or "2024-03-15" (dashes are ignored).
     """
-    try:
-        # List all objects in bucket
-        objects = list_objects_in_bucket(bucket_name)
-        if not objects:
-            logging.warning(f"No objects found in bucket {bucket_name}")
-            return
-
-        for obj_name in objects[:2]:
-            if obj_name.endswith('.csv'):
-                # Download CSV content
-                csv_content = download_file_from_s3(bucket_name, obj_name)
-                if csv_content:
-                    # Use filename without extension as playlist name
-                    playlist_name = obj_name.rsplit('.', 1)[0]
-                    create_playlist_from_csv(
-                        csv_content, playlist_name, str(uuid.uuid4()), session_data
+    prefix = f'playlist_{station}_' if station else ''
+    date = (date or '').replace('-', '')
+    for key in iter_objects_in_bucket(bucket_name, prefix):
+        # Scraped files only: the compacted dataset's partitions are Parquet with the
+        # same columns, and would each become a playlist.
+        match = PLAYLIST_KEY_PATTERN.match(key)
+        if not match:
+            continue
+        # "playlist_retro_" is also a prefix of "playlist_retro_fm_...".
+        if station and match['station'] != station:
+            continue
+        if date and not match['date'].startswith(date):
+            continue
+        yield key
+
+def process_s3_playlists(session_data, task_id=None, bucket_name="radio-playlists",
+                         station=None, date=None, duplicates='keep'):
+    """
+    Create a Spotify playlist for every CSV in the S3 bucket matching `station` and
+    `date` (see iter_playlist_keys).
+
+    Keys are streamed from the listing and downloaded by one thread that runs up to
+    BULK_PREFETCH files ahead, while BULK_PLAYLIST_CONCURRENCY threads each build one
+    playlist at a time. Each file gets its own task, checkpointed like a single build
+    so running the same bulk job again resumes it. The `task_id` task aggregates them
+    as counters under 'counts' (listed, building, finished, failed) and a 'failures'
+    list of file, task id and message: a run covers thousands of files, and rewriting
+    every file's state into one record each second cost O(files) per second.
+
+    Returns {key: True/False} for the files that were attempted.
+    """
+    task_id = task_id or str(uuid.uuid4())
+    workers = max(1, BULK_PLAYLIST_CONCURRENCY)
+    user_key = session_user_key(session_data)
+    files = {}  # key -> task id of its build, in listing order
+    building = {}  # key -> task id, of the builds in progress
+    failures = []
+    results = {}
+    listing_errors = []
+    lock = threading.Lock()
+    downloads = queue.Queue(maxsize=max(1, BULK_PREFETCH))
+
+    tasks.create(task_id, {
+        'status': 'processing',
+        'progress': 0,
+        'message': 'Listing playlists...',
+        'counts': {'listed': 0, 'building': 0, 'finished': 0, 'failed': 0},
+        'failures': []
+    })
+
+    def download_all():
+        try:
+            for key in iter_playlist_keys(bucket_name, station, date):
+                file_task_id = str(uuid.uuid4())
+                tasks.create(file_task_id, {
+                    'status': 'queued', 'progress': 0, 'message': 'Downloading...'
+                })
+                with lock:
+                    files[key] = file_task_id
+                # Blocks once BULK_PREFETCH downloaded files are waiting for a builder.
+                downloads.put((key, file_task_id, download_file_from_s3(bucket_name, key, decode=False)))
+        except Exception as e:
+            logging.error(f"Error listing playlists in bucket {bucket_name}: {e}")
+            listing_errors.append(str(e))
+        finally:
+            for _ in range(workers):
+                downloads.put(None)
+
+    def build_all():
+        while True:
+            item = downloads.get()
+            if item is None:
+                return
+            key, file_task_id, csv_content = item
+            with lock:
+                building[key] = file_task_id
+            if csv_content is None:
+                tasks.update(file_task_id, {'status': 'error', 'message': f'Failed to download {key}'})
+                ok = False
+            else:
+                try:
+                    ok = create_playlist_from_csv(
+                        csv_content, playlist_format.playlist_name(key), file_task_id, session_data,
+                        duplicates=duplicates,
+                        # Same key as /create_playlist_from_file, so either resumes the other.
+                        checkpoint_key='|'.join(['create', user_key, key, duplicates, ''])
                     )
+                except Exception as e:
+                    # A dead builder would leave the downloader blocked on a full queue.
+                    logging.error(f"Error creating playlist from {key}: {e}")
+                    tasks.update(file_task_id, {'status': 'error', 'message': str(e)})
+                    ok = False
+            failure = None
+            if not ok:
+                failure = {
+                    'file': key,
+                    'task_id': file_task_id,
+                    'message': (tasks.get(file_task_id) or {}).get('message', ''),
+                }
+            with lock:
+                results[key] = ok
+                del building[key]
+                if failure:
+                    failures.append(failure)
 
-    except Exception as e:
-        logging.error(f"Error processing S3 playlists: {e}")
+    last_report = {}
+
+    def report(finished=False):
+        with lock:
+            listed = len(files)
+            done = len(results)
+            failed = list(failures)
+            in_progress = list(building.values())
+        # Only the builds in progress (BULK_PLAYLIST_CONCURRENCY at most) are read back;
+        # finished ones count as 100, the rest of the listing as 0.
+        partial = sum(
+            min((tasks.get(file_task_id) or {}).get('progress', 0), 99) for file_task_id in in_progress
+        )
+        fields = {
+            'counts': {'listed': listed, 'building': len(in_progress), 'finished': done, 'failed': len(failed)},
+            'failures': failed,
+            'progress': int((done * 100 + partial) / listed) if listed else 0,
+            'message': f'Finished {done} of {listed} playlists'
+                       + (f' ({len(failed)} failed)' if failed else '')
+        }
+        if not finished:
+            # More keys may still be coming from the listing.
+            fields['progress'] = min(fields['progress'], 99)
+        elif not listed:
+            fields.update({
+                'status': 'error',
+                'message': f'Error listing playlists: {listing_errors[0]}' if listing_errors
+                           else 'No playlists match the selected station and date'
+            })
+        elif len(failed) == listed:
+            fields.update({'status': 'error', 'message': f'All {listed} playlists failed'})
+        elif failed or listing_errors:
+            fields.update({
+                'status': 'completed_with_warning',
+                'progress': 100,
+                'message': f'Created {listed - len(failed)} of {listed} playlists; '
+                           f'{len(failed)} failed' + ('; the listing was cut short' if listing_errors else '')
+            })
+        else:
+            fields.update({
+                'status': 'completed',
+                'progress': 100,
+                'message': f'Created {listed} playlists'
+            })
+        if fields != last_report:
+            tasks.update(task_id, fields)
+            last_report.clear()
+            last_report.update(fields)
+
+    threads = [threading.Thread(target=download_all, name='bulk-download', daemon=True)]
+    threads += [
+        threading.Thread(target=build_all, name=f'bulk-build-{index}', daemon=True)
+        for index in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        report()
+        time.sleep(1)
+    report(finished=True)
+
+    logging.info(
+        f"Bulk playlist creation {task_id}: {sum(results.values())} of {len(results)} created"
+    )
+    return results
@@ -1,12 +1,15 @@
-import React, { useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import { PlaylistFile, PlaylistProgress } from '../types';
+import { isTaskFinished, watchTaskProgress } from '../progress';
 import { ProgressBar } from './ProgressBar';
 import {
   PlaylistItem as StyledPlaylistItem,
   PlaylistName,
+  PlaylistMeta,
   ButtonGroup,
   ViewButton,
   AddButton,
+  RepeatsToggle,
   ConnectSpotifyLink,
 } from './styles';
 
@@ -19,11 +22,17 @@ export const PlaylistItem: React.FC<PlaylistItemProps> = ({ file }) => {
   // Set from the `auth_url` the server returns with its "not authenticated" response,
   // so the button that failed is also where the user can fix it.
   const [authUrl, setAuthUrl] = useState<string | null>(null);
+  // Stations replay their hits many times a day; by default the playlist keeps every
+  // play in order, ticking this adds each track only once.
+  const [skipRepeats, setSkipRepeats] = useState(false);
   const [progress, setProgress] = useState<PlaylistProgress>({
     status: 'processing',
     progress: 0,
     message: 'Initializing...'
   });
+  const stopWatching = useRef<(() => void) | null>(null);
+
+  useEffect(() => () => stopWatching.current?.(), []);
 
   const handleAddToSpotify = async () => {
     setIsProcessing(true);
@@ -35,14 +44,17 @@ export const PlaylistItem: React.FC<PlaylistItemProps> = ({ file }) => {
           'Content-Type': 'application/json',
           'Accept': 'application/json'
         },
-        body: JSON.stringify({ file_name: file.name })
+        body: JSON.stringify({
+          file_name: file.name,
+          duplicates: skipRepeats ? 'remove' : 'keep'
+        })
       });
 
       const data = await response.json();
       
       if (data.status === 'success') {
         const taskId = data.task_id;
-        pollProgress(taskId);
+        followProgress(taskId);
       } else {
         setProgress({
           status: 'error',
@@ -62,37 +74,25 @@ export const PlaylistItem: React.FC<PlaylistItemProps> = ({ file }) => {
     }
   };
 
-  const pollProgress = async (taskId: string) => {
-    const poll = setInterval(async () => {
-      try {
-        const response = await fetch(`/playlist_progress/${taskId}`);
-        const data = await response.json();
-
-        setProgress({
-          status: data.status,
-          progress: data.progress,
-          message: data.message
-        });
-
-        if (data.status === 'completed' || data.status === 'error') {
-          clearInterval(poll);
-          setIsProcessing(false);
-        }
-      } catch (error) {
-        clearInterval(poll);
+  const followProgress = (taskId: string) => {
+    stopWatching.current = watchTaskProgress(taskId, (update) => {
+      setProgress(update);
+      if (isTaskFinished(update.status)) {
         setIsProcessing(false);
-        setProgress({
-          status: 'error',
-          progress: 0,
-          message: 'Error checking progress'
-        });
       }
-    }, 1000);
+    });
   };
 
   return (
     <StyledPlaylistItem>
-      <PlaylistName>{file.name}</PlaylistName>
+      <PlaylistName>
+        {file.name}
+        {file.trackCount != null && (
+          <PlaylistMeta>
+            {[file.station, file.date, `${file.trackCount} tracks`].filter(Boolean).join(' · ')}
+          </PlaylistMeta>
+        )}
+      </PlaylistName>
       <ButtonGroup>
         <ViewButton href={`/playlists/view/${file.name}`}>View</ViewButton>
         <AddButton
@@ -101,6 +101,15 @@ export const PlaylistItem: React.FC<PlaylistItemProps> = ({ file }) => {
         >
           Add to Spotify
         </AddButton>
+        <RepeatsToggle>
+          <input
+            type="checkbox"
+            checked={skipRepeats}
+            onChange={(e) => setSkipRepeats(e.target.checked)}
+            disabled={isProcessing}
+          />
+          Skip repeats
+        </RepeatsToggle>
         {/* Also render while stopped-with-an-error: the error handlers clear
             isProcessing, which used to hide the message they had just set, so a
             failed click looked like nothing had happened at all. */}
@@ -1,5 +1,5 @@
 import React, { useEffect, useMemo, useState } from 'react';
-import { PlaylistFile } from '../types';
+import { PlaylistDetails, PlaylistFile } from '../types';
 import { PlaylistItem } from './PlaylistItem';
 import {
   PlaylistContainer,
@@ -24,7 +24,16 @@ export const PlaylistsPage: React.FC = () => {
       const response = await fetch('/api/playlists');
       const data = await response.json();
       if (data.status === 'success') {
-        setFiles(data.playlists.map((name: string) => ({ name })));
+        setFiles(
+          data.details
+            ? data.details.map((entry: PlaylistDetails) => ({
+                name: entry.key,
+                station: entry.station,
+                date: entry.date,
+                trackCount: entry.track_count,
+              }))
+            : data.playlists.map((name: string) => ({ name }))
+        );
       } else {
         console.error('Error from server:', data.message);
       }
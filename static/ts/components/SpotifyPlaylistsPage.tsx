@@ -1,5 +1,6 @@
-import React, { useEffect, useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import { SpotifyPlaylist, MergeProgress } from '../types';
+import { isTaskFinished, watchTaskProgress } from '../progress';
 import { PlaylistContainer, PlaylistList, PlaylistActions, MergeButton, DropdownContainer, DropdownMenu, DropdownItem, ConnectSpotifyLink } from './styles';
 import { ProgressBar } from './ProgressBar';
 
@@ -16,9 +17,13 @@ export const SpotifyPlaylistsPage: React.FC = () => {
   const [mergeProgress, setMergeProgress] = useState<{ [playlistId: string]: MergeProgress }>({});
   const [dropdownOpen, setDropdownOpen] = useState<string | null>(null);
   const [mergingPlaylists, setMergingPlaylists] = useState<Set<string>>(new Set());
+  // Stop functions for the merges still being followed, so leaving the page closes
+  // their progress streams.
+  const stopWatching = useRef<Set<() => void>>(new Set());
 
   useEffect(() => {
     fetchSpotifyPlaylists();
+    return () => stopWatching.current.forEach((stop) => stop());
   }, []);
 
   const fetchSpotifyPlaylists = async () => {
@@ -103,7 +108,7 @@ export const SpotifyPlaylistsPage: React.FC = () => {
       
       if (data.status === 'success') {
         const taskId = data.task_id;
-        pollMergeProgress(taskId, sourcePlaylistId);
+        followMergeProgress(taskId, sourcePlaylistId);
       } else {
         setMergeProgress(prev => ({
           ...prev,
@@ -136,55 +141,32 @@ export const SpotifyPlaylistsPage: React.FC = () => {
     }
   };
 
-  const pollMergeProgress = async (taskId: string, playlistId: string) => {
-    const poll = setInterval(async () => {
-      try {
-        const response = await fetch(`/playlist_progress/${taskId}`);
-        const data = await response.json();
-
-        setMergeProgress(prev => ({
-          ...prev,
-          [playlistId]: {
-            status: data.status,
-            progress: data.progress,
-            message: data.message
-          }
-        }));
+  const followMergeProgress = (taskId: string, playlistId: string) => {
+    const stop = watchTaskProgress(taskId, (update) => {
+      setMergeProgress(prev => ({
+        ...prev,
+        [playlistId]: update
+      }));
 
-        if (data.status === 'completed' || data.status === 'error') {
-          clearInterval(poll);
-          setMergingPlaylists(prev => {
-            const newSet = new Set(prev);
-            newSet.delete(playlistId);
-            return newSet;
-          });
-          
-          // Clear progress after 5 seconds
-          setTimeout(() => {
-            setMergeProgress(prev => {
-              const newProgress = { ...prev };
-              delete newProgress[playlistId];
-              return newProgress;
-            });
-          }, 5000);
-        }
-      } catch (error) {
-        clearInterval(poll);
-        setMergeProgress(prev => ({
-          ...prev,
-          [playlistId]: {
-            status: 'error',
-            progress: 0,
-            message: 'Error checking merge progress'
-          }
-        }));
+      if (isTaskFinished(update.status)) {
+        stopWatching.current.delete(stop);
         setMergingPlaylists(prev => {
           const newSet = new Set(prev);
           newSet.delete(playlistId);
           return newSet;
         });
+
+        // Clear progress after 5 seconds
+        setTimeout(() => {
+          setMergeProgress(prev => {
+            const newProgress = { ...prev };
+            delete newProgress[playlistId];
+            return newProgress;
+          });
+        }, 5000);
       }
-    }, 1000);
+    });
+    stopWatching.current.add(stop);
   };
 
   // Close dropdown when clicking outside
@@ -52,6 +52,12 @@ export const PlaylistName = styled.span`
   color: #333;
 `;
 
+export const PlaylistMeta = styled.span`
+  display: block;
+  font-size: 13px;
+  color: #666;
+`;
+
 export const ButtonGroup = styled.div`
   display: flex;
   gap: 10px;
@@ -89,6 +95,15 @@ export const AddButton = styled.button<{ disabled?: boolean }>`
   }
 `;
 
+export const RepeatsToggle = styled.label`
+  display: flex;
+  align-items: center;
+  gap: 4px;
+  color: #666;
+  font-size: 14px;
+  cursor: pointer;
+`;
+
 export const Progress = styled.div<{ active: boolean }>`
   display: ${props => props.active ? 'flex' : 'none'};
   flex-direction: column;
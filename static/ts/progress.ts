@@ -0,0 +1,69 @@
+import { PlaylistProgress } from './types';
+
+const FINISHED_STATUSES: string[] = ['completed', 'completed_with_warning', 'error'];
+
+export const isTaskFinished = (status: string) => FINISHED_STATUSES.includes(status);
+
+/**
+ * Follow a background task until it finishes, calling `onUpdate` with each change.
+ *
+ * Listens on the server-sent event stream at /playlist_progress/<id>/events, so
+ * progress arrives as it happens instead of once per poll. Falls back to polling
+ * /playlist_progress/<id> when the browser has no EventSource or the stream fails
+ * outright. EventSource reconnects on its own when the server ends a long stream,
+ * so only a stream the browser has given up on (CLOSED) counts as failed.
+ *
+ * Returns a function that stops watching; call it on unmount.
+ */
+export const watchTaskProgress = (
+  taskId: string,
+  onUpdate: (progress: PlaylistProgress) => void
+): (() => void) => {
+  let stopped = false;
+  let source: EventSource | null = null;
+  let poll: ReturnType<typeof setInterval> | null = null;
+
+  const stop = () => {
+    stopped = true;
+    source?.close();
+    if (poll) {
+      clearInterval(poll);
+    }
+  };
+
+  const handle = (data: PlaylistProgress) => {
+    if (stopped) {
+      return;
+    }
+    onUpdate({ status: data.status, progress: data.progress ?? 0, message: data.message });
+    if (isTaskFinished(data.status)) {
+      stop();
+    }
+  };
+
+  const startPolling = () => {
+    poll = setInterval(async () => {
+      try {
+        const response = await fetch(`/playlist_progress/${taskId}`);
+        handle(await response.json());
+      } catch (error) {
+        handle({ status: 'error', progress: 0, message: 'Error checking progress' });
+      }
+    }, 1000);
+  };
+
+  if (typeof EventSource === 'undefined') {
+    startPolling();
+    return stop;
+  }
+
+  source = new EventSource(`/playlist_progress/${taskId}/events`);
+  source.onmessage = (event) => handle(JSON.parse(event.data));
+  source.onerror = () => {
+    if (!stopped && source && source.readyState === EventSource.CLOSED) {
+      source = null;
+      startPolling();
+    }
+  };
+  return stop;
+};
@@ -1,9 +1,22 @@
 export interface PlaylistFile {
   name: string;
+  // From the playlist manifest; absent until it has been built.
+  station?: string | null;
+  date?: string | null;
+  trackCount?: number | null;
+}
+
+export interface PlaylistDetails {
+  key: string;
+  station: string | null;
+  date: string | null;
+  track_count: number | null;
+  size: number | null;
+  etag: string | null;
 }
 
 export interface PlaylistProgress {
-  status: 'processing' | 'completed' | 'error';
+  status: 'queued' | 'processing' | 'completed' | 'completed_with_warning' | 'error';
   progress: number;
   message: string;
 }
@@ -38,7 +51,7 @@ export interface SpotifyTrack {
 }
 
 export interface MergeProgress {
-  status: 'processing' | 'completed' | 'error';
+  status: 'queued' | 'processing' | 'completed' | 'completed_with_warning' | 'error';
   progress: number;
   message: string;
 }
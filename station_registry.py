@@ -0,0 +1,61 @@
+import hashlib
+import json
+import logging
+import os
+from zoneinfo import ZoneInfo
+
+# The stations the nightly job scrapes, one JSON object per station:
+#     {"source": "radoxo", "id": 38225, "timezone": "Etc/UTC"}
+# source is the site (see SOURCES), id the station there, and timezone the one its day
+# runs in: "yesterday" is yesterday in that timezone. An optional "shard" pins a
+# station to a shard of the night (see shard_of).
+#
+# Radoxo ids are NOT the old raddio.net ids. To add a station, find it on
+# https://radoxo.com and run:
+#     uv run python -c "import load_playlist; \
+#         print(load_playlist.get_radoxo_station_id('https://radoxo.com/<country>/<slug>'))"
+STATIONS_FILE = os.environ.get("STATIONS_FILE") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "stations.json"
+)
+
+# Scraped sites, by the host their politeness limits apply to.
+SOURCES = {'radiotut': "radiotut.com", 'radoxo': "radoxo.com"}
+
+def load_stations(path=None):
+    """
+    The stations in `path` (STATIONS_FILE by default), as dicts with source, id and
+    timezone. Raises ValueError on an entry that cannot be scraped: a mistake in the
+    registry should stop the job loudly, not drop a station silently.
+    """
+    with open(path or STATIONS_FILE, encoding='utf-8') as f:
+        entries = json.load(f)
+    stations = []
+    seen = set()
+    for entry in entries:
+        source, station_id = entry.get('source'), entry.get('id')
+        if source not in SOURCES:
+            raise ValueError(f"Unknown station source {source!r} in {path or STATIONS_FILE}")
+        if station_id in (None, '') or (source, str(station_id)) in seen:
+            raise ValueError(f"Missing or repeated station id {station_id!r} in {path or STATIONS_FILE}")
+        seen.add((source, str(station_id)))
+        station = dict(entry)
+        station['timezone'] = entry.get('timezone', 'Etc/UTC')
+        ZoneInfo(station['timezone'])  # raises on an unknown timezone
+        stations.append(station)
+    return stations
+
+def stations(source=None):
+    """The registered stations, optionally only those of `source`"""
+    return [station for station in load_stations() if source is None or station['source'] == source]
+
+def shard_of(station, shard_count):
+    """
+    The shard (0 .. shard_count - 1) a station is scraped in: its "shard" entry, or a
+    stable hash of source and id, so adding a station never moves the others.
+    """
+    if 'shard' in station:
+        if not 0 <= int(station['shard']) < shard_count:
+            logging.warning(f"Station {station['id']} is pinned to shard {station['shard']} of {shard_count}")
+        return int(station['shard']) % shard_count
+    digest = hashlib.sha256(f"{station['source']}:{station['id']}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:4], 'big') % shard_count
@@ -0,0 +1,309 @@
+import datetime
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from zoneinfo import ZoneInfo
+
+import load_playlist
+import playlist_format
+import playlist_listing
+import playlist_manifest
+import playlist_upload
+import station_registry
+
+# Stations scraped at once within one shard. Each unit is one slow page fetch plus an
+# upload, so a shard's run stays roughly flat as stations are added, up to this many.
+SCRAPE_WORKERS = int(os.environ.get("SCRAPE_WORKERS", "4"))
+
+# Politeness per scraped site: requests in flight at once, and the least time between
+# the start of two requests. All Radoxo stations share one host, and a burst of dozens
+# of requests is how a scraper gets its IP blocked.
+SCRAPE_PER_HOST_CONCURRENCY = int(os.environ.get("SCRAPE_PER_HOST_CONCURRENCY", "2"))
+SCRAPE_HOST_INTERVAL = float(os.environ.get("SCRAPE_HOST_INTERVAL_SECONDS", "1.0"))
+
+class HostLimiter:
+    """Caps concurrent requests per host and spaces out their starts."""
+    def __init__(self, max_concurrent, min_interval):
+        self.max_concurrent = max(1, max_concurrent)
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._next_start = {}
+
+    @contextmanager
+    def slot(self, host):
+        with self._lock:
+            semaphore = self._semaphores.setdefault(host, threading.Semaphore(self.max_concurrent))
+        with semaphore:
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_start.get(host, now))
+                self._next_start[host] = start + self.min_interval
+            if start > now:
+                time.sleep(start - now)
+            yield
+
+host_limiter = HostLimiter(SCRAPE_PER_HOST_CONCURRENCY, SCRAPE_HOST_INTERVAL)
+
+# When the nightly scrape starts (app.py schedules it). It scrapes yesterday, so the
+# playlist of day D is the file stamped D+1 at about this time, and the backfill names
+# the files it writes the same way.
+NIGHTLY_SCRAPE_TIME = datetime.time(23, 40)
+
+# One job firing every station at once is a burst that grows with the registry. The
+# stations are split into SCRAPE_SHARDS shards (see station_registry.shard_of), started
+# evenly across SCRAPE_WINDOW_MINUTES from NIGHTLY_SCRAPE_TIME, each delayed by up to
+# SCRAPE_JITTER_SECONDS more so the sites do not see us at the same second every night.
+# A shard starting after midnight still stamps and scrapes by its own "yesterday", so
+# the key date is always the day after the day played.
+SCRAPE_SHARDS = max(1, int(os.environ.get("SCRAPE_SHARDS", "4")))
+SCRAPE_WINDOW_MINUTES = int(os.environ.get("SCRAPE_WINDOW_MINUTES", "120"))
+SCRAPE_JITTER_SECONDS = int(os.environ.get("SCRAPE_JITTER_SECONDS", "300"))
+
+def shard_start(shard):
+    """The time of day shard `shard` of the nightly scrape starts"""
+    start = datetime.datetime.combine(datetime.date.today(), NIGHTLY_SCRAPE_TIME)
+    return (start + datetime.timedelta(minutes=SCRAPE_WINDOW_MINUTES * shard / SCRAPE_SHARDS)).time()
+
+# Days of history Radoxo serves (see load_playlist.get_playlist_from_radoxo), which is
+# how far back a backfill can reach.
+RADOXO_HISTORY_DAYS = int(os.environ.get("RADOXO_HISTORY_DAYS", "7"))
+
+# S3 user metadata holding playlist_format.content_hash of an uploaded file.
+CONTENT_HASH_METADATA = 'content-sha256'
+
+def stored_content_hashes(station):
+    """
+    The content hashes of the files already stored for `station`, each mapped to the
+    key of a file with that content: from the manifest, plus the object metadata of
+    the newest file when the manifest has no hash for it.
+    """
+    bucket_name = playlist_listing.PLAYLIST_BUCKET
+    hashes = {}
+    try:
+        entries = playlist_manifest.manifest.entries() or []
+    except Exception as e:
+        logging.warning(f"Cannot read the playlist manifest for content hashes: {e}")
+        entries = []
+    for entry in entries:
+        if entry.get('station') == station and entry.get('sha256'):
+            hashes[entry['sha256']] = entry['key']
+
+    prefix = f"playlist_{station}_"
+    keys = [key for key in playlist_listing.listing.keys() if playlist_listing.station_prefix(key) == prefix]
+    if keys and not any(entry['key'] == keys[-1] and entry.get('sha256') for entry in entries):
+        try:
+            head = playlist_upload.get_s3_client().head_object(Bucket=bucket_name, Key=keys[-1])
+            if head.get('Metadata', {}).get(CONTENT_HASH_METADATA):
+                hashes[head['Metadata'][CONTENT_HASH_METADATA]] = keys[-1]
+        except Exception as e:
+            logging.warning(f"Cannot read the content hash of {keys[-1]}: {e}")
+    return hashes
+
+def upload_playlist(filename, manifest_entries=None):
+    """
+    Upload a scraped file and register it with the listing and manifest.
+
+    With a `manifest_entries` list, the file's manifest entry is appended to it for the
+    caller to write along with others (see _scrape_units) instead of being written here.
+
+    Returns (key, status). A scrape whose rows are identical to a file already stored
+    for the station - a manual /load_playlist on the same day as the cron job - is not
+    uploaded: status is 'unchanged', nothing is written to the bucket and the key is
+    that of the stored file. Otherwise status is 'uploaded'.
+    """
+    key = os.path.basename(filename)
+    with open(filename, 'rb') as f:
+        sha256 = playlist_format.content_hash(playlist_format.read_playlist(f.read(), key))
+    match = playlist_listing.PLAYLIST_KEY_PATTERN.match(key)
+    stored_key = stored_content_hashes(match['station']).get(sha256) if match else None
+    if stored_key:
+        logging.info(f"{key} is identical to {stored_key}, already stored - not uploaded")
+        return stored_key, 'unchanged'
+
+    if not playlist_upload.upload_file_to_s3(
+        filename, playlist_listing.PLAYLIST_BUCKET, key,
+        content_type=playlist_format.content_type(filename),
+        metadata={CONTENT_HASH_METADATA: sha256}
+    ):
+        raise RuntimeError(f"upload of {key} failed")
+    # Other workers pick it up on their next incremental refresh.
+    playlist_listing.listing.add(key)
+    if manifest_entries is None:
+        playlist_manifest.record_upload(playlist_listing.PLAYLIST_BUCKET, key, filename)
+    else:
+        try:
+            manifest_entries.append(playlist_manifest.describe_upload(playlist_listing.PLAYLIST_BUCKET, key, filename))
+        except Exception as e:
+            # Uploaded all the same; the listing shows it and a rebuild describes it.
+            logging.error(f"Error describing {key} for the playlist manifest: {e}")
+    return key, 'uploaded'
+
+def scrape_radiotut(station_id, timezone):
+    """Scrape a radiotut station's yesterday and write it to DATA_DIR, returning the file name"""
+    # load_playlist() raises NoTracksFoundError on an empty scrape and only writes a
+    # file when it has tracks, so there is nothing to re-read here. Reading it back
+    # was worse than redundant: a bare open() uses the platform default encoding,
+    # which is ASCII in the container, and the Cyrillic track names blew up on it.
+    with host_limiter.slot(station_registry.SOURCES['radiotut']):
+        return load_playlist.load_playlist(station_id, timezone)
+
+def scrape_radoxo(station_id, date, timestamp=None):
+    """
+    Scrape one Radoxo station's `date` (YYYY-MM-DD) and write it, returning the file
+    name. The file is stamped `timestamp` (a datetime), or now.
+    """
+    with host_limiter.slot(station_registry.SOURCES['radoxo']):
+        playlist_df = load_playlist.get_playlist_from_radoxo(station_id, date)
+
+    # Guard the upload itself as well, so a future scraper change that returns an
+    # empty frame instead of raising still cannot write a junk file to S3.
+    if playlist_df.empty:
+        raise load_playlist.NoTracksFoundError("scrape produced no tracks - not uploaded")
+
+    timestamp = (timestamp or datetime.datetime.now()).strftime("%Y%m%d_%H%M%S")
+    # .csv, .csv.gz or .parquet depending on PLAYLIST_FORMAT.
+    return playlist_format.write_playlist(
+        playlist_df, os.path.join(load_playlist.DATA_DIR, f"playlist_{station_id}_{timestamp}")
+    )
+
+def scrape_station(station):
+    """Scrape a registry station's yesterday (in its timezone), returning the file name"""
+    if station['source'] == 'radiotut':
+        return scrape_radiotut(station['id'], station['timezone'])
+    yesterday = datetime.datetime.now(ZoneInfo(station['timezone'])) - datetime.timedelta(days=1)
+    return scrape_radoxo(station['id'], yesterday.strftime("%Y-%m-%d"))
+
+def scrape_and_upload_playlists(results=None, shard=None, stations=None):
+    """
+    Scrape the registered stations and upload the results to S3: all of `stations`
+    (station_registry.stations() by default), or only those in `shard`.
+
+    A playlist is only uploaded when it actually contains tracks: an empty scrape is a
+    bug in the scraper or a retired station, and writing it produced the 877 one-byte
+    CSVs that accumulated after raddio.net became Radoxo. One failing station does not
+    abort the others.
+
+    Sources are scraped concurrently on SCRAPE_WORKERS threads, within the per-host
+    limits of host_limiter. If `results` is a list, one dict per source is appended to
+    it, in source order: source, status ('uploaded', 'unchanged' - identical to a file
+    already stored, see upload_playlist - or 'failed'), seconds, and the key (of the
+    stored file it matched, for 'unchanged') or the error.
+
+    Returns (uploaded, failures) where failures is a list of (source, reason).
+    """
+    if stations is None:
+        stations = station_registry.stations()
+    if shard is not None:
+        stations = [station for station in stations if station_registry.shard_of(station, SCRAPE_SHARDS) == shard]
+    units = [
+        (str(station['id']), lambda station=station: scrape_station(station))
+        for station in stations
+    ]
+    return _scrape_units(units, results)
+
+def _scrape_units(units, results):
+    """Run (source, scrape) units on SCRAPE_WORKERS threads and upload what they write"""
+    # Written to the manifest once, after the last unit: each upload writing its own
+    # entry had the threads racing each other on the manifest's conditional PUT.
+    manifest_entries = []
+
+    def run(unit):
+        source, scrape = unit
+        started = time.monotonic()
+        try:
+            key, status = upload_playlist(scrape(), manifest_entries)
+            outcome = {'source': source, 'status': status, 'key': key}
+        except Exception as e:
+            logging.error(f"Error scraping {source}: {e}")
+            outcome = {'source': source, 'status': 'failed', 'error': str(e)}
+        outcome['seconds'] = round(time.monotonic() - started, 3)
+        logging.info(f"Scrape of {source}: {outcome['status']} in {outcome['seconds']}s")
+        return outcome
+
+    with ThreadPoolExecutor(max_workers=max(1, SCRAPE_WORKERS), thread_name_prefix='scrape') as pool:
+        outcomes = list(pool.map(run, units))
+    playlist_manifest.record_uploads(playlist_listing.PLAYLIST_BUCKET, manifest_entries)
+
+    if results is not None:
+        results.extend(outcomes)
+    uploaded = [outcome['key'] for outcome in outcomes if outcome['status'] == 'uploaded']
+    failures = [(outcome['source'], outcome['error']) for outcome in outcomes if outcome['status'] == 'failed']
+    return uploaded, failures
+
+def scraped_station_days():
+    """
+    The (station, date) pairs already in the bucket, date being the day played
+    (YYYY-MM-DD): one day before the date in the key.
+
+    Read from the listing, which is current within seconds. Files the manifest records
+    with no tracks (the old empty scrapes) do not count, so those days are scraped again.
+    """
+    empty = set()
+    try:
+        entries = playlist_manifest.manifest.entries() or []
+        empty = {entry['key'] for entry in entries if entry.get('track_count') == 0}
+    except Exception as e:
+        logging.warning(f"Cannot read the playlist manifest, counting every file as scraped: {e}")
+
+    scraped = set()
+    for key in playlist_listing.listing.keys():
+        match = playlist_listing.PLAYLIST_KEY_PATTERN.match(key)
+        if not match or key in empty:
+            continue
+        played = datetime.datetime.strptime(match['date'], "%Y%m%d").date() - datetime.timedelta(days=1)
+        scraped.add((match['station'], played.isoformat()))
+    return scraped
+
+def backfill_radoxo(days=RADOXO_HISTORY_DAYS, station_ids=None, results=None):
+    """
+    Scrape every Radoxo station-day of the last `days` days that is not in the bucket.
+
+    A missed night (an outage, a failed scrape) is otherwise lost once it falls out of
+    Radoxo's window. Station-days already scraped are skipped without a request, so
+    after downtime one run catches up, and running it again does nothing. Days whose
+    nightly run may still be to come (yesterday, before the last shard) are left to it.
+    Everything left is scraped at once, within the same worker and per-host limits as
+    the nightly job.
+
+    `results` gets one dict per station-day as in scrape_and_upload_playlists, status
+    'skipped' included. Returns (uploaded, failures).
+    """
+    now = datetime.datetime.now()
+    scraped = scraped_station_days()
+    units = []
+    skipped = []
+    for offset in range(1, days + 1):
+        played = now.date() - datetime.timedelta(days=offset)
+        # Named as the nightly job would have named it, so the day sorts where it belongs.
+        stamp = datetime.datetime.combine(played + datetime.timedelta(days=1), NIGHTLY_SCRAPE_TIME)
+        if stamp + datetime.timedelta(minutes=SCRAPE_WINDOW_MINUTES, seconds=SCRAPE_JITTER_SECONDS) > now:
+            continue
+        for station_id in station_ids or [station['id'] for station in station_registry.stations('radoxo')]:
+            source = f"{station_id}/{played.isoformat()}"
+            if (str(station_id), played.isoformat()) in scraped:
+                skipped.append({'source': source, 'status': 'skipped', 'seconds': 0.0})
+                continue
+            units.append((source, lambda station_id=station_id, played=played, stamp=stamp:
+                          scrape_radoxo(station_id, played.isoformat(), stamp)))
+
+    logging.info(f"Radoxo backfill: {len(units)} station-day(s) to scrape, {len(skipped)} already scraped")
+    uploaded, failures = _scrape_units(units, results)
+    if results is not None:
+        results.extend(skipped)
+    return uploaded, failures
+
+if __name__ == '__main__':
+    # uv run python station_scraper.py backfill [days]
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2 or sys.argv[1] != 'backfill':
+        sys.exit("usage: python station_scraper.py backfill [days]")
+    uploaded, failures = backfill_radoxo(int(sys.argv[2]) if len(sys.argv) > 2 else RADOXO_HISTORY_DAYS)
+    for source, reason in failures:
+        print(f"failed: {source}: {reason}")
+    print(f"{len(uploaded)} playlist(s) backfilled, {len(failures)} failed")
+    sys.exit(1 if failures else 0)
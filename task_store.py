@@ -0,0 +1,323 @@
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+
+# Progress for background playlist jobs. A dict in one process is invisible to the
+# other uWSGI workers (-p 4 in the Dockerfile), so a /playlist_progress poll that landed
+# on a different worker than the job answered 404. SQLite on the data volume is shared
+# by every worker and survives restarts.
+TASK_STORE_PATH = os.environ.get("TASK_STORE_PATH") or os.path.join(
+    os.environ.get("PLAYLIST_DATA_DIR", "/var/data"), "tasks.sqlite3"
+)
+
+# Finished tasks are kept long enough for the page that started them to read the
+# outcome; anything untouched for a day belongs to a job whose worker died.
+TASK_TTL = int(os.environ.get("TASK_TTL_SECONDS", "3600"))
+TASK_STALE_TTL = 24 * 3600
+
+# Every live task of a process running jobs is rewritten each minute by the job
+# executor's heartbeat (see touch_all), queued or running: a running job can go quiet
+# for far longer on its own, sleeping through Spotify's Retry-After. One silent for this
+# long died with its process, usually a container restart, and is reported as
+# interrupted rather than left spinning.
+TASK_STALL_SECONDS = int(os.environ.get("TASK_STALL_SECONDS", "600"))
+
+# Checkpoints of unfinished jobs (see save_checkpoint) are kept this long for a rerun
+# to resume from.
+CHECKPOINT_TTL = 7 * 24 * 3600
+
+# Progress is reported once per track. Writes that only move the bar are coalesced to
+# at most one per interval per task; status changes are always written at once.
+TASK_PROGRESS_FLUSH_SECONDS = float(os.environ.get("TASK_PROGRESS_FLUSH_SECONDS", "0.5"))
+
+TERMINAL_STATUSES = frozenset({'completed', 'completed_with_warning', 'error'})
+
+INTERRUPTED_MESSAGE = (
+    'This job was interrupted, most likely by a server restart. Start it again - it '
+    'resumes from where it stopped.'
+)
+
+class TaskStore:
+    """
+    Task progress records shared by every worker process.
+
+    create() starts a record, update() merges fields into it, get() returns a dict or
+    None. Only the process running a job writes its record, so update() merges into a
+    local copy instead of reading the row back first.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # Notified on every create/update in this process, so progress streams served
+        # by the worker running the job see each step as it happens.
+        self._changed = threading.Condition(self._lock)
+        self._local = {}
+        self._ready = False
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def _ensure_ready(self):
+        if self._ready:
+            return
+        with self._lock:
+            if self._ready:
+                return
+            try:
+                self._create_schema()
+            except Exception as e:
+                # Without the data volume (local development) fall back to the temp dir,
+                # which every worker on this host still shares.
+                fallback = os.path.join(tempfile.gettempdir(), "radio-to-spotify-tasks.sqlite3")
+                logging.warning(f"Task store cannot use {self.path} ({e}) - using {fallback}")
+                self.path = fallback
+                self._create_schema()
+            self._ready = True
+
+    def _create_schema(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                " task_id TEXT PRIMARY KEY,"
+                " status TEXT NOT NULL,"
+                " data TEXT NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS tasks_updated_at ON tasks (updated_at)")
+            # One row per job running in any worker, for limits that must hold across
+            # all of them (see claim_job).
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS running_jobs ("
+                " task_id TEXT PRIMARY KEY,"
+                " user_key TEXT NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoints ("
+                " job_key TEXT PRIMARY KEY,"
+                " data TEXT NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+
+    def _write(self, task_id, fields):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO tasks (task_id, status, data, updated_at) VALUES (?, ?, ?, ?)",
+                (task_id, fields.get('status', 'processing'), json.dumps(fields), time.time())
+            )
+
+    def create(self, task_id, fields):
+        """Start (or restart) the record for a task"""
+        fields = dict(fields)
+        self._ensure_ready()
+        with self._lock:
+            self._write(task_id, fields)
+            self._local[task_id] = {'fields': fields, 'flushed_at': time.monotonic()}
+            self._changed.notify_all()
+        self.evict()
+
+    def update(self, task_id, fields):
+        """
+        Merge `fields` into a task's record.
+
+        A change of status is written immediately; progress-only changes are written at
+        most every TASK_PROGRESS_FLUSH_SECONDS, and a pending one is carried by the next
+        write. A task this process has no record of is read back from the store first.
+        """
+        self._ensure_ready()
+        with self._lock:
+            owned = task_id in self._local
+        if not owned:
+            # Not a job of this process (say, an error handler reporting on a task): write
+            # straight through and keep no local copy that could go stale.
+            current = self.get(task_id)
+            if current is not None:
+                current.update(fields)
+                with self._lock:
+                    self._write(task_id, current)
+            return
+
+        # Held across the write so concurrent reporters (the search pool) cannot land
+        # their rows out of order.
+        with self._lock:
+            entry = self._local[task_id]
+            status_changed = 'status' in fields and fields['status'] != entry['fields'].get('status')
+            entry['fields'].update(fields)
+            now = time.monotonic()
+            if status_changed or now - entry['flushed_at'] >= TASK_PROGRESS_FLUSH_SECONDS:
+                self._write(task_id, entry['fields'])
+                entry['flushed_at'] = now
+            if entry['fields'].get('status') in TERMINAL_STATUSES:
+                # Nothing more will be written; the store holds the final record.
+                del self._local[task_id]
+            self._changed.notify_all()
+
+    def get(self, task_id):
+        """
+        The task's fields as a dict, or None when there is no such (live) task.
+
+        A task that is still queued or processing but has not been written for
+        TASK_STALL_SECONDS is reported as an error: its process is gone.
+        """
+        with self._lock:
+            entry = self._local.get(task_id)
+            if entry is not None:
+                # Includes progress that has not been flushed yet.
+                return dict(entry['fields'])
+
+        self._ensure_ready()
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT data, updated_at FROM tasks WHERE task_id = ?", (task_id,)
+            ).fetchone()
+        if not row:
+            return None
+        fields = json.loads(row[0])
+        if fields.get('status') not in TERMINAL_STATUSES and time.time() - row[1] > TASK_STALL_SECONDS:
+            fields.update({'status': 'error', 'message': INTERRUPTED_MESSAGE})
+        return fields
+
+    def touch_all(self):
+        """Rewrite every live task of this process unchanged, to show it is still alive"""
+        with self._lock:
+            if not self._local:
+                return
+            now = time.time()
+            with closing(self._connect()) as conn, conn:
+                # One transaction: a bulk job holds a live task per file.
+                conn.executemany(
+                    "INSERT OR REPLACE INTO tasks (task_id, status, data, updated_at) VALUES (?, ?, ?, ?)",
+                    [
+                        (task_id, entry['fields'].get('status', 'processing'), json.dumps(entry['fields']), now)
+                        for task_id, entry in self._local.items()
+                    ]
+                )
+            flushed_at = time.monotonic()
+            for entry in self._local.values():
+                entry['flushed_at'] = flushed_at
+
+    def claim_job(self, task_id, user_key, limit):
+        """
+        Record `task_id` as running for `user_key`, unless that user already has `limit`
+        jobs running in any worker process. Returns whether the job may start.
+
+        A claim not renewed (see renew_jobs) for TASK_STALL_SECONDS belongs to a dead
+        process and no longer counts.
+        """
+        self._ensure_ready()
+        now = time.time()
+        with closing(self._connect()) as conn:
+            # IMMEDIATE takes the write lock before counting, so two workers cannot
+            # both see a free slot and both take it.
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM running_jobs WHERE updated_at < ?", (now - TASK_STALL_SECONDS,))
+                (running,) = conn.execute(
+                    "SELECT COUNT(*) FROM running_jobs WHERE user_key = ?", (user_key,)
+                ).fetchone()
+                claimed = running < limit
+                if claimed:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO running_jobs (task_id, user_key, updated_at) VALUES (?, ?, ?)",
+                        (task_id, user_key, now)
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return claimed
+
+    def renew_jobs(self, task_ids):
+        """Keep this process's claims (see claim_job) from being taken for a dead process's"""
+        if not task_ids:
+            return
+        self._ensure_ready()
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "UPDATE running_jobs SET updated_at = ? WHERE task_id = ?",
+                [(now, task_id) for task_id in task_ids]
+            )
+
+    def release_job(self, task_id):
+        """Drop the claim of a job that has finished"""
+        self._ensure_ready()
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM running_jobs WHERE task_id = ?", (task_id,))
+
+    def running_jobs(self):
+        """(jobs, users) running in all worker processes together"""
+        self._ensure_ready()
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT user_key) FROM running_jobs WHERE updated_at >= ?",
+                (time.time() - TASK_STALL_SECONDS,)
+            ).fetchone()
+
+    def load_checkpoint(self, job_key):
+        """The checkpoint saved for `job_key`, or None"""
+        self._ensure_ready()
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT data FROM checkpoints WHERE job_key = ? AND updated_at > ?",
+                (job_key, time.time() - CHECKPOINT_TTL)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_checkpoint(self, job_key, data):
+        """
+        Persist how far a job has got, so a rerun after a restart can resume from it.
+
+        Keyed by what the job does (see create_playlist_from_csv), not by task id: a
+        rerun is a new task.
+        """
+        self._ensure_ready()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (job_key, data, updated_at) VALUES (?, ?, ?)",
+                (job_key, json.dumps(data), time.time())
+            )
+
+    def clear_checkpoint(self, job_key):
+        """Drop a job's checkpoint once it has finished"""
+        self._ensure_ready()
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM checkpoints WHERE job_key = ?", (job_key,))
+
+    def wait(self, timeout):
+        """
+        Block until a task changes in this process, or `timeout` seconds pass.
+
+        Changes made by other workers only show up through the store, so callers
+        re-read with get() after every wake-up and keep `timeout` short.
+        """
+        with self._changed:
+            self._changed.wait(timeout)
+
+    def __contains__(self, task_id):
+        return self.get(task_id) is not None
+
+    def evict(self):
+        """Delete finished tasks older than TASK_TTL and any task stale for a day"""
+        self._ensure_ready()
+        now = time.time()
+        terminal = tuple(TERMINAL_STATUSES)
+        with closing(self._connect()) as conn, conn:
+            removed = conn.execute(
+                f"DELETE FROM tasks WHERE (status IN ({', '.join('?' * len(terminal))}) AND updated_at < ?)"
+                " OR updated_at < ?",
+                (*terminal, now - TASK_TTL, now - TASK_STALE_TTL)
+            ).rowcount
+            conn.execute("DELETE FROM checkpoints WHERE updated_at < ?", (now - CHECKPOINT_TTL,))
+        if removed:
+            logging.info(f"Task store evicted {removed} finished task(s)")
+        return removed
+
+tasks = TaskStore(TASK_STORE_PATH)
@@ -0,0 +1,75 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import spotify_playlist
+import task_store
+
+TRACKS = 250
+
+def _csv():
+    lines = ['artist_name,song_name']
+    lines += [f'Artist {n},Song {n}' for n in range(TRACKS)]
+    return '\n'.join(lines) + '\n'
+
+class ResumedBuildTest(unittest.TestCase):
+    """A resumed build adds exactly the tracks the interrupted one had not added"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = task_store.TaskStore(os.path.join(directory.name, 'tasks.db'))
+        self.sp = mock.Mock()
+        self.sp.current_user.return_value = {'id': 'user'}
+        self.sp.user_playlist_create.return_value = {'id': 'playlist'}
+        self.added = []
+        self.failing_song = None
+        self.fail_after_batches = None
+
+        def add_items(playlist_id, batch):
+            if self.fail_after_batches is not None and len(self.added) >= self.fail_after_batches:
+                raise RuntimeError('connection reset')
+            self.added.append(list(batch))
+
+        def resolve_track(sp, artist, track):
+            if track == self.failing_song:
+                return spotify_playlist.SEARCH_FAILED
+            return f'spotify:track:{track.split()[-1]}'
+
+        self.sp.playlist_add_items.side_effect = add_items
+        for patcher in (
+            mock.patch.object(spotify_playlist, 'tasks', store),
+            mock.patch.object(spotify_playlist, 'create_spotify_client_with_session', return_value=self.sp),
+            mock.patch.object(spotify_playlist, 'resolve_track', side_effect=resolve_track),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def build(self, task_id):
+        return spotify_playlist.create_playlist_from_csv(
+            _csv(), 'Station', task_id, session_data={}, checkpoint_key='station-build'
+        )
+
+    def test_search_succeeding_on_resume_does_not_shift_the_batches(self):
+        # The first run loses one search and is cut off after its first batch.
+        self.failing_song = 'Song 5'
+        self.fail_after_batches = 1
+        self.assertFalse(self.build('first'))
+        self.assertEqual(len(self.added), 1)
+
+        # The search works this time, but the playlist is half built without it.
+        self.failing_song = None
+        self.fail_after_batches = None
+        self.assertTrue(self.build('second'))
+
+        sent = [uri for batch in self.added for uri in batch]
+        expected = [f'spotify:track:{n}' for n in range(TRACKS) if n != 5]
+        self.assertEqual(sent, expected)
+        self.sp.user_playlist_create.assert_called_once()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import io
+import json
+import os
+import sys
+import threading
+import unittest
+from unittest import mock
+
+from urllib3.connectionpool import HTTPConnectionPool
+from urllib3.response import HTTPResponse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import spotipy
+
+import spotify_playlist
+import track_resolver
+from track_resolver import RateLimitedError, TokenBucket, call_with_rate_limit, resolve_tracks
+
+def _response(status, body, headers=None):
+    return HTTPResponse(
+        body=io.BytesIO(json.dumps(body).encode("utf-8")),
+        headers={'Content-Type': 'application/json', **(headers or {})},
+        status=status,
+        preload_content=False,
+        decode_content=True,
+    )
+
+class RateLimitedClientTest(unittest.TestCase):
+    """A 429 must reach call_with_rate_limit after one HTTP attempt, Retry-After intact"""
+
+    def setUp(self):
+        self.sp = spotipy.Spotify(auth='token', requests_session=spotify_playlist.rate_limited_session())
+        self.responses = []
+        self.attempts = 0
+
+        def make_request(pool, conn, method, url, **kwargs):
+            self.attempts += 1
+            return self.responses.pop(0)
+
+        patcher = mock.patch.object(HTTPConnectionPool, '_make_request', make_request)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Nothing may actually sleep in a test: the limiter runs on a clock that a
+        # sleep moves forward, and urllib3 must not sleep at all.
+        self.sleeps = []
+        self.clock = 1000.0
+
+        def sleep(seconds):
+            self.sleeps.append(seconds)
+            self.clock += seconds
+
+        fake_time = mock.Mock(monotonic=lambda: self.clock, sleep=sleep)
+        for patcher in (
+            mock.patch.object(track_resolver, 'time', fake_time),
+            mock.patch('urllib3.util.retry.time.sleep', side_effect=self.fail),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.limiter = TokenBucket(rate=0, capacity=1)
+
+    def test_retry_after_pauses_the_limiter_and_retries_once(self):
+        self.responses = [
+            _response(429, {'error': {'status': 429, 'message': 'slow down'}}, {'Retry-After': '7'}),
+            _response(200, {'tracks': {'items': []}}),
+        ]
+        with mock.patch.object(self.limiter, 'pause', wraps=self.limiter.pause) as pause:
+            result = call_with_rate_limit(self.sp.search, q='x', limiter=self.limiter)
+        self.assertEqual(result, {'tracks': {'items': []}})
+        # One HTTP attempt per call_with_rate_limit attempt: urllib3 did not retry the 429.
+        self.assertEqual(self.attempts, 2)
+        pause.assert_called_once_with(7)
+        self.assertTrue(self.sleeps)
+        self.assertLessEqual(max(self.sleeps), 7)
+
+    def test_retry_after_beyond_the_cap_fails_without_sleeping(self):
+        wait = track_resolver.SPOTIFY_MAX_RETRY_AFTER + 100
+        self.responses = [
+            _response(429, {'error': {'status': 429, 'message': 'slow down'}}, {'Retry-After': str(wait)}),
+        ]
+        with self.assertRaises(RateLimitedError):
+            call_with_rate_limit(self.sp.search, q='x', limiter=self.limiter)
+        self.assertEqual(self.attempts, 1)
+        self.assertEqual(self.sleeps, [])
+
+class ResolveTracksTest(unittest.TestCase):
+    """The first RateLimitedError stops the searches still queued"""
+
+    def test_rate_limit_cancels_pending_searches(self):
+        searched = []
+
+        def resolve(index):
+            searched.append(index)
+            if index == 0:
+                raise RateLimitedError('Retry-After beyond the cap')
+            # Long enough that the single worker is still on this search when the
+            # failure is seen; it may finish, but nothing after it may start.
+            event.wait(0.05)
+            return index
+
+        event = threading.Event()
+        with self.assertRaises(RateLimitedError):
+            resolve_tracks([(index,) for index in range(50)], resolve, max_workers=1)
+        self.assertIn(searched, ([0], [0, 1]))
+
+    def test_results_keep_the_order_of_the_items(self):
+        results = resolve_tracks([(index,) for index in range(20)], lambda index: index * 2, max_workers=4)
+        self.assertEqual(results, [index * 2 for index in range(20)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,185 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+from track_resolver import normalize_track
+
+# The same stations play the same few hundred songs every day, so almost every search
+# create_playlist_from_csv makes has been made before. Keep the answers in SQLite on the
+# data volume (docker-compose mounts ./data at /var/data) so they survive restarts and
+# are shared by every uWSGI worker.
+TRACK_CACHE_PATH = os.environ.get("TRACK_CACHE_PATH") or os.path.join(
+    os.environ.get("PLAYLIST_DATA_DIR", "/var/data"), "track_cache.sqlite3"
+)
+
+# A match is stable for months; "no match" is cached briefly, because the usual cause
+# is a release that Spotify simply has not ingested yet.
+TRACK_CACHE_TTL = int(os.environ.get("TRACK_CACHE_TTL_DAYS", "90")) * 86400
+TRACK_CACHE_NEGATIVE_TTL = int(os.environ.get("TRACK_CACHE_NEGATIVE_TTL_HOURS", "24")) * 3600
+TRACK_CACHE_MAX_ENTRIES = int(os.environ.get("TRACK_CACHE_MAX_ENTRIES", "50000"))
+
+# Run eviction every this many stores rather than on every write.
+_EVICT_EVERY = 500
+
+# Returned by lookup() when the cache has no usable answer. None is a real answer
+# ("Spotify has no such track"), so it cannot double as the miss marker.
+MISS = object()
+
+_lock = threading.Lock()
+_ready = False
+_disabled = False
+_stores_since_evict = 0
+_counters = {'hits': 0, 'negative_hits': 0, 'misses': 0, 'stores': 0, 'evicted': 0}
+
+def _key(artist, song):
+    """Cache key: the same normalize_track key duplicate plays are grouped by"""
+    return normalize_track(artist, song) or (str(artist), str(song))
+
+def _connect():
+    return sqlite3.connect(TRACK_CACHE_PATH, timeout=10)
+
+def _ensure_ready():
+    """
+    Create the schema once per process. Returns False when the cache is unusable.
+
+    A cache that cannot be opened (no data volume in local development, a read-only
+    mount) disables itself with one warning: it is an optimisation, and a playlist
+    build must never fail because of it.
+    """
+    global _ready, _disabled
+    if _ready:
+        return True
+    if _disabled:
+        return False
+    with _lock:
+        if _ready or _disabled:
+            return _ready
+        try:
+            os.makedirs(os.path.dirname(TRACK_CACHE_PATH) or '.', exist_ok=True)
+            with closing(_connect()) as conn, conn:
+                # WAL lets the other workers keep reading while one of them writes.
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS tracks ("
+                    " artist TEXT NOT NULL,"
+                    " song TEXT NOT NULL,"
+                    " uri TEXT,"
+                    " expires_at REAL NOT NULL,"
+                    " last_used REAL NOT NULL,"
+                    " PRIMARY KEY (artist, song))"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS tracks_last_used ON tracks (last_used)")
+            _ready = True
+        except Exception as e:
+            _disabled = True
+            logging.warning(f"Track cache disabled - cannot open {TRACK_CACHE_PATH}: {e}")
+    return _ready
+
+def _count(name, n=1):
+    with _lock:
+        _counters[name] += n
+
+def lookup(artist, song):
+    """
+    Return the cached URI for a track, None for a cached "no match", or MISS.
+    """
+    if not _ensure_ready():
+        _count('misses')
+        return MISS
+
+    key = _key(artist, song)
+    now = time.time()
+    try:
+        with closing(_connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT uri FROM tracks WHERE artist = ? AND song = ? AND expires_at > ?",
+                (*key, now)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE tracks SET last_used = ? WHERE artist = ? AND song = ?",
+                    (now, *key)
+                )
+    except Exception as e:
+        logging.warning(f"Track cache lookup failed for {song} by {artist}: {e}")
+        row = None
+
+    if row is None:
+        _count('misses')
+        return MISS
+    _count('hits' if row[0] else 'negative_hits')
+    return row[0]
+
+def store(artist, song, uri):
+    """
+    Remember the search result for a track; pass uri=None to record "no match".
+
+    Only store answers Spotify actually gave. A search that raised says nothing about
+    the track and must not be cached as a miss.
+    """
+    global _stores_since_evict
+    if not _ensure_ready():
+        return
+
+    now = time.time()
+    ttl = TRACK_CACHE_TTL if uri else TRACK_CACHE_NEGATIVE_TTL
+    try:
+        with closing(_connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO tracks (artist, song, uri, expires_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (*_key(artist, song), uri, now + ttl, now)
+            )
+    except Exception as e:
+        logging.warning(f"Track cache store failed for {song} by {artist}: {e}")
+        return
+
+    _count('stores')
+    with _lock:
+        _stores_since_evict += 1
+        due = _stores_since_evict >= _EVICT_EVERY
+        if due:
+            _stores_since_evict = 0
+    if due:
+        evict()
+
+def evict():
+    """Drop expired entries, then the least recently used ones above TRACK_CACHE_MAX_ENTRIES"""
+    if not _ensure_ready():
+        return 0
+    try:
+        with closing(_connect()) as conn, conn:
+            removed = conn.execute(
+                "DELETE FROM tracks WHERE expires_at <= ?", (time.time(),)
+            ).rowcount
+            (entries,) = conn.execute("SELECT COUNT(*) FROM tracks").fetchone()
+            if entries > TRACK_CACHE_MAX_ENTRIES:
+                removed += conn.execute(
+                    "DELETE FROM tracks WHERE rowid IN ("
+                    " SELECT rowid FROM tracks ORDER BY last_used LIMIT ?)",
+                    (entries - TRACK_CACHE_MAX_ENTRIES,)
+                ).rowcount
+    except Exception as e:
+        logging.warning(f"Track cache eviction failed: {e}")
+        return 0
+
+    if removed:
+        _count('evicted', removed)
+        logging.info(f"Track cache evicted {removed} entries")
+    return removed
+
+def stats():
+    """Hit/miss counters for this process, plus the number of entries on disk"""
+    with _lock:
+        result = dict(_counters)
+    result['entries'] = None
+    if _ensure_ready():
+        try:
+            with closing(_connect()) as conn:
+                (result['entries'],) = conn.execute("SELECT COUNT(*) FROM tracks").fetchone()
+        except Exception as e:
+            logging.warning(f"Track cache stats failed: {e}")
+    return result
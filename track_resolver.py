@@ -0,0 +1,192 @@
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+from spotipy.exceptions import SpotifyException
+
+# Searches in flight at once for one playlist build. spotipy's connection pool holds 10
+# connections per host, so going above that only buys "pool is full" warnings.
+SPOTIFY_SEARCH_CONCURRENCY = int(os.environ.get("SPOTIFY_SEARCH_CONCURRENCY", "4"))
+
+# Sustained Spotify requests per second for this process, and how many may go out back
+# to back after an idle spell. 0 turns the limiter off (Retry-After is still honoured).
+SPOTIFY_REQUEST_RATE = float(os.environ.get("SPOTIFY_REQUEST_RATE", "5"))
+SPOTIFY_REQUEST_BURST = int(os.environ.get("SPOTIFY_REQUEST_BURST", "10"))
+
+# How often one call is retried after a 429, and the longest Retry-After we are willing
+# to sleep through. Spotify occasionally asks for hours; failing the job with a clear
+# message beats a worker thread that silently sleeps until tomorrow.
+SPOTIFY_RATE_LIMIT_RETRIES = 5
+SPOTIFY_MAX_RETRY_AFTER = int(os.environ.get("SPOTIFY_MAX_RETRY_AFTER", "300"))
+
+# "feat. X", "ft X", "(featuring X)", "[Feat. X]" to the end of the string. Stations
+# disagree on whether the guest belongs in the artist or the title, and on the spelling.
+_FEATURING = re.compile(r"\s*[\(\[]?\s*\b(?:feat|ft|featuring)\b\.?\s.*$", re.IGNORECASE)
+_APOSTROPHES = re.compile(r"['\u2019`\u00b4]")
+_NON_WORD = re.compile(r"[\W_]+")
+
+def normalize_track(artist, song):
+    """
+    Key under which two plays count as the same track.
+
+    Case, whitespace, punctuation and featured-artist credits are ignored, and "ё" is
+    folded into "е" the way Russian station logs use them interchangeably. Returns
+    None when either part is missing, since such a row cannot be searched.
+    """
+    parts = []
+    for value in (artist, song):
+        if not isinstance(value, str):
+            return None
+        value = unicodedata.normalize('NFKC', value).casefold().replace('ё', 'е')
+        value = _FEATURING.sub('', value)
+        value = _APOSTROPHES.sub('', value)
+        value = ' '.join(_NON_WORD.sub(' ', value).split())
+        if not value:
+            return None
+        parts.append(value)
+    return tuple(parts)
+
+def group_duplicate_tracks(rows):
+    """
+    Collapse repeated plays of the same track before anything is searched.
+
+    `rows` is a sequence of (artist, song). Returns (unique_rows, row_keys): one row per
+    distinct normalize_track key, in order of first play and spelled as first seen,
+    and the key of every input row (None for unsearchable rows), so results resolved
+    for unique_rows can be expanded back to the full play order.
+    """
+    unique = {}
+    row_keys = []
+    for artist, song in rows:
+        key = normalize_track(artist, song)
+        row_keys.append(key)
+        if key is not None and key not in unique:
+            unique[key] = (artist, song)
+    return list(unique.values()), row_keys
+
+class RateLimitedError(Exception):
+    """Raised when Spotify keeps answering 429, or asks us to wait too long."""
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: acquire() blocks until a request may be sent.
+
+    pause() empties the bucket and holds every caller until a deadline, which is how a
+    429's Retry-After from one thread slows down all of them instead of only itself.
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self.rate <= 0:
+                    return
+                else:
+                    self._tokens = min(
+                        self.capacity, self._tokens + (now - self._updated) * self.rate
+                    )
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self._lock:
+            until = time.monotonic() + seconds
+            if until > self._paused_until:
+                self._paused_until = until
+            self._tokens = 0.0
+            self._updated = max(self._updated, self._paused_until)
+
+# One bucket per process: every job in this worker draws on the same Spotify quota.
+spotify_limiter = TokenBucket(SPOTIFY_REQUEST_RATE, SPOTIFY_REQUEST_BURST)
+
+def _retry_after(error, attempt):
+    """Seconds to wait after a 429: the Retry-After header, else exponential backoff"""
+    value = (error.headers or {}).get('Retry-After')
+    try:
+        return max(1, int(value))
+    except (TypeError, ValueError):
+        return 2 ** attempt
+
+def call_with_rate_limit(func, *args, limiter=None, **kwargs):
+    """
+    Call a Spotify API function through the rate limiter, honouring 429 Retry-After.
+
+    The client must be built with 429 left out of spotipy's own retry list (see
+    create_spotify_client_with_session): otherwise urllib3 sleeps through Retry-After
+    inside one thread and the limiter never learns the quota was exceeded.
+    """
+    limiter = limiter or spotify_limiter
+    for attempt in range(SPOTIFY_RATE_LIMIT_RETRIES + 1):
+        limiter.acquire()
+        try:
+            return func(*args, **kwargs)
+        except SpotifyException as e:
+            if e.http_status != 429:
+                raise
+            wait = _retry_after(e, attempt)
+            if wait > SPOTIFY_MAX_RETRY_AFTER or attempt == SPOTIFY_RATE_LIMIT_RETRIES:
+                raise RateLimitedError(
+                    f"Spotify rate limit exceeded (Retry-After {wait}s after "
+                    f"{attempt + 1} attempt(s)) - try again later"
+                ) from e
+            logging.warning(f"Spotify returned 429 - pausing all requests for {wait}s")
+            limiter.pause(wait)
+
+def resolve_tracks(items, resolve, on_progress=None, max_workers=None):
+    """
+    Run resolve(*item) for every item on a bounded thread pool.
+
+    Results come back in the order of `items`, whatever order the calls finish in.
+    on_progress(done, total, item) is called after each one completes, from the
+    worker thread that completed it, with `done` counting up without gaps.
+    The first exception from resolve cancels the calls not yet started and is
+    re-raised.
+    """
+    items = list(items)
+    total = len(items)
+    results = [None] * total
+    if not items:
+        return results
+
+    done = 0
+    progress_lock = threading.Lock()
+
+    def run(index):
+        nonlocal done
+        results[index] = resolve(*items[index])
+        if on_progress:
+            with progress_lock:
+                done += 1
+                on_progress(done, total, items[index])
+
+    workers = max(1, min(max_workers or SPOTIFY_SEARCH_CONCURRENCY, total))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='track-search') as pool:
+        futures = [pool.submit(run, index) for index in range(total)]
+        finished, _ = wait(futures, return_when=FIRST_EXCEPTION)
+        failed = next((future for future in finished if future.exception()), None)
+        if failed:
+            # A RateLimitedError means Spotify wants us gone for longer than we will
+            # wait; every search still queued would only hit the same 429 and sleep
+            # the limiter out first. Drop them and let the searches already running
+            # finish before the error goes up.
+            pool.shutdown(cancel_futures=True)
+            raise failed.exception()
+
+    return results